@@ -0,0 +1,3 @@
+#!/usr/bin/env python
+from lsst.pipe.tasks.multiBandPatch import MultiBandPatchTask
+MultiBandPatchTask.parseAndRun()
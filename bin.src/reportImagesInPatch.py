@@ -41,7 +41,8 @@ class ReportImagesInPatchConfig(pexConfig.Config):
         default="deep",
     )
     select = pexConfig.ConfigurableField(
-        doc="image selection subtask",
+        doc="image selection subtask; with WcsSelectImagesTask, set select.footprintIndexFile to "
+            "select from a footprint index written by a coadd run",
         target=WcsSelectImagesTask,
     )
 
@@ -91,13 +92,8 @@ class ReportImagesInPatchTask(pipeBase.CmdLineTask):
         if len(exposureInfoList) < 1:
             return
 
-        fwhmList = [exposureInfo.fwhm for exposureInfo in exposureInfoList]
-        fwhmList = numpy.array(fwhmList, dtype=float)
-        print("FWHM Q1=%0.2f Q2=%0.2f Q3=%0.2f" % (
-            numpy.percentile(fwhmList, 25.0),
-            numpy.percentile(fwhmList, 50.0),
-            numpy.percentile(fwhmList, 75.0),
-        ))
+        fwhmList = [getattr(exposureInfo, "fwhm", numpy.nan) for exposureInfo in exposureInfoList]
+        _printFwhmQuartiles(fwhmList)
 
         print("Image IDs:")
         if len(exposureInfoList) > 0:
@@ -164,5 +160,19 @@ def _getBox2DCorners(bbox):
     )
 
 
+def _printFwhmQuartiles(fwhmList):
+    """Print the quartiles of FWHM, if the select task provides it
+    """
+    fwhmList = numpy.array(fwhmList, dtype=float)
+    fwhmList = fwhmList[numpy.isfinite(fwhmList)]
+    if len(fwhmList) == 0:
+        return
+    print("FWHM Q1=%0.2f Q2=%0.2f Q3=%0.2f" % (
+        numpy.percentile(fwhmList, 25.0),
+        numpy.percentile(fwhmList, 50.0),
+        numpy.percentile(fwhmList, 75.0),
+    ))
+
+
 if __name__ == "__main__":
     ReportImagesInPatchTask.parseAndRun()
@@ -41,7 +41,8 @@ class ReportImagesToCoaddConfig(pexConfig.Config):
         default="deep",
     )
     select = pexConfig.ConfigurableField(
-        doc="image selection subtask",
+        doc="image selection subtask; with WcsSelectImagesTask, set select.footprintIndexFile to "
+            "select from a footprint index written by a coadd run",
         target=WcsSelectImagesTask,
     )
     raDecRange = pexConfig.ListField(
@@ -109,7 +110,7 @@ class ReportImagesToCoaddTask(pipeBase.CmdLineTask):
 
         fwhmList = []
         for exposureInfo in exposureInfoList:
-            fwhmList.append(exposureInfo.fwhm)
+            fwhmList.append(getattr(exposureInfo, "fwhm", numpy.nan))
 
             tractPatchList = skyMap.findTractPatchList(exposureInfo.coordList)
             for tractInfo, patchInfoList in tractPatchList:
@@ -121,12 +122,7 @@ class ReportImagesToCoaddTask(pipeBase.CmdLineTask):
                     else:
                         ccdInfoSet.add(exposureInfo)
 
-        fwhmList = numpy.array(fwhmList, dtype=float)
-        print("FWHM Q1=%0.2f Q2=%0.2f Q3=%0.2f" % (
-            numpy.percentile(fwhmList, 25.0),
-            numpy.percentile(fwhmList, 50.0),
-            numpy.percentile(fwhmList, 75.0),
-        ))
+        _printFwhmQuartiles(fwhmList)
 
         print("\nTract  patchX  patchY  numExp")
         for key in sorted(ccdInfoSetDict.keys()):
@@ -203,5 +199,19 @@ class SkyMapPlusFilterIdContainer(pipeBase.DataIdContainer):
             namespace.id.refList.append(dataRef)
 
 
+def _printFwhmQuartiles(fwhmList):
+    """Print the quartiles of FWHM, if the select task provides it
+    """
+    fwhmList = numpy.array(fwhmList, dtype=float)
+    fwhmList = fwhmList[numpy.isfinite(fwhmList)]
+    if len(fwhmList) == 0:
+        return
+    print("FWHM Q1=%0.2f Q2=%0.2f Q3=%0.2f" % (
+        numpy.percentile(fwhmList, 25.0),
+        numpy.percentile(fwhmList, 50.0),
+        numpy.percentile(fwhmList, 75.0),
+    ))
+
+
 if __name__ == "__main__":
     ReportImagesToCoaddTask.parseAndRun()
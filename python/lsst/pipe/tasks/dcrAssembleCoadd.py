@@ -21,6 +21,7 @@
 #
 
 from math import ceil
+import time
 import numpy as np
 from scipy import ndimage
 import lsst.afw.geom as afwGeom
@@ -128,6 +129,25 @@ class DcrAssembleCoaddConfig(CompareWarpAssembleCoaddConfig):
         default=2,
         doc="Minimum radius of a region to include in regularization, in pixels."
     )
+    doWarmStart = pexConfig.Field(
+        dtype=bool,
+        doc="Seed the model of each subregion with the relative flux in each subfilter of its "
+            "already-solved neighbors, instead of dividing the initial coadd evenly between subfilters.",
+        default=False,
+    )
+    doSkipEmptySubregions = pexConfig.Field(
+        dtype=bool,
+        doc="Skip forward modeling of subregions with negligible signal? "
+            "A subregion is skipped if the fraction of its pixels with any of ``convergenceMaskPlanes`` set"
+            " is not greater than ``minSignalFraction``, or if its initial convergence metric is zero.",
+        default=False,
+    )
+    minSignalFraction = pexConfig.Field(
+        dtype=float,
+        doc="Minimum fraction of pixels with any of ``convergenceMaskPlanes`` set for a subregion to be"
+            " forward modeled, if ``doSkipEmptySubregions`` is set.",
+        default=0.,
+    )
     imageInterpOrder = pexConfig.Field(
         dtype=int,
         doc="The order of the spline interpolation used to shift the image plane.",
@@ -470,20 +490,38 @@ class DcrAssembleCoaddTask(CompareWarpAssembleCoaddTask):
         nSubregions = (ceil(skyInfo.bbox.getHeight()/subregionSize[1]) *
                        ceil(skyInfo.bbox.getWidth()/subregionSize[0]))
         subIter = 0
+        # The relative flux in each subfilter of the subregions that have already been solved,
+        # used to seed the model of their neighbors if ``doWarmStart`` is set.
+        solvedFractions = []
         for subBBox in self._subBBoxIter(skyInfo.bbox, subregionSize):
             modelIter = 0
             subIter += 1
+            startTime = time.time()
             self.log.info("Computing coadd over patch %s subregion %s of %s: %s",
                           skyInfo.patchInfo.getIndex(), subIter, nSubregions, subBBox)
+            if self.config.doSkipEmptySubregions:
+                signalFraction = self.calculateSignalFraction(dcrModels, subBBox)
+                if signalFraction <= self.config.minSignalFraction:
+                    self.log.info("Skipping patch %s subregion %s: only %.4f%% of pixels have signal.",
+                                  skyInfo.patchInfo.getIndex(), subIter, 100.*signalFraction)
+                    self.recordSubregionMetadata(modelIter, startTime, skipped=True)
+                    continue
             dcrBBox = afwGeom.Box2I(subBBox)
             dcrBBox.grow(self.bufferSize)
             dcrBBox.clip(dcrModels.bbox)
+            if self.config.doWarmStart:
+                self.seedSubregionModel(dcrModels, subBBox, solvedFractions)
             modelWeights = self.calculateModelWeights(dcrModels, dcrBBox)
             subExposures = self.loadSubExposures(dcrBBox, stats.ctrl, warpRefList,
                                                  imageScalerList, spanSetMaskList)
             convergenceMetric = self.calculateConvergence(dcrModels, subExposures, subBBox,
                                                           warpRefList, weightList, stats.ctrl)
             self.log.info("Initial convergence : %s", convergenceMetric)
+            if self.config.doSkipEmptySubregions and convergenceMetric == 0:
+                self.log.info("Skipping patch %s subregion %s: initial convergence metric is 0.0.",
+                              skyInfo.patchInfo.getIndex(), subIter)
+                self.recordSubregionMetadata(modelIter, startTime, skipped=True)
+                continue
             convergenceList = [convergenceMetric]
             gainList = []
             convergenceCheck = 1.
@@ -534,6 +572,11 @@ class DcrAssembleCoaddTask(CompareWarpAssembleCoaddTask):
             if self.config.useConvergence and convergenceMetric > 0:
                 self.log.info("Final convergence improvement was %.4f%% overall",
                               100*(convergenceList[0] - convergenceMetric)/convergenceMetric)
+            if self.config.doWarmStart:
+                fractions = self.calculateSubfilterFractions(dcrModels, subBBox)
+                if fractions is not None:
+                    solvedFractions.append((subBBox, fractions))
+            self.recordSubregionMetadata(modelIter, startTime, skipped=False)
 
         dcrCoadds = self.fillCoadd(dcrModels, skyInfo, warpRefList, weightList,
                                    calibration=self.scaleZeroPoint.getPhotoCalib(),
@@ -1019,6 +1062,103 @@ class DcrAssembleCoaddTask(CompareWarpAssembleCoaddTask):
         weights /= np.max(weights)
         return weights
 
+    def calculateSignalFraction(self, dcrModels, bbox):
+        """Calculate the fraction of pixels in a subregion that contain signal.
+
+        Parameters
+        ----------
+        dcrModels : `lsst.pipe.tasks.DcrModel`
+            Best fit model of the true sky after correcting chromatic effects.
+        bbox : `lsst.afw.geom.box.Box2I`
+            Sub-region of the coadd to evaluate.
+
+        Returns
+        -------
+        signalFraction : `float`
+            Fraction of the pixels in ``bbox`` with any of
+            ``convergenceMaskPlanes`` set.
+        """
+        convergeMask = dcrModels.mask.getPlaneBitMask(self.config.convergenceMaskPlanes)
+        convergeMaskPixels = dcrModels.mask[bbox].array & convergeMask > 0
+        if convergeMaskPixels.size == 0:
+            return 0.
+        return np.count_nonzero(convergeMaskPixels)/convergeMaskPixels.size
+
+    def calculateSubfilterFractions(self, dcrModels, bbox):
+        """Calculate the relative flux in each subfilter of a solved subregion.
+
+        Parameters
+        ----------
+        dcrModels : `lsst.pipe.tasks.DcrModel`
+            Best fit model of the true sky after correcting chromatic effects.
+        bbox : `lsst.afw.geom.box.Box2I`
+            Sub-region of the coadd to evaluate.
+
+        Returns
+        -------
+        fractions : `numpy.ndarray` or `None`
+            The fraction of the flux of the pixels with any of
+            ``convergenceMaskPlanes`` set that falls in each subfilter.
+            `None` if there is no positive flux in every subfilter.
+        """
+        convergeMask = dcrModels.mask.getPlaneBitMask(self.config.convergenceMaskPlanes)
+        convergeMaskPixels = dcrModels.mask[bbox].array & convergeMask > 0
+        if not np.any(convergeMaskPixels):
+            return None
+        fluxes = np.array([np.sum(model[bbox].array[convergeMaskPixels]) for model in dcrModels])
+        if not np.all(np.isfinite(fluxes)) or np.any(fluxes <= 0):
+            return None
+        return fluxes/np.sum(fluxes)
+
+    def seedSubregionModel(self, dcrModels, bbox, solvedFractions):
+        """Seed the model of a subregion from its already-solved neighbors.
+
+        The pixels of the subregion with any of ``convergenceMaskPlanes`` set
+        are divided between the subfilters in the average proportion of the
+        neighboring subregions, instead of evenly.
+        The total flux summed over all subfilters is unchanged.
+
+        Parameters
+        ----------
+        dcrModels : `lsst.pipe.tasks.DcrModel`
+            Best fit model of the true sky after correcting chromatic effects.
+            The values within ``bbox`` will be modified in place.
+        bbox : `lsst.afw.geom.box.Box2I`
+            Sub-region of the coadd to seed.
+        solvedFractions : `list` of `tuple`
+            The bounding box and relative flux in each subfilter of each of the
+            subregions that have already been solved, as returned by
+            ``calculateSubfilterFractions``.
+        """
+        neighborBBox = afwGeom.Box2I(bbox)
+        neighborBBox.grow(1)
+        neighborFractions = [fractions for solvedBBox, fractions in solvedFractions
+                             if solvedBBox.overlaps(neighborBBox)]
+        if not neighborFractions:
+            return
+        fractions = np.mean(neighborFractions, axis=0)
+        convergeMask = dcrModels.mask.getPlaneBitMask(self.config.convergenceMaskPlanes)
+        convergeMaskPixels = dcrModels.mask[bbox].array & convergeMask > 0
+        totalFlux = np.sum([model[bbox].array[convergeMaskPixels] for model in dcrModels], axis=0)
+        for model, fraction in zip(dcrModels, fractions):
+            model[bbox].array[convergeMaskPixels] = totalFlux*fraction
+
+    def recordSubregionMetadata(self, numIter, startTime, skipped):
+        """Record the number of iterations and time spent on a subregion.
+
+        Parameters
+        ----------
+        numIter : `int`
+            The number of iterations of forward modeling.
+        startTime : `float`
+            The time that processing of the subregion began, from `time.time`.
+        skipped : `bool`
+            Was forward modeling of the subregion skipped?
+        """
+        self.metadata.add("subregionNumIter", numIter)
+        self.metadata.add("subregionDuration", time.time() - startTime)
+        self.metadata.add("subregionSkipped", skipped)
+
     def applyModelWeights(self, modelImages, refImage, modelWeights):
         """Smoothly replace model pixel values with those from a
         reference at locations away from detected sources.
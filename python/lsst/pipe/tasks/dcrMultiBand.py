@@ -163,7 +163,9 @@ class DeblendDcrCoaddSourcesTask(DeblendCoaddSourcesTask):
                                datasetType="dcrCoadd_calexp",
                                help="data ID, e.g. --id tract=12345 patch=1,2 filter=g, subfilter=0",
                                ContainerClass=ExistingCoaddDataIdContainer)
-        parser.add_argument("--psfCache", type=int, default=100, help="Size of CoaddPsf cache")
+        parser.add_argument("--psfCache", type=int, default=None,
+                            help="Size of CoaddPsf cache; if not set, the cache is sized to the number "
+                                 "of merged detections in each patch, up to config.maxPsfCache")
         return parser
 
 
@@ -19,18 +19,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import fcntl
+import hashlib
+import multiprocessing
 import os
 import shutil
 import tempfile
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
 from glob import glob
 from contextlib import contextmanager
 
-from lsst.pex.config import Config, Field, DictField, ListField, ConfigurableField
+from lsst.pex.config import Config, Field, RangeField, DictField, ListField, ConfigurableField
 import lsst.pex.exceptions
-from lsst.afw.fits import readMetadata
-from lsst.pipe.base import Task, InputOnlyArgumentParser
+from lsst.afw.fits import Fits, readMetadata
+from lsst.pipe.base import Task, Struct, InputOnlyArgumentParser
 from lsst.afw.fits import DEFAULT_HDU
 
 
@@ -41,8 +45,8 @@ class IngestArgumentParser(InputOnlyArgumentParser):
         super(IngestArgumentParser, self).__init__(*args, **kwargs)
         self.add_argument("-n", "--dry-run", dest="dryrun", action="store_true", default=False,
                           help="Don't perform any action?")
-        self.add_argument("--mode", choices=["move", "copy", "link", "skip"], default="link",
-                          help="Mode of delivering the files to their destination")
+        self.add_argument("--mode", choices=["move", "copy", "link", "hardlink", "reflink", "skip"],
+                          default="link", help="Mode of delivering the files to their destination")
         self.add_argument("--create", action="store_true", help="Create new registry (clobber old)?")
         self.add_argument("--ignore-ingested", dest="ignoreIngested", action="store_true",
                           help="Don't register files that have already been registered")
@@ -75,10 +79,15 @@ class ParseTask(Task):
         Here, we open the image and parse the header, but one could also look at the filename itself
         and derive information from that, or set values from the configuration.
 
+        The file is opened once, and the headers of the extensions are read in a single
+        sequential pass that stops as soon as all of config.extnames have been found.
+
         @param filename    Name of file to inspect
         @return File properties; list of file properties for each extension
         """
-        md = readMetadata(filename, self.config.hdu)
+        fitsFile = Fits(filename, "r")  # Closed when it goes out of scope
+        fitsFile.setHdu(self.config.hdu)
+        md = readMetadata(fitsFile)
         phuInfo = self.getInfoFromMetadata(md)
         if len(self.config.extnames) == 0:
             # No extensions to worry about
@@ -90,7 +99,8 @@ class ParseTask(Task):
         while len(extnames) > 0:
             extnum += 1
             try:
-                md = readMetadata(filename, extnum)
+                fitsFile.setHdu(extnum)
+                md = readMetadata(fitsFile)
             except Exception as e:
                 self.log.warn("Error reading %s extensions %s: %s" % (filename, extnames, e))
                 break
@@ -213,7 +223,16 @@ class RegisterConfig(Config):
     visit = ListField(dtype=str, default=["visit", "object", "date", "filter"],
                       doc="List of columns for raw_visit table")
     ignore = Field(dtype=bool, default=False, doc="Ignore duplicates in the table?")
+    batchSize = RangeField(dtype=int, default=0, min=0,
+                           doc="Number of rows to buffer before writing them to the registry in a single "
+                           "executemany, checking for duplicates against the unique columns read from the "
+                           "registry once; 0 to write each row as it is added.")
     permissions = Field(dtype=int, default=0o664, doc="Permissions mode for registry; 0o664 = rw-rw-r--")
+    manifestTable = Field(dtype=str, default="",
+                          doc="Name of table recording the path, size, modification time and (once it has "
+                          "been needed) content hash of each ingested file, so that unchanged files are "
+                          "skipped without being opened when re-ingesting with --ignore-ingested; empty "
+                          "to disable.")
 
 
 class RegistryContext:
@@ -252,6 +271,15 @@ class RegistryContext:
         """Provide the 'as' value"""
         return self.conn
 
+    def connect(self):
+        """Open an additional connection to the registry being updated
+
+        This is used by worker processes to check for files that are already
+        registered; they only read from the registry, and do not see rows added
+        (but not yet committed) through the main connection.
+        """
+        return sqlite3.connect(self.updateName)
+
     def __exit__(self, excType, excValue, traceback):
         self.conn.commit()
         self.conn.close()
@@ -279,6 +307,14 @@ class RegisterTask(Task):
     placeHolder = '?'  # Placeholder for parameter substitution; this value suitable for sqlite3
     typemap = {'text': str, 'int': int, 'double': float}  # Mapping database type --> python type
 
+    def __init__(self, *args, **kwargs):
+        super(RegisterTask, self).__init__(*args, **kwargs)
+        self._bulkConn = None  # Connection for which the following are valid
+        self._uniqueKeys = {}  # Unique column values in each table, when config.batchSize > 0
+        self._pendingRows = {}  # Rows waiting to be written to each table, when config.batchSize > 0
+        self._manifest = None  # Contents of the ingest manifest, read on demand
+        self._addedVisits = {}  # Values of the visit columns of the rows added to config.table
+
     def openRegistry(self, directory, create=False, dryrun=False, name="registry.sqlite3"):
         """Open the registry and return the connection handle.
 
@@ -301,6 +337,8 @@ class RegisterTask(Task):
         One table (typically 'raw') contains information on all files, and the
         other (typically 'raw_visit') contains information on all visits.
 
+        Indexes are added to existing tables that were created without them.
+
         @param conn    Database connection
         @param table   Name of table to create in database
         """
@@ -311,12 +349,16 @@ class RegisterTask(Task):
         cursor.execute(cmd)
         if cursor.fetchone() and not forceCreateTables:  # Assume if we get an answer the table exists
             self.log.info('Table "%s" exists.  Skipping creation' % table)
+            self.createIndexes(conn, table)
             return
         else:
             cmd = "drop table if exists %s" % table
             cursor.execute(cmd)
             cmd = "drop table if exists %s_visit" % table
             cursor.execute(cmd)
+            if self.config.manifestTable:
+                cmd = "drop table if exists %s" % self.config.manifestTable
+                cursor.execute(cmd)
 
         cmd = "create table %s (id integer primary key autoincrement, " % table
         cmd += ",".join([("%s %s" % (col, colType)) for col, colType in self.config.columns.items()])
@@ -332,6 +374,25 @@ class RegisterTask(Task):
         cursor.execute(cmd)
 
         conn.commit()
+        self.createIndexes(conn, table)
+
+    def createIndexes(self, conn, table=None):
+        """Create the indexes for the registry tables, if they do not exist
+
+        The file table (typically 'raw') gets a covering index on the visit
+        columns, used to list the visits; its unique columns are already indexed
+        through the unique constraint.
+
+        @param conn    Database connection
+        @param table   Name of table in database
+        """
+        if table is None:
+            table = self.config.table
+        cursor = conn.cursor()
+        cmd = "create index if not exists %s_visit_index on %s " % (table, table)
+        cmd += "(" + ",".join(self.config.visit) + ")"
+        cursor.execute(cmd)
+        conn.commit()
 
     def check(self, conn, info, table=None):
         """Check for the presence of a row already
@@ -342,6 +403,8 @@ class RegisterTask(Task):
             table = self.config.table
         if self.config.ignore or len(self.config.unique) == 0:
             return False  # Our entry could already be there, but we don't care
+        if self.config.batchSize > 0:
+            return self.getUniqueKey(info) in self.getUniqueKeys(conn, table)
         cursor = conn.cursor()
         sql = "SELECT COUNT(*) FROM %s WHERE " % table
         sql += " AND ".join(["%s = %s" % (col, self.placeHolder) for col in self.config.unique])
@@ -361,9 +424,16 @@ class RegisterTask(Task):
         """
         if table is None:
             table = self.config.table
+        values = [self.typemap[tt](info[col]) for col, tt in self.config.columns.items()]
+        if table == self.config.table and not dryrun:
+            self._resetBulk(conn)
+            visit = tuple(self.typemap[self.config.columns[col]](info[col]) for col in self.config.visit)
+            self._addedVisits[visit] = None  # dict rather than set, to preserve the ingest order
+        if self.config.batchSize > 0 and not dryrun:
+            self.bufferRow(conn, info, values, table)
+            return
         sql = "INSERT INTO %s (%s) SELECT " % (table, ",".join(self.config.columns))
         sql += ",".join([self.placeHolder] * len(self.config.columns))
-        values = [self.typemap[tt](info[col]) for col, tt in self.config.columns.items()]
 
         if self.config.ignore:
             sql += " WHERE NOT EXISTS (SELECT 1 FROM %s WHERE " % table
@@ -376,15 +446,169 @@ class RegisterTask(Task):
         else:
             conn.cursor().execute(sql, values)
 
+    def getUniqueKey(self, info):
+        """Return the values of the unique columns for a row
+
+        @param info    File properties
+        @return tuple of values, converted to the column types
+        """
+        return tuple(self.typemap[self.config.columns[col]](info[col]) for col in self.config.unique)
+
+    def _resetBulk(self, conn):
+        """Forget the buffered rows and unique keys if they belong to another connection"""
+        if conn is not self._bulkConn:
+            self._bulkConn = conn
+            self._uniqueKeys = {}
+            self._pendingRows = {}
+            self._manifest = None
+            self._addedVisits = {}
+
+    def getUniqueKeys(self, conn, table):
+        """Return the set of unique column values of the rows in a table
+
+        The set is read from the registry once for each connection and table,
+        and then kept up to date by bufferRow.
+
+        @param conn    Database connection
+        @param table   Name of table in database
+        @return set of tuples of values of the unique columns
+        """
+        self._resetBulk(conn)
+        if table not in self._uniqueKeys:
+            cursor = conn.cursor()
+            cursor.execute("SELECT %s FROM %s" % (",".join(self.config.unique), table))
+            types = [self.typemap[self.config.columns[col]] for col in self.config.unique]
+            self._uniqueKeys[table] = set(tuple(tt(value) if value is not None else None
+                                                for tt, value in zip(types, row))
+                                          for row in cursor.fetchall())
+        return self._uniqueKeys[table]
+
+    def bufferRow(self, conn, info, values, table):
+        """Buffer a row for the file table, to be written by flushRows
+
+        Rows whose unique columns are already present in the table (or the
+        buffer) are dropped if config.ignore is set; otherwise they are left for
+        the database to reject. The buffer is written once it holds
+        config.batchSize rows.
+
+        @param conn    Database connection
+        @param info    File properties to add to database
+        @param values  Values of the columns, in the order of config.columns
+        @param table   Name of table in database
+        """
+        if len(self.config.unique) > 0:
+            uniqueKeys = self.getUniqueKeys(conn, table)
+            key = self.getUniqueKey(info)
+            if self.config.ignore and key in uniqueKeys:
+                return
+            uniqueKeys.add(key)
+        else:
+            self._resetBulk(conn)
+        rows = self._pendingRows.setdefault(table, [])
+        rows.append(values)
+        if len(rows) >= self.config.batchSize:
+            self.flushRows(conn, table)
+
+    def flushRows(self, conn, table=None):
+        """Write the rows buffered by bufferRow to the registry
+
+        @param conn    Database connection
+        @param table   Name of table in database, or None for all tables
+        """
+        if conn is not self._bulkConn:
+            return
+        tables = list(self._pendingRows) if table is None else [table]
+        for tt in tables:
+            rows = self._pendingRows.pop(tt, None)
+            if not rows:
+                continue
+            sql = "INSERT INTO %s (%s) VALUES (" % (tt, ",".join(self.config.columns))
+            sql += ",".join([self.placeHolder] * len(self.config.columns)) + ")"
+            conn.cursor().executemany(sql, rows)
+            self.log.debug("Wrote %d rows to %s", len(rows), tt)
+
+    def createManifestTable(self, conn):
+        """Create the ingest manifest table (config.manifestTable), if it does not exist
+
+        @param conn    Database connection
+        """
+        cursor = conn.cursor()
+        cmd = "create table if not exists %s " % self.config.manifestTable
+        cmd += "(path text primary key, size bigint, mtime double precision, hash text)"
+        cursor.execute(cmd)
+        conn.commit()
+
+    def getManifest(self, conn):
+        """Return the contents of the ingest manifest
+
+        The manifest is read once for each connection, and then kept up to date
+        by addManifestEntry.
+
+        @param conn    Database connection
+        @return dict mapping absolute path --> (size, mtime, hash)
+        """
+        self._resetBulk(conn)
+        if self._manifest is None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT path, size, mtime, hash FROM %s" % self.config.manifestTable)
+            self._manifest = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        return self._manifest
+
+    def addManifestEntry(self, conn, entry):
+        """Record an ingested file in the ingest manifest
+
+        @param conn    Database connection
+        @param entry   Tuple of (absolute path, size, mtime, hash)
+        """
+        cursor = conn.cursor()
+        sql = "DELETE FROM %s WHERE path=%s" % (self.config.manifestTable, self.placeHolder)
+        cursor.execute(sql, (entry[0],))
+        sql = "INSERT INTO %s (path, size, mtime, hash) VALUES (" % self.config.manifestTable
+        sql += ",".join([self.placeHolder] * 4) + ")"
+        cursor.execute(sql, entry)
+        if conn is self._bulkConn and self._manifest is not None:
+            self._manifest[entry[0]] = tuple(entry[1:])
+
     def addVisits(self, conn, dryrun=False, table=None):
         """Generate the visits table (typically 'raw_visits') from the
         file table (typically 'raw').
 
+        For config.table, only the visits of the rows added through addRow since
+        the registry was opened are considered; those not already in the visits
+        table are added with a single executemany. Other tables are scanned in full.
+
+        @param conn    Database connection
+        @param table   Name of table in database
+        """
+        if table is None:
+            table = self.config.table
+        if table != self.config.table:
+            self.addAllVisits(conn, dryrun=dryrun, table=table)
+            return
+        sql = "INSERT INTO %s_visit (%s) SELECT " % (table, ",".join(self.config.visit))
+        sql += ",".join([self.placeHolder] * len(self.config.visit))
+        sql += " WHERE NOT EXISTS (SELECT 1 FROM %s_visit WHERE visit = %s)" % (table, self.placeHolder)
+        if dryrun:
+            print("Would execute: %s for each new visit" % sql)
+            return
+        self.flushRows(conn, table)
+        if conn is not self._bulkConn:
+            return  # No rows have been added
+        iVisit = self.config.visit.index("visit")
+        conn.cursor().executemany(sql, [visit + (visit[iVisit],) for visit in self._addedVisits])
+        self._addedVisits = {}
+
+    def addAllVisits(self, conn, dryrun=False, table=None):
+        """Add the visits of all rows of the file table (typically 'raw')
+        that are missing from the visits table (typically 'raw_visits').
+
         @param conn    Database connection
         @param table   Name of table in database
         """
         if table is None:
             table = self.config.table
+        if not dryrun:
+            self.flushRows(conn, table)
         sql = "INSERT INTO %s_visit SELECT DISTINCT " % table
         sql += ",".join(self.config.visit)
         sql += " FROM %s AS vv1" % table
@@ -402,6 +626,15 @@ class IngestConfig(Config):
     register = ConfigurableField(target=RegisterTask, doc="Registry entry")
     allowError = Field(dtype=bool, default=False, doc="Allow error in ingestion?")
     clobber = Field(dtype=bool, default=False, doc="Clobber existing file?")
+    numProcesses = RangeField(dtype=int, default=1, min=1,
+                              doc="Number of processes used to parse and transfer the files; "
+                              "the registry is always written by the main process.")
+    numTransferThreads = RangeField(dtype=int, default=1, min=1,
+                                    doc="Number of files transferred concurrently, in batches of "
+                                    "transferBatchSize, when numProcesses is 1.")
+    transferBatchSize = RangeField(dtype=int, default=100, min=1,
+                                   doc="Number of files parsed before being transferred together, "
+                                   "when numTransferThreads > 1; the free space is checked once per batch.")
 
 
 class IngestTask(Task):
@@ -424,13 +657,19 @@ class IngestTask(Task):
         task = cls(config=args.config)
         task.run(args)
 
-    def ingest(self, infile, outfile, mode="move", dryrun=False):
+    def ingest(self, infile, outfile, mode="move", dryrun=False, checkSpace=True):
         """Ingest a file into the image repository.
 
+        The "hardlink" mode creates a hard link, and the "reflink" mode a copy that
+        shares the data blocks of the input where the filesystem supports it (see
+        cloneFile); neither moves the data if the input and the repository are on
+        the same filesystem.
+
         @param infile  Name of input file
         @param outfile Name of output file (file in repository)
-        @param mode    Mode of ingest (copy/link/move/skip)
+        @param mode    Mode of ingest (copy/link/hardlink/reflink/move/skip)
         @param dryrun  Only report what would occur?
+        @param checkSpace  Check for sufficient space before copying or moving the file?
         @param Success boolean
         """
         if mode == "skip":
@@ -454,12 +693,18 @@ class IngestTask(Task):
                     raise RuntimeError("File %s already exists; consider --config clobber=True" % outfile)
 
             if mode == "copy":
-                assertCanCopy(infile, outfile)
+                if checkSpace:
+                    assertCanCopy(infile, outfile)
                 shutil.copyfile(infile, outfile)
             elif mode == "link":
                 os.symlink(os.path.abspath(infile), outfile)
+            elif mode == "hardlink":
+                os.link(infile, outfile)
+            elif mode == "reflink":
+                cloneFile(infile, outfile)
             elif mode == "move":
-                assertCanCopy(infile, outfile)
+                if checkSpace:
+                    assertCanCopy(infile, outfile)
                 shutil.move(infile, outfile)
             else:
                 raise AssertionError("Unknown mode: %s" % mode)
@@ -515,12 +760,55 @@ class IngestTask(Task):
 
         return filenameList
 
+    def checkManifest(self, infile, registry):
+        """!Compare a file with its record in the ingest manifest
+
+        The file is unchanged if its size and modification time match the record.
+        The content hash is only computed if the size matches but the modification
+        time does not; the file is then also unchanged if the hash matches the
+        recorded one (a record without a hash never matches). Files that are new or
+        have changed size are recorded without a hash, so they are not read in full
+        here.
+
+        @param infile: File to check
+        @param registry: Database connection
+        @return (whether the file is unchanged since it was ingested,
+                 manifest entry to record for the file or None if the record is current)
+        """
+        stat = os.stat(infile)
+        path = os.path.abspath(infile)
+        record = self.register.getManifest(registry).get(path)
+        if record is None or record[0] != stat.st_size:
+            return False, (path, stat.st_size, stat.st_mtime, None)
+        if record[1] == stat.st_mtime:
+            return True, None
+        digest = hashFile(infile)
+        return record[2] == digest, (path, stat.st_size, stat.st_mtime, digest)
+
     def runFile(self, infile, registry, args):
         """!Examine and ingest a single file
 
         @param infile: File to process
         @param args: Parsed command-line arguments
-        @return parsed information from FITS HDUs or None
+        @return parsed information from FITS HDUs (empty if the file is already registered) or None
+        """
+        prepared = self.prepareFile(infile, registry, args)
+        if prepared is None:
+            return None
+        outfile, hduInfoList = prepared
+        if outfile is None:
+            return hduInfoList
+        if not self.ingest(infile, outfile, mode=args.mode, dryrun=args.dryrun):
+            return None
+        return hduInfoList
+
+    def prepareFile(self, infile, registry, args):
+        """!Examine a single file and determine its destination
+
+        @param infile: File to process
+        @param args: Parsed command-line arguments
+        @return (destination filename, parsed information from FITS HDUs); (None, []) if the file is
+            already registered and args.ignoreIngested is set; or None to skip the file
         """
         if self.isBadFile(infile, args.badFile):
             self.log.info("Skipping declared bad file %s" % infile)
@@ -537,12 +825,144 @@ class IngestTask(Task):
             return
         if registry is not None and self.register.check(registry, fileInfo):
             if args.ignoreIngested:
-                return None
+                # Not an error: the file is still recorded in the ingest manifest, if any
+                return None, []
             self.log.warn("%s: already ingested: %s" % (infile, fileInfo))
         outfile = self.parse.getDestination(args.butler, fileInfo, infile)
-        if not self.ingest(infile, outfile, mode=args.mode, dryrun=args.dryrun):
-            return None
-        return hduInfoList
+        return outfile, hduInfoList
+
+    def runFiles(self, filenameList, context, registry, args):
+        """!Examine and ingest a list of files
+
+        If config.numProcesses > 1, the files are parsed and transferred by a pool of
+        forked processes (each with its own connection to the registry, for checking
+        whether a file is already registered), and their results are streamed back in
+        the order of the input list. The registry is committed before the processes
+        are forked, so that they do not inherit an open transaction. Errors are
+        logged and the file is skipped, as for serial processing. Otherwise, if
+        config.numTransferThreads > 1, the files are parsed serially and transferred
+        concurrently (see _runFilesBatched).
+
+        @param filenameList: Files to process
+        @param context: Registry context, from self.register.openRegistry
+        @param registry: Database connection provided by the context, or None
+        @param args: Parsed command-line arguments
+        @return generator of (filename, parsed information from FITS HDUs or None,
+                              ingest manifest entry to record or None)
+        """
+        numProcesses = min(self.config.numProcesses, len(filenameList))
+        if numProcesses <= 1 and self.config.numTransferThreads > 1 and args.mode != "skip" and \
+                not args.dryrun:
+            yield from self._runFilesBatched(filenameList, registry, args)
+            return
+        if numProcesses <= 1:
+            for infile in filenameList:
+                yield (infile,) + self._runFileOrWarn(infile, registry, args)
+            return
+
+        self.log.info("Ingesting %d files with %d processes", len(filenameList), numProcesses)
+        connect = context.connect if registry is not None and isinstance(context, RegistryContext) else None
+        if registry is not None:
+            registry.commit()
+        state = Struct(task=self, args=args, connect=connect)
+        mpContext = multiprocessing.get_context("fork")
+        with mpContext.Pool(numProcesses, initializer=_initIngestWorker, initargs=(state,)) as pool:
+            for result in pool.imap(_ingestFile, filenameList):
+                yield result
+
+    def _runFilesBatched(self, filenameList, registry, args):
+        """!Examine files serially, and transfer them concurrently
+
+        The files are processed in batches of config.transferBatchSize: the files of
+        a batch are examined with prepareFile, the free space needed to copy or move
+        them is checked at once, and they are transferred by a pool of
+        config.numTransferThreads threads.
+
+        @return generator of (filename, parsed information from FITS HDUs or None,
+                              ingest manifest entry to record or None)
+        """
+        batchSize = self.config.transferBatchSize
+        with ThreadPoolExecutor(self.config.numTransferThreads) as executor:
+            for start in range(0, len(filenameList), batchSize):
+                batch = [(infile,) + self._prepareFileOrWarn(infile, registry, args) for
+                         infile in filenameList[start:start + batchSize]]
+                transfers = [(infile, outfile) for infile, outfile, _, _ in batch if outfile is not None]
+                try:
+                    if args.mode in ("copy", "move"):
+                        assertCanCopyFiles(transfers)
+                    success = iter(list(executor.map(lambda pair: self._ingestOrWarn(pair[0], pair[1], args),
+                                                     transfers)))
+                except Exception as exc:
+                    self.log.warn("Failed to ingest %d files: %s", len(transfers), exc)
+                    success = iter([False]*len(transfers))
+                for infile, outfile, hduInfoList, entry in batch:
+                    if outfile is None:
+                        yield infile, None, entry
+                    elif next(success):
+                        yield infile, hduInfoList, entry
+                    else:
+                        yield infile, None, None
+
+    def _checkUnchanged(self, infile, registry, args):
+        """Check a file against the ingest manifest (register.config.manifestTable), if any
+
+        Files that are unchanged since they were ingested are skipped without
+        being opened when args.ignoreIngested is set.
+
+        @return (whether to skip the file, ingest manifest entry to record or None)
+        """
+        if registry is None or not self.register.config.manifestTable:
+            return False, None
+        unchanged, entry = self.checkManifest(infile, registry)
+        if unchanged and args.ignoreIngested:
+            self.log.info("Skipping unchanged file %s", infile)
+            return True, entry
+        return False, entry
+
+    def _runFileOrWarn(self, infile, registry, args):
+        """Examine and ingest a single file, logging any failure
+
+        @return (parsed information from FITS HDUs or None, ingest manifest entry to record or None)
+        """
+        try:
+            skip, entry = self._checkUnchanged(infile, registry, args)
+            if skip:
+                return None, entry
+            hduInfoList = self.runFile(infile, registry, args)
+            return hduInfoList, (entry if hduInfoList is not None else None)
+        except Exception as exc:
+            self.log.warn("Failed to ingest file %s: %s", infile, exc)
+            return None, None
+
+    def _prepareFileOrWarn(self, infile, registry, args):
+        """Examine a single file, logging any failure
+
+        @return (destination filename or None if the file is not to be transferred,
+                 parsed information from FITS HDUs or None, ingest manifest entry to record or None)
+        """
+        try:
+            skip, entry = self._checkUnchanged(infile, registry, args)
+            if skip:
+                return None, None, entry
+            prepared = self.prepareFile(infile, registry, args)
+            if prepared is None:
+                return None, None, None
+            outfile, hduInfoList = prepared
+            return outfile, hduInfoList, entry
+        except Exception as exc:
+            self.log.warn("Failed to ingest file %s: %s", infile, exc)
+            return None, None, None
+
+    def _ingestOrWarn(self, infile, outfile, args):
+        """Transfer a single file whose destination has been checked for space, logging any failure
+
+        @return Success boolean
+        """
+        try:
+            return self.ingest(infile, outfile, mode=args.mode, dryrun=args.dryrun, checkSpace=False)
+        except Exception as exc:
+            self.log.warn("Failed to ingest file %s: %s", infile, exc)
+            return False
 
     def run(self, args):
         """Ingest all specified files and add them to the registry"""
@@ -550,19 +970,114 @@ class IngestTask(Task):
         root = args.input
         context = self.register.openRegistry(root, create=args.create, dryrun=args.dryrun)
         with context as registry:
-            for infile in filenameList:
-                try:
-                    hduInfoList = self.runFile(infile, registry, args)
-                except Exception as exc:
-                    self.log.warn("Failed to ingest file %s: %s", infile, exc)
-                    continue
-                if hduInfoList is None:
-                    continue
-                for info in hduInfoList:
+            if registry is not None and self.register.config.manifestTable:
+                self.register.createManifestTable(registry)
+            for infile, hduInfoList, manifestEntry in self.runFiles(filenameList, context, registry, args):
+                for info in hduInfoList or []:
                     self.register.addRow(registry, info, dryrun=args.dryrun, create=args.create)
+                if manifestEntry is not None:
+                    self.register.addManifestEntry(registry, manifestEntry)
             self.register.addVisits(registry, dryrun=args.dryrun)
 
 
+_ingestWorkerState = None
+
+
+def _initIngestWorker(state):
+    """Initialize a forked worker process for parallel ingestion
+
+    @param state: Struct with the IngestTask, the parsed command-line arguments and
+                  a function to connect to the registry (or None)
+    """
+    global _ingestWorkerState
+    registry = state.connect() if state.connect is not None else None
+    _ingestWorkerState = Struct(task=state.task, args=state.args, registry=registry)
+
+
+def _ingestFile(infile):
+    """Parse and transfer a single file in a worker process
+
+    @param infile: File to process
+    @return (infile, parsed information from FITS HDUs or None, ingest manifest entry or None)
+    """
+    state = _ingestWorkerState
+    return (infile,) + state.task._runFileOrWarn(infile, state.registry, state.args)
+
+
+def hashFile(filename, blockSize=1 << 20):
+    """Compute the SHA-1 hash of the contents of a file
+
+    @param filename    Name of file
+    @param blockSize   Number of bytes to read at a time
+    @return hexadecimal digest
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as fd:
+        for block in iter(lambda: fd.read(blockSize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+FICLONE = 0x40049409  # Linux ioctl to clone (reflink) a file
+
+
+def cloneFile(fromPath, toPath):
+    """Copy a file without copying its data, where possible
+
+    Tries, in order: a reflink (the FICLONE ioctl, supported by e.g. btrfs and XFS),
+    which shares the data blocks between the two files; os.copy_file_range, which
+    copies within the kernel (and may be offloaded to the server by network
+    filesystems); and a normal copy.
+
+    @param fromPath    Path of the file to copy
+    @param toPath      Path of the copy
+    """
+    with open(fromPath, "rb") as src, open(toPath, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+        if hasattr(os, "copy_file_range"):
+            remaining = os.fstat(src.fileno()).st_size
+            try:
+                while remaining > 0:
+                    num = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if num == 0:
+                        break
+                    remaining -= num
+            except OSError:
+                pass
+            if remaining == 0:
+                return
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+        shutil.copyfileobj(src, dst)
+
+
+def assertCanCopyFiles(pathPairs):
+    """Can I copy a set of files?  Raise an exception if space constraints not met.
+
+    The sizes of the files are added up for each destination filesystem, so that
+    each filesystem is only checked once.
+
+    @param pathPairs   List of (fromPath, toPath)
+    """
+    required = {}  # device --> [bytes required, directory on device]
+    for fromPath, toPath in pathPairs:
+        dirName = os.path.dirname(os.path.abspath(toPath))
+        while not os.path.isdir(dirName):  # The destination directory may not have been created yet
+            dirName = os.path.dirname(dirName)
+        entry = required.setdefault(os.stat(dirName).st_dev, [0, dirName])
+        entry[0] += os.stat(fromPath).st_size
+    for req, dirName in required.values():
+        st = os.statvfs(dirName)
+        avail = st.f_bavail * st.f_frsize
+        if avail < req:
+            raise RuntimeError("Insufficient space in %s: %d vs %d" % (dirName, req, avail))
+
+
 def assertCanCopy(fromPath, toPath):
     """Can I copy a file?  Raise an exception is space constraints not met.
 
@@ -79,12 +79,25 @@ class CalibsRegisterConfig(RegisterConfig):
                                         doc="Tables for which to set validity for a calib from when it is "
                                         "taken until it is superseded by the next; validity in other tables "
                                         "is calculated by applying the validity range.")
+    incrementalValidity = Field(dtype=bool, default=False,
+                                doc="Only update the validity ranges of the detectors with calibrations "
+                                "added since the registry was opened, rather than of all detectors?")
 
 
 class CalibsRegisterTask(RegisterTask):
     """Task that will generate the calibration registry for the Mapper"""
     ConfigClass = CalibsRegisterConfig
 
+    def __init__(self, *args, **kwargs):
+        super(CalibsRegisterTask, self).__init__(*args, **kwargs)
+        self._addedDetectors = {}  # Detectors with calibrations added to each table
+
+    def _resetBulk(self, conn):
+        """Forget the added detectors if they belong to another connection"""
+        if conn is not self._bulkConn:
+            self._addedDetectors = {}
+        RegisterTask._resetBulk(self, conn)
+
     def openRegistry(self, directory, create=False, dryrun=False, name="calibRegistry.sqlite3"):
         """Open the registry and return the connection handle"""
         return RegisterTask.openRegistry(self, directory, create, dryrun, name)
@@ -94,29 +107,95 @@ class CalibsRegisterTask(RegisterTask):
         for table in self.config.tables:
             RegisterTask.createTable(self, conn, table=table, forceCreateTables=forceCreateTables)
 
+    def createIndexes(self, conn, table=None):
+        """Create an index on the detector and calibration date columns of a table, if it does not exist
+
+        These are the columns used to look up calibrations and to update their
+        validity ranges.
+        """
+        if table is None:
+            table = self.config.table
+        cmd = "create index if not exists %s_detector_index on %s " % (table, table)
+        cmd += "(" + ",".join(self.config.detector + [self.config.calibDate]) + ")"
+        conn.cursor().execute(cmd)
+        conn.commit()
+
     def addRow(self, conn, info, *args, **kwargs):
         """Add a row to the file table"""
         info[self.config.validStart] = None
         info[self.config.validEnd] = None
         RegisterTask.addRow(self, conn, info, *args, **kwargs)
+        if not kwargs.get("dryrun", False):
+            table = kwargs.get("table") or self.config.table
+            self._resetBulk(conn)
+            detectorData = tuple(self.typemap[self.config.columns[col]](info[col]) for
+                                 col in self.config.detector)
+            self._addedDetectors.setdefault(table, set()).add(detectorData)
 
     def updateValidityRanges(self, conn, validity, tables=None):
         """Loop over all tables, filters, and ccdnums,
         and update the validity ranges in the registry.
 
+        Each table is read with a single query, and the rows are grouped by
+        detector; the new validity ranges of all rows are written with a single
+        executemany. If config.incrementalValidity, only the rows of the detectors
+        with calibrations added through addRow since the registry was opened are
+        read and updated.
+
         @param conn: Database connection
         @param validity: Validity range (days)
         """
+        self.flushRows(conn)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         if tables is None:
             tables = self.config.tables
         for table in tables:
-            sql = "SELECT DISTINCT %s FROM %s" % (", ".join(self.config.detector), table)
+            columns = ", ".join("%s.%s" % (table, col) for col in
+                                ["id"] + self.config.detector + [self.config.calibDate])
+            sql = "SELECT %s FROM %s" % (columns, table)
+            if self.config.incrementalValidity:
+                detectors = self._addedDetectors.pop(table, None) if conn is self._bulkConn else None
+                if not detectors:
+                    continue
+                # Only read the rows of the added detectors, by joining against a temporary table of them
+                self._createDetectorTable(cursor, detectors)
+                sql += " JOIN added_detectors ON "
+                sql += " AND ".join("%s.%s IS added_detectors.%s" % (table, col, col) for
+                                    col in self.config.detector)
+            sql += " ORDER BY %s.%s" % (table, self.config.calibDate)
             cursor.execute(sql)
-            rows = cursor.fetchall()
-            for row in rows:
-                self.fixSubsetValidity(conn, table, row, validity)
+            groups = collections.OrderedDict()
+            for row in cursor.fetchall():
+                detectorData = tuple(row[col] for col in self.config.detector)
+                groups.setdefault(detectorData, []).append(row)
+            updates = []
+            for detectorData, rows in groups.items():
+                updates += self.computeValidity(table, detectorData, rows, validity)
+            self.writeValidity(conn, table, updates)
+
+    def _createDetectorTable(self, cursor, detectors):
+        """Fill the temporary table added_detectors with the values identifying some detectors
+
+        @param cursor: Database cursor
+        @param detectors: Iterable of values identifying a detector (from columns in self.config.detector)
+        """
+        cursor.execute("DROP TABLE IF EXISTS temp.added_detectors")
+        cursor.execute("CREATE TEMPORARY TABLE added_detectors (%s)" % ", ".join(self.config.detector))
+        cursor.executemany("INSERT INTO added_detectors VALUES (%s)" %
+                           ", ".join("?" for col in self.config.detector), detectors)
+
+    def writeValidity(self, conn, table, updates):
+        """Write validity ranges to the registry
+
+        @param conn: Database connection
+        @param table: Name of table to be updated
+        @param updates: List of (validStart, validEnd, id)
+        """
+        sql = "UPDATE %s" % table
+        sql += " SET %s=?, %s=?" % (self.config.validStart, self.config.validEnd)
+        sql += " WHERE id=?"
+        conn.executemany(sql, updates)
 
     def fixSubsetValidity(self, conn, table, detectorData, validity):
         """Update the validity ranges among selected rows in the registry.
@@ -140,7 +219,20 @@ class CalibsRegisterTask(RegisterTask):
         cursor = conn.cursor()
         cursor.execute(sql, detectorData)
         rows = cursor.fetchall()
+        self.writeValidity(conn, table, self.computeValidity(table, detectorData, rows, validity))
 
+    def computeValidity(self, table, detectorData, rows, validity):
+        """Compute the validity ranges of the calibrations of a detector
+
+        See fixSubsetValidity for the rules.
+
+        @param table: Name of table
+        @param detectorData: Values identifying a detector (from columns in self.config.detector)
+        @param rows: Rows of the table for the detector, with the id and calibration date,
+                     ordered by calibration date
+        @param validity: Validity range (days)
+        @return list of (validStart, validEnd, id), empty if some calibration dates are missing
+        """
         try:
             valids = collections.OrderedDict([(_convertToDate(row[self.config.calibDate]), [None, None]) for
                                               row in rows])
@@ -149,7 +241,7 @@ class CalibsRegisterTask(RegisterTask):
             # Sqlite returns unicode strings, which cannot be passed through SWIG.
             self.log.warn(str("Skipped setting the validity overlaps for %s %s: missing calibration dates" %
                               (table, det)))
-            return
+            return []
         dates = list(valids.keys())
         if table in self.config.validityUntilSuperseded:
             # A calib is valid until it is superseded
@@ -172,15 +264,11 @@ class CalibsRegisterTask(RegisterTask):
                     valids[date][1] = midpoint
             del midpoints
         del dates
-        # Update the validity data in the registry
+        updates = []
         for row in rows:
             calibDate = _convertToDate(row[self.config.calibDate])
-            validStart = valids[calibDate][0].isoformat()
-            validEnd = valids[calibDate][1].isoformat()
-            sql = "UPDATE %s" % table
-            sql += " SET %s=?, %s=?" % (self.config.validStart, self.config.validEnd)
-            sql += " WHERE id=?"
-            conn.execute(sql, (validStart, validEnd, row["id"]))
+            updates.append((valids[calibDate][0].isoformat(), valids[calibDate][1].isoformat(), row["id"]))
+        return updates
 
 
 class IngestCalibsArgumentParser(InputOnlyArgumentParser):
@@ -190,8 +278,8 @@ class IngestCalibsArgumentParser(InputOnlyArgumentParser):
         InputOnlyArgumentParser.__init__(self, *args, **kwargs)
         self.add_argument("-n", "--dry-run", dest="dryrun", action="store_true",
                           default=False, help="Don't perform any action?")
-        self.add_argument("--mode", choices=["move", "copy", "link", "skip"], default="move",
-                          help="Mode of delivering the files to their destination")
+        self.add_argument("--mode", choices=["move", "copy", "link", "hardlink", "reflink", "skip"],
+                          default="move", help="Mode of delivering the files to their destination")
         self.add_argument("--create", action="store_true", help="Create new registry?")
         self.add_argument("--validity", type=int, required=True, help="Calibration validity period (days)")
         self.add_argument("--ignore-ingested", dest="ignoreIngested", action="store_true",
@@ -1,3 +1,5 @@
+import csv
+import io
 import os
 
 from lsst.pex.config import ConfigurableField
@@ -14,17 +16,19 @@ except ImportError:
 class PgsqlRegistryContext(RegistryContext):
     """Context manager to provide a pgsql registry
     """
-    def __init__(self, registryName, createTableFunc, forceCreateTables):
+    def __init__(self, registryName, createTableFunc, forceCreateTables, createIndexesFunc=None):
         """Construct a context manager
 
         @param registryName: Name of registry file
         @param createTableFunc: Function to create tables
         @param forceCreateTables: Force the (re-)creation of tables?
+        @param createIndexesFunc: Function to create any missing indexes on existing tables, or None
         """
         self.registryName = registryName
         data = PgsqlRegistry.readYaml(registryName)
-        self.conn = pgsql.connect(host=data["host"], port=data["port"], user=data["user"],
-                                  password=data["password"], database=data["database"])
+        self.connectArgs = dict(host=data["host"], port=data["port"], user=data["user"],
+                                password=data["password"], database=data["database"])
+        self.conn = pgsql.connect(**self.connectArgs)
         cur = self.conn.cursor()
 
         # Check for existence of tables
@@ -39,6 +43,12 @@ class PgsqlRegistryContext(RegistryContext):
             for tt in tables:
                 cur.execute("DROP TABLE %s CASCADE" % tt)
             createTableFunc(self.conn)
+        elif createIndexesFunc is not None:
+            createIndexesFunc(self.conn)
+
+    def connect(self):
+        """Open an additional connection to the registry"""
+        return pgsql.connect(**self.connectArgs)
 
     def __exit__(self, excType, excValue, traceback):
         self.conn.commit()
@@ -60,7 +70,7 @@ class PgsqlRegisterTask(RegisterTask):
         if dryrun:
             return fakeContext()
         registryName = os.path.join(directory, "registry.pgsql")
-        return PgsqlRegistryContext(registryName, self.createTable, create)
+        return PgsqlRegistryContext(registryName, self.createTable, create, self.createIndexes)
 
     def createTable(self, conn, table=None):
         """Create the registry tables
@@ -99,6 +109,63 @@ class PgsqlRegisterTask(RegisterTask):
         cur.execute(cmd)
         del cur
         conn.commit()
+        self.createIndexes(conn, table)
+
+    def flushRows(self, conn, table=None):
+        """Write the rows buffered by bufferRow to the registry
+
+        The rows are streamed with COPY FROM STDIN into a temporary staging
+        table, and merged from there into the file table and (for config.table)
+        the visits table with set-based SQL, all within the registry transaction.
+
+        @param conn    Database connection
+        @param table   Name of table in database, or None for all tables
+        """
+        if conn is not self._bulkConn:
+            return
+        tables = list(self._pendingRows) if table is None else [table]
+        columns = ",".join(self.config.columns)
+        for tt in tables:
+            rows = self._pendingRows.pop(tt, None)
+            if not rows:
+                continue
+            staging = tt + "_staging"
+            cur = conn.cursor()
+            cur.execute("CREATE TEMPORARY TABLE IF NOT EXISTS %s AS SELECT %s FROM %s WITH NO DATA" %
+                        (staging, columns, tt))
+            data = io.StringIO()
+            csv.writer(data, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+            data.seek(0)
+            cur.copy_expert("COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (staging, columns), data)
+
+            sql = "INSERT INTO %s (%s) SELECT %s FROM %s" % (tt, columns, columns, staging)
+            if self.config.ignore:
+                sql += " ON CONFLICT DO NOTHING"
+            cur.execute(sql)
+            if tt == self.config.table:
+                visitColumns = ",".join(self.config.visit)
+                sql = "INSERT INTO %s_visit (%s) " % (tt, visitColumns)
+                sql += "SELECT DISTINCT %s FROM %s AS ss" % (visitColumns, staging)
+                sql += " WHERE NOT EXISTS (SELECT 1 FROM %s_visit AS vv WHERE vv.visit = ss.visit)" % tt
+                cur.execute(sql)
+            cur.execute("TRUNCATE %s" % staging)
+            self.log.debug("Copied %d rows to %s", len(rows), tt)
+
+    def addVisits(self, conn, dryrun=False, table=None):
+        """Generate the visits table (typically 'raw_visits') from the
+        file table (typically 'raw').
+
+        With config.batchSize > 0, the visits are merged as the rows are flushed,
+        so it only remains to flush the buffered rows.
+
+        @param conn    Database connection
+        @param table   Name of table in database
+        """
+        if self.config.batchSize > 0 and not dryrun and table in (None, self.config.table):
+            self.flushRows(conn, self.config.table)
+            self._addedVisits = {}
+            return
+        RegisterTask.addVisits(self, conn, dryrun=dryrun, table=table)
 
 
 class PgsqlIngestConfig(IngestConfig):
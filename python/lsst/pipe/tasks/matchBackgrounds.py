@@ -18,6 +18,9 @@
 # You should have received a copy of the LSST License Statement and
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
+import multiprocessing
+import warnings
+
 import numpy
 import lsst.afw.image as afwImage
 import lsst.afw.math as afwMath
@@ -133,6 +136,20 @@ class MatchBackgroundsConfig(pexConfig.Config):
         default=1e-8,
         min=0.
     )
+    doSinglePass = pexConfig.Field(
+        dtype=bool,
+        doc="Read each exposure only once, keeping all (scaled) exposures in memory between the "
+        "selection of the best reference exposure and the background fits. "
+        "Ignored when a reference exposure is supplied, as no selection is needed then.",
+        default=False,
+    )
+    numProcesses = pexConfig.RangeField(
+        dtype=int,
+        doc="Number of processes used to fit the backgrounds of the non-reference exposures; "
+        "the reference exposure (and, with doSinglePass, the other exposures) is shared with them.",
+        default=1,
+        min=1,
+    )
 
 
 class MatchBackgroundsTask(pipeBase.Task):
@@ -152,6 +169,10 @@ class MatchBackgroundsTask(pipeBase.Task):
 
         Choose a refExpDataRef automatically if none supplied.
 
+        If config.doSinglePass is set, the exposures read while choosing the reference exposure are
+        kept in memory for the fits. If config.numProcesses > 1, the non-reference exposures are
+        fit in a pool of forked processes that share the reference exposure.
+
         @param[in] expRefList: list of data references to science exposures to be background-matched;
             all exposures must exist.
         @param[in] expDatasetType: dataset type of exposures, e.g. 'goodSeeingCoadd_tempExp'
@@ -195,12 +216,15 @@ class MatchBackgroundsTask(pipeBase.Task):
                                (len(expRefList), len(imageScalerList)))
 
         refInd = None
+        exposureCache = None
         if refExpDataRef is None:
             # select the best reference exposure from expRefList
+            exposureCache = {} if self.config.doSinglePass else None
             refInd = self.selectRefExposure(
                 expRefList=expRefList,
                 imageScalerList=imageScalerList,
                 expDatasetType=expDatasetType,
+                exposureCache=exposureCache,
             )
             refExpDataRef = expRefList[refInd]
             refImageScaler = imageScalerList[refInd]
@@ -215,17 +239,38 @@ class MatchBackgroundsTask(pipeBase.Task):
         if refInd is not None and refInd not in refIndSet:
             raise RuntimeError("Internal error: selected reference %s not found in expRefList")
 
-        refExposure = refExpDataRef.get(expDatasetType, immediate=True)
-        if refImageScaler is not None:
-            refMI = refExposure.getMaskedImage()
-            refImageScaler.scaleMaskedImage(refMI)
+        if exposureCache is not None and refInd in exposureCache:
+            refExposure = exposureCache.pop(refInd)
+        else:
+            refExposure = refExpDataRef.get(expDatasetType, immediate=True)
+            if refImageScaler is not None:
+                refMI = refExposure.getMaskedImage()
+                refImageScaler.scaleMaskedImage(refMI)
 
         debugIdKeyList = tuple(set(expKeyList) - set(['tract', 'patch']))
 
         self.log.info("Matching %d Exposures" % (numExp))
 
+        toMatchIndices = [ind for ind in range(numExp) if ind not in refIndSet]
+        for ind in toMatchIndices:
+            self.log.info("Matching background of %s to %s" % (expRefList[ind].dataId, refExpDataRef.dataId))
+        matchState = pipeBase.Struct(task=self, refExposure=refExposure, expRefList=expRefList,
+                                     imageScalerList=imageScalerList, expDatasetType=expDatasetType,
+                                     exposureCache=exposureCache, debugIdKeyList=debugIdKeyList)
+        fitDict = {}
+        if self.config.numProcesses > 1 and len(toMatchIndices) > 1:
+            numProcesses = min(self.config.numProcesses, len(toMatchIndices))
+            context = multiprocessing.get_context("fork")
+            with context.Pool(numProcesses, initializer=_initMatchWorker, initargs=(matchState,)) as pool:
+                for ind, packedFit, error in pool.imap_unordered(_matchExposure, toMatchIndices):
+                    fitDict[ind] = (self._unpackFit(packedFit) if packedFit is not None else None, error)
+        else:
+            for ind in toMatchIndices:
+                fit, error = self._matchOne(ind, matchState)
+                fitDict[ind] = (self._stripFit(fit) if fit is not None else None, error)
+
         backgroundInfoList = []
-        for ind, (toMatchRef, imageScaler) in enumerate(zip(expRefList, imageScalerList)):
+        for ind, toMatchRef in enumerate(expRefList):
             if ind in refIndSet:
                 backgroundInfoStruct = pipeBase.Struct(
                     isReference=True,
@@ -235,21 +280,9 @@ class MatchBackgroundsTask(pipeBase.Task):
                     diffImVar=None,
                 )
             else:
-                self.log.info("Matching background of %s to %s" % (toMatchRef.dataId, refExpDataRef.dataId))
-                try:
-                    toMatchExposure = toMatchRef.get(expDatasetType, immediate=True)
-                    if imageScaler is not None:
-                        toMatchMI = toMatchExposure.getMaskedImage()
-                        imageScaler.scaleMaskedImage(toMatchMI)
-                    # store a string specifying the visit to label debug plot
-                    self.debugDataIdString = ''.join([str(toMatchRef.dataId[vk]) for vk in debugIdKeyList])
-                    backgroundInfoStruct = self.matchBackgrounds(
-                        refExposure=refExposure,
-                        sciExposure=toMatchExposure,
-                    )
-                    backgroundInfoStruct.isReference = False
-                except Exception as e:
-                    self.log.warn("Failed to fit background %s: %s" % (toMatchRef.dataId, e))
+                backgroundInfoStruct, error = fitDict[ind]
+                if backgroundInfoStruct is None:
+                    self.log.warn("Failed to fit background %s: %s" % (toMatchRef.dataId, error))
                     backgroundInfoStruct = pipeBase.Struct(
                         isReference=False,
                         backgroundModel=None,
@@ -257,14 +290,97 @@ class MatchBackgroundsTask(pipeBase.Task):
                         matchedMSE=None,
                         diffImVar=None,
                     )
+                else:
+                    backgroundInfoStruct.isReference = False
 
             backgroundInfoList.append(backgroundInfoStruct)
 
         return pipeBase.Struct(
             backgroundInfoList=backgroundInfoList)
 
+    def _matchOne(self, ind, state):
+        """Fit the background of one exposure against the reference exposure
+
+        @param[in] ind: index of the exposure in state.expRefList
+        @param[in] state: pipeBase.Struct with the reference exposure and the inputs of run
+        @return: (result of _fitBackground, None) on success, or (None, error message) on failure
+        """
+        toMatchRef = state.expRefList[ind]
+        try:
+            toMatchExposure = None
+            if state.exposureCache is not None:
+                toMatchExposure = state.exposureCache.pop(ind, None)
+            if toMatchExposure is None:
+                toMatchExposure = toMatchRef.get(state.expDatasetType, immediate=True)
+                imageScaler = state.imageScalerList[ind]
+                if imageScaler is not None:
+                    toMatchMI = toMatchExposure.getMaskedImage()
+                    imageScaler.scaleMaskedImage(toMatchMI)
+            # store a string specifying the visit to label debug plot
+            self.debugDataIdString = ''.join([str(toMatchRef.dataId[vk]) for vk in state.debugIdKeyList])
+            return self._fitBackground(refExposure=state.refExposure, sciExposure=toMatchExposure), None
+        except Exception as e:
+            return None, str(e)
+
+    @staticmethod
+    def _stripFit(fit):
+        """Return the fields of the result of _fitBackground that are returned by matchBackgrounds"""
+        return pipeBase.Struct(
+            backgroundModel=fit.backgroundModel,
+            fitRMS=fit.fitRMS,
+            matchedMSE=fit.matchedMSE,
+            diffImVar=fit.diffImVar,
+        )
+
+    def _packFit(self, backgroundInfoStruct):
+        """Convert the result of matchBackgrounds to a picklable form
+
+        The background model is represented by its statistics image, from which
+        _unpackFit rebuilds it, in the same way as afw.math.BackgroundList does
+        when reading a background model from a file.
+        """
+        background = backgroundInfoStruct.background
+        statsImage = background.getStatsImage()
+        bbox = background.getImageBBox()
+        return dict(
+            bbox=(bbox.getMinX(), bbox.getMinY(), bbox.getWidth(), bbox.getHeight()),
+            image=statsImage.getImage().getArray().copy(),
+            mask=statsImage.getMask().getArray().copy(),
+            variance=statsImage.getVariance().getArray().copy(),
+            approxOrder=backgroundInfoStruct.approxOrder,
+            approxWeighting=backgroundInfoStruct.approxWeighting,
+            fitRMS=backgroundInfoStruct.fitRMS,
+            matchedMSE=backgroundInfoStruct.matchedMSE,
+            diffImVar=backgroundInfoStruct.diffImVar,
+        )
+
+    def _unpackFit(self, packedFit):
+        """Rebuild the result of matchBackgrounds from the output of _packFit"""
+        x0, y0, width, height = packedFit["bbox"]
+        bbox = afwGeom.Box2I(afwGeom.Point2I(x0, y0), afwGeom.Extent2I(width, height))
+        statsImage = afwImage.makeMaskedImage(afwImage.ImageF(packedFit["image"]),
+                                              afwImage.Mask(packedFit["mask"]),
+                                              afwImage.ImageF(packedFit["variance"]))
+        background = afwMath.BackgroundMI(bbox, statsImage)
+        bctrl = background.getBackgroundControl()
+        bctrl.setInterpStyle(self.config.interpStyle)
+        bctrl.setUndersampleStyle(self.config.undersampleStyle)
+        backgroundModel = background
+        if self.config.usePolynomial:
+            order = packedFit["approxOrder"]
+            actrl = afwMath.ApproximateControl(afwMath.ApproximateControl.CHEBYSHEV,
+                                               order, order, packedFit["approxWeighting"])
+            undersampleStyle = getattr(afwMath, self.config.undersampleStyle)
+            backgroundModel = background.getApproximate(actrl, undersampleStyle)
+        return pipeBase.Struct(
+            backgroundModel=backgroundModel,
+            fitRMS=packedFit["fitRMS"],
+            matchedMSE=packedFit["matchedMSE"],
+            diffImVar=packedFit["diffImVar"],
+        )
+
     @pipeBase.timeMethod
-    def selectRefExposure(self, expRefList, imageScalerList, expDatasetType):
+    def selectRefExposure(self, expRefList, imageScalerList, expDatasetType, exposureCache=None):
         """Find best exposure to use as the reference exposure
 
         Calculate an appropriate reference exposure by minimizing a cost function that penalizes
@@ -279,6 +395,8 @@ class MatchBackgroundsTask(pipeBase.Task):
         @param[in] imageScalerList: list of image scalers (coaddUtils.ImageScaler);
             must be the same length as expRefList
         @param[in] expDatasetType: dataset type of exposure: e.g. 'goodSeeingCoadd_tempExp'
+        @param[out] exposureCache: if not None, a dict into which the scaled exposures are stored,
+            indexed by their position in expRefList, so that they need not be read again
 
         @return: index of best exposure
 
@@ -293,7 +411,7 @@ class MatchBackgroundsTask(pipeBase.Task):
             raise RuntimeError("len(expRefList) = %s != %s = len(imageScalerList)" %
                                (len(expRefList), len(imageScalerList)))
 
-        for expRef, imageScaler in zip(expRefList, imageScalerList):
+        for ind, (expRef, imageScaler) in enumerate(zip(expRefList, imageScalerList)):
             exposure = expRef.get(expDatasetType, immediate=True)
             maskedImage = exposure.getMaskedImage()
             if imageScaler is not None:
@@ -305,6 +423,8 @@ class MatchBackgroundsTask(pipeBase.Task):
                     meanBkgdLevelList.append(numpy.nan)
                     coverageList.append(numpy.nan)
                     continue
+            if exposureCache is not None:
+                exposureCache[ind] = exposure
             statObjIm = afwMath.makeStatistics(maskedImage.getImage(), maskedImage.getMask(),
                                                afwMath.MEAN | afwMath.NPOINT | afwMath.VARIANCE, self.sctrl)
             meanVar, meanVarErr = statObjIm.getResult(afwMath.VARIANCE)
@@ -351,7 +471,17 @@ class MatchBackgroundsTask(pipeBase.Task):
               should be comparable to difference image's mean variance.
             - diffImVar: the mean variance of the difference image.
         """
+        return self._stripFit(self._fitBackground(refExposure, sciExposure))
 
+    def _fitBackground(self, refExposure, sciExposure):
+        """Implementation of matchBackgrounds
+
+        @returns the pipeBase.Struct returned by matchBackgrounds, plus the fields:
+            - background: the afw.math.Background from which backgroundModel is derived
+            - approxOrder: order of the Chebyshev approximation (None unless config.usePolynomial)
+            - approxWeighting: whether the approximation is weighted by inverse variance
+                (None unless config.usePolynomial)
+        """
         if lsstDebug.Info(__name__).savefits:
             refExposure.writeFits(lsstDebug.Info(__name__).figpath + 'refExposure.fits')
             sciExposure.writeFits(lsstDebug.Info(__name__).figpath + 'sciExposure.fits')
@@ -480,7 +610,10 @@ class MatchBackgroundsTask(pipeBase.Task):
             backgroundModel=outBkgd,
             fitRMS=rms,
             matchedMSE=mse,
-            diffImVar=meanVar)
+            diffImVar=meanVar,
+            background=bkgd,
+            approxOrder=order if self.config.usePolynomial else None,
+            approxWeighting=weightByInverseVariance if self.config.usePolynomial else None)
 
     def _debugPlot(self, X, Y, Z, dZ, modelImage, bbox, model, resids):
         """Generate a plot showing the background fit and residuals.
@@ -537,42 +670,108 @@ class MatchBackgroundsTask(pipeBase.Task):
             plt.clf()
 
     def _gridImage(self, maskedImage, binsize, statsFlag):
-        """Private method to grid an image for debugging"""
+        """Private method to grid an image for debugging
+
+        The image is split into (nby, binsize, nbx, binsize) blocks (padding the
+        last row and column of bins with NaN), and the statistics of each bin
+        are computed with numpy reductions over the unmasked, finite pixels,
+        reproducing afw.math.makeStatistics with self.sctrl.
+        """
         width, height = maskedImage.getDimensions()
         x0, y0 = maskedImage.getXY0()
         xedges = numpy.arange(0, width, binsize)
         yedges = numpy.arange(0, height, binsize)
         xedges = numpy.hstack((xedges, width))  # add final edge
         yedges = numpy.hstack((yedges, height))  # add final edge
+        nbx = len(xedges) - 1
+        nby = len(yedges) - 1
+
+        image = maskedImage.getImage().getArray().astype(numpy.float64)
+        image[(maskedImage.getMask().getArray() & self.sctrl.getAndMask()) != 0] = numpy.nan
+        padded = numpy.full((nby*binsize, nbx*binsize), numpy.nan)
+        padded[:height, :width] = image
+        blocks = padded.reshape(nby, binsize, nbx, binsize).swapaxes(1, 2).reshape(nby, nbx, binsize**2)
+
+        npoints = numpy.isfinite(blocks).sum(axis=2)
+        # Bins with fewer than two valid pixels are dropped below; don't warn about them
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            stdev = numpy.nanstd(blocks, axis=2, ddof=1)
+            if statsFlag == afwMath.MEAN:
+                est = numpy.nanmean(blocks, axis=2)
+            elif statsFlag == afwMath.MEDIAN:
+                est = numpy.nanmedian(blocks, axis=2)
+            elif statsFlag == afwMath.MEANCLIP:
+                est = self._clippedMean(blocks)
+            else:
+                raise ValueError("Unsupported grid statistic %s" % (statsFlag,))
+
+        # Only include bins with enough valid pixels in the fit
+        good = npoints >= 2
+        stdev = numpy.maximum(stdev, self.config.gridStdevEpsilon)
+        xCenters = 0.5 * (x0 + xedges[:-1] + x0 + xedges[1:])
+        yCenters = 0.5 * (y0 + yedges[:-1] + y0 + yedges[1:])
+        bgX = numpy.broadcast_to(xCenters[numpy.newaxis, :], good.shape)[good]
+        bgY = numpy.broadcast_to(yCenters[:, numpy.newaxis], good.shape)[good]
+        bgZ = est[good]
+        bgdZ = stdev[good]/numpy.sqrt(npoints[good])
+
+        return bgX, bgY, bgZ, bgdZ
+
+    def _clippedMean(self, blocks):
+        """Private method to compute the sigma-clipped mean of each bin of a gridded image
+
+        Follows afw.math.Statistics: start from the median, with a clipping
+        half-width of numSigmaClip times the interquartile range converted to
+        a standard deviation, then numIter times replace the center by the mean
+        and the half-width by numSigmaClip standard deviations of the pixels
+        strictly within the clipping range.
+
+        @param blocks: array of shape (nby, nbx, npix) with invalid pixels set to NaN
+        @return array of shape (nby, nbx) of clipped means
+        """
+        IQ_TO_STDEV = 0.741301109252802  # 1 sigma in units of interquartile (assume Gaussian)
+        numSigmaClip = self.sctrl.getNumSigmaClip()
+        q1, median, q3 = numpy.nanpercentile(blocks, [25, 50, 75], axis=2)
+        center = median
+        hwidth = numSigmaClip*IQ_TO_STDEV*(q3 - q1)
+        for i in range(self.sctrl.getNumIter()):
+            inside = ((blocks > (center - hwidth)[..., numpy.newaxis]) &
+                      (blocks < (center + hwidth)[..., numpy.newaxis]))
+            nClip = inside.sum(axis=2)
+            meanClip = numpy.where(inside, blocks, 0.0).sum(axis=2)/nClip
+            varClip = (numpy.where(inside, blocks - meanClip[..., numpy.newaxis], 0.0)**2).sum(axis=2)
+            varClip /= nClip - 1
+            center = numpy.where(nClip > 0, meanClip, center)
+            hwidth = numpy.where(nClip > 1, numSigmaClip*numpy.sqrt(varClip), hwidth)
+        return center
+
+
+_matchWorkerState = None
+
+
+def _initMatchWorker(state):
+    """Initialize a forked worker process for parallel background matching
+
+    The worker inherits the reference exposure (and any exposures kept in memory
+    by MatchBackgroundsTask.selectRefExposure) from the parent process, so they
+    are not pickled.
+
+    @param[in] state: pipeBase.Struct with the task, the reference exposure and the inputs of run
+    """
+    global _matchWorkerState
+    _matchWorkerState = state
+
 
-        # Use lists/append to protect against the case where
-        # a bin has no valid pixels and should not be included in the fit
-        bgX = []
-        bgY = []
-        bgZ = []
-        bgdZ = []
-
-        for ymin, ymax in zip(yedges[0:-1], yedges[1:]):
-            for xmin, xmax in zip(xedges[0:-1], xedges[1:]):
-                subBBox = afwGeom.Box2I(afwGeom.PointI(int(x0 + xmin), int(y0 + ymin)),
-                                        afwGeom.PointI(int(x0 + xmax-1), int(y0 + ymax-1)))
-                subIm = afwImage.MaskedImageF(maskedImage, subBBox, afwImage.PARENT, False)
-                stats = afwMath.makeStatistics(subIm,
-                                               afwMath.MEAN | afwMath.MEANCLIP | afwMath.MEDIAN |
-                                               afwMath.NPOINT | afwMath.STDEV,
-                                               self.sctrl)
-                npoints, _ = stats.getResult(afwMath.NPOINT)
-                if npoints >= 2:
-                    stdev, _ = stats.getResult(afwMath.STDEV)
-                    if stdev < self.config.gridStdevEpsilon:
-                        stdev = self.config.gridStdevEpsilon
-                    bgX.append(0.5 * (x0 + xmin + x0 + xmax))
-                    bgY.append(0.5 * (y0 + ymin + y0 + ymax))
-                    bgdZ.append(stdev/numpy.sqrt(npoints))
-                    est, _ = stats.getResult(statsFlag)
-                    bgZ.append(est)
-
-        return numpy.array(bgX), numpy.array(bgY), numpy.array(bgZ), numpy.array(bgdZ)
+def _matchExposure(ind):
+    """Fit the background of one exposure in a worker process
+
+    @param[in] ind: index of the exposure in expRefList
+    @return: (ind, picklable fit result or None, error message or None)
+    """
+    task = _matchWorkerState.task
+    fit, error = task._matchOne(ind, _matchWorkerState)
+    return ind, task._packFit(fit) if fit is not None else None, error
 
 
 class DataRefMatcher:
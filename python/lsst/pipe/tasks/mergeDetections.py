@@ -25,6 +25,8 @@ from .multiBandUtils import (CullPeaksConfig, MergeSourcesRunner, _makeMakeIdFac
                              getInputSchema, getShortFilterName, readCatalog)
 
 
+import numpy
+
 import lsst.afw.detection as afwDetect
 import lsst.afw.image as afwImage
 import lsst.afw.table as afwTable
@@ -321,24 +323,34 @@ class MergeDetectionsTask(PipelineTask, CmdLineTask):
         """
         keys = [item.key for item in self.merged.getPeakSchema().extract("merge_peak_*").values()]
         assert len(keys) > 0, "Error finding flags that associate peaks with their detection bands."
+        config = self.config.cullPeaks
         totalPeaks = 0
         culledPeaks = 0
         for parentSource in catalog:
-            # Make a list copy so we can clear the attached PeakCatalog and append the ones we're keeping
-            # to it (which is easier than deleting as we iterate).
-            keptPeaks = parentSource.getFootprint().getPeaks()
-            oldPeaks = list(keptPeaks)
-            keptPeaks.clear()
-            familySize = len(oldPeaks)
+            peaks = parentSource.getFootprint().getPeaks()
+            familySize = len(peaks)
             totalPeaks += familySize
-            for rank, peak in enumerate(oldPeaks):
-                if ((rank < self.config.cullPeaks.rankSufficient) or
-                    (sum([peak.get(k) for k in keys]) >= self.config.cullPeaks.nBandsSufficient) or
-                    (rank < self.config.cullPeaks.rankConsidered and
-                     rank < self.config.cullPeaks.rankNormalizedConsidered * familySize)):
-                    keptPeaks.append(peak)
-                else:
-                    culledPeaks += 1
+            # Peaks are always kept if their rank is below rankSufficient
+            if familySize <= config.rankSufficient:
+                continue
+            # Column access requires a contiguous catalog
+            peakColumns = peaks if peaks.isContiguous() else peaks.copy(deep=True)
+            nBands = numpy.zeros(familySize, dtype=int)
+            for k in keys:
+                nBands += peakColumns.get(k)
+            rank = numpy.arange(familySize)
+            keep = ((rank < config.rankSufficient) |
+                    (nBands >= config.nBandsSufficient) |
+                    ((rank < config.rankConsidered) &
+                     (rank < config.rankNormalizedConsidered * familySize)))
+            if keep.all():
+                continue
+            # Shallow copy the peaks we're keeping, so we can clear the attached PeakCatalog and
+            # append them to it.
+            keptPeaks = peaks.subset(keep)
+            peaks.clear()
+            peaks.extend(keptPeaks)
+            culledPeaks += familySize - len(keptPeaks)
         self.log.info("Culled %d of %d peaks" % (culledPeaks, totalPeaks))
 
     def getSchemaCatalogs(self):
@@ -302,83 +302,69 @@ class MergeMeasurementsTask(pipeBase.PipelineTask, pipeBase.CmdLineTask):
             if numpy.any(orderedCatalogs[0].get(idKey) != catalog.get(idKey)):
                 raise ValueError("Error in inputs to MergeCoaddMeasurements: source IDs do not match")
 
-        # This first zip iterates over all the catalogs simultaneously, yielding a sequence of one
-        # record for each band, in priority order.
-        for orderedRecords in zip(*orderedCatalogs):
-
-            maxSNRecord = None
-            maxSNFlagKeys = None
-            maxSN = 0.
-            priorityRecord = None
-            priorityFlagKeys = None
-            prioritySN = 0.
-            hasPseudoFilter = False
-
-            # Now we iterate over those record-band pairs, keeping track of the priority and the
-            # largest S/N band.
-            for inputRecord, flagKeys in zip(orderedRecords, orderedKeys):
-                parent = (inputRecord.getParent() == 0 and inputRecord.get(flagKeys.footprint))
-                child = (inputRecord.getParent() != 0 and inputRecord.get(flagKeys.peak))
-
-                if not (parent or child):
-                    for pseudoFilterKey in self.pseudoFilterKeys:
-                        if inputRecord.get(pseudoFilterKey):
-                            hasPseudoFilter = True
-                            priorityRecord = inputRecord
-                            priorityFlagKeys = flagKeys
-                            break
-                    if hasPseudoFilter:
-                        break
-
-                isBad = any(inputRecord.get(flag) for flag in self.badFlags)
-                if isBad or inputRecord.get(self.fluxFlagKey) or inputRecord.get(self.instFluxErrKey) == 0:
-                    sn = 0.
-                else:
-                    sn = inputRecord.get(self.instFluxKey)/inputRecord.get(self.instFluxErrKey)
-                if numpy.isnan(sn) or sn < 0.:
-                    sn = 0.
-                if (parent or child) and priorityRecord is None:
-                    priorityRecord = inputRecord
-                    priorityFlagKeys = flagKeys
-                    prioritySN = sn
-                if sn > maxSN:
-                    maxSNRecord = inputRecord
-                    maxSNFlagKeys = flagKeys
-                    maxSN = sn
-
-            # If the priority band has a low S/N we would like to choose the band with the highest S/N as
-            # the reference band instead.  However, we only want to choose the highest S/N band if it is
-            # significantly better than the priority band.  Therefore, to choose a band other than the
-            # priority, we require that the priority S/N is below the minimum threshold and that the
-            # difference between the priority and highest S/N is larger than the difference threshold.
-            #
-            # For pseudo code objects we always choose the first band in the priority list.
-            bestRecord = None
-            bestFlagKeys = None
-            if hasPseudoFilter:
-                bestRecord = priorityRecord
-                bestFlagKeys = priorityFlagKeys
-            elif (prioritySN < self.config.minSN and (maxSN - prioritySN) > self.config.minSNDiff and
-                  maxSNRecord is not None):
-                bestRecord = maxSNRecord
-                bestFlagKeys = maxSNFlagKeys
-            elif priorityRecord is not None:
-                bestRecord = priorityRecord
-                bestFlagKeys = priorityFlagKeys
-
-            if bestRecord is not None and bestFlagKeys is not None:
-                outputRecord = mergedCatalog.addNew()
-                outputRecord.assign(bestRecord, self.schemaMapper)
-                outputRecord.set(bestFlagKeys.output, True)
-            else:  # if we didn't find any records
-                raise ValueError("Error in inputs to MergeCoaddMeasurements: no valid reference for %s" %
-                                 inputRecord.getId())
-
-        # more checking for sane inputs, since zip silently iterates over the smallest sequence
-        for inputCatalog in orderedCatalogs:
-            if len(mergedCatalog) != len(inputCatalog):
-                raise ValueError("Mismatch between catalog sizes: %s != %s" %
-                                 (len(mergedCatalog), len(orderedCatalogs)))
+        # Work out the reference band for every source at once, iterating over the bands in
+        # priority order and keeping track of the priority and the largest S/N band.
+        nSources = len(orderedCatalogs[0])
+        priorityBand = numpy.full(nSources, -1, dtype=int)
+        prioritySN = numpy.zeros(nSources)
+        maxSNBand = numpy.full(nSources, -1, dtype=int)
+        maxSN = numpy.zeros(nSources)
+        hasPseudoFilter = numpy.zeros(nSources, dtype=bool)
+        for band, (catalog, flagKeys) in enumerate(zip(orderedCatalogs, orderedKeys)):
+            if len(catalog) != nSources:
+                raise ValueError("Mismatch between catalog sizes: %s != %s" % (len(catalog), nSources))
+            isParent = catalog.get(catalog.table.getParentKey()) == 0
+            parentOrChild = numpy.where(isParent, catalog.get(flagKeys.footprint), catalog.get(flagKeys.peak))
+            # Sources that have already been assigned to a pseudo-filter band ignore all later bands.
+            active = ~hasPseudoFilter
+
+            isPseudo = numpy.zeros(nSources, dtype=bool)
+            for pseudoFilterKey in self.pseudoFilterKeys:
+                isPseudo |= catalog.get(pseudoFilterKey)
+            isPseudo &= active & ~parentOrChild
+            hasPseudoFilter |= isPseudo
+            priorityBand[isPseudo] = band
+            active &= ~isPseudo
+
+            isBad = catalog.get(self.fluxFlagKey).copy()
+            for flag in self.badFlags.values():
+                isBad |= catalog.get(flag)
+            instFlux = catalog.get(self.instFluxKey)
+            instFluxErr = catalog.get(self.instFluxErrKey)
+            isBad |= instFluxErr == 0
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                sn = instFlux/instFluxErr
+            sn[isBad | ~(sn >= 0.)] = 0.
+
+            isPriority = active & parentOrChild & (priorityBand < 0)
+            priorityBand[isPriority] = band
+            prioritySN[isPriority] = sn[isPriority]
+            isMaxSN = active & (sn > maxSN)
+            maxSNBand[isMaxSN] = band
+            maxSN[isMaxSN] = sn[isMaxSN]
+
+        # If the priority band has a low S/N we would like to choose the band with the highest S/N as
+        # the reference band instead.  However, we only want to choose the highest S/N band if it is
+        # significantly better than the priority band.  Therefore, to choose a band other than the
+        # priority, we require that the priority S/N is below the minimum threshold and that the
+        # difference between the priority and highest S/N is larger than the difference threshold.
+        #
+        # For pseudo code objects we always choose the first band in the priority list.
+        useMaxSN = (~hasPseudoFilter & (prioritySN < self.config.minSN) &
+                    ((maxSN - prioritySN) > self.config.minSNDiff) & (maxSNBand >= 0))
+        bestBand = numpy.where(useMaxSN, maxSNBand, priorityBand)
+        if numpy.any(bestBand < 0):
+            raise ValueError("Error in inputs to MergeCoaddMeasurements: no valid reference for %s" %
+                             orderedCatalogs[0][int(numpy.argmax(bestBand < 0))].getId())
+
+        # Copy all records from the first band in bulk, then overwrite those with a different
+        # reference band.
+        mergedCatalog.extend(orderedCatalogs[0], mapper=self.schemaMapper)
+        for band, catalog in enumerate(orderedCatalogs[1:], start=1):
+            for row in numpy.flatnonzero(bestBand == band):
+                mergedCatalog[int(row)].assign(catalog[int(row)], self.schemaMapper)
+        for band, flagKeys in enumerate(orderedKeys):
+            mergedCatalog[flagKeys.output] = bestBand == band
 
         return pipeBase.Struct(
             mergedCatalog=mergedCatalog
@@ -20,13 +20,16 @@
 # the GNU General Public License along with this program.  If not,
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
+import multiprocessing
+
 from lsst.coadd.utils.coaddDataIdContainer import ExistingCoaddDataIdContainer
 from lsst.pipe.base import (CmdLineTask, Struct, ArgumentParser, ButlerInitializedTaskRunner,
                             PipelineTask, PipelineTaskConfig, InitInputDatasetField,
                             InitOutputDatasetField, InputDatasetField, OutputDatasetField)
 from lsst.pex.config import Config, Field, ConfigurableField
 from lsst.meas.algorithms import DynamicDetectionTask, ReferenceObjectLoader
-from lsst.meas.base import SingleFrameMeasurementTask, ApplyApCorrTask, CatalogCalculationTask
+from lsst.meas.base import (SingleFrameMeasurementTask, ApplyApCorrTask, CatalogCalculationTask,
+                            NoiseReplacer, DummyNoiseReplacer)
 from lsst.meas.deblender import SourceDeblendTask, MultibandDeblendTask
 from lsst.pipe.tasks.coaddBase import getSkyInfo
 from lsst.pipe.tasks.scaleVariance import ScaleVarianceTask
@@ -360,6 +363,11 @@ class DeblendCoaddSourcesConfig(Config):
     hasFakes = Field(dtype=bool,
                      default=False,
                      doc="Should be set to True if fake sources have been inserted into the input data.")
+    maxPsfCache = Field(dtype=int, default=100,
+                        doc="Maximum size of the CoaddPsf cache when it is sized to the number of merged "
+                            "detections (i.e. when --psfCache is not set); the default is the size "
+                            "formerly used for every patch, so the cache is never larger than before "
+                            "and is smaller for patches with fewer detections.")
 
     def setDefaults(self):
         Config.setDefaults(self)
@@ -371,6 +379,10 @@ class DeblendCoaddSourcesRunner(MergeSourcesRunner):
 
     Required because the run method requires a list of
     dataRefs rather than a single dataRef.
+
+    Each target is the list of data references for all filters of a single
+    patch, so a batch of patches may be deblended in a process pool by
+    passing ``-j`` on the command line.
     """
     @staticmethod
     def getTargetList(parsedCmd, **kwargs):
@@ -431,7 +443,9 @@ class DeblendCoaddSourcesTask(CmdLineTask):
         parser.add_id_argument("--id", "deepCoadd_calexp",
                                help="data ID, e.g. --id tract=12345 patch=1,2 filter=g^r^i",
                                ContainerClass=ExistingCoaddDataIdContainer)
-        parser.add_argument("--psfCache", type=int, default=100, help="Size of CoaddPsf cache")
+        parser.add_argument("--psfCache", type=int, default=None,
+                            help="Size of CoaddPsf cache; if not set, the cache is sized to the number "
+                                 "of merged detections in each patch, up to config.maxPsfCache")
         return parser
 
     def __init__(self, butler=None, schema=None, peakSchema=None, **kwargs):
@@ -463,7 +477,7 @@ class DeblendCoaddSourcesTask(CmdLineTask):
         return {self.config.coaddName + "Coadd_deblendedFlux": catalog,
                 self.config.coaddName + "Coadd_deblendedModel": catalog}
 
-    def runDataRef(self, patchRefList, psfCache=100):
+    def runDataRef(self, patchRefList, psfCache=None):
         """Deblend the patch
 
         Deblend each source simultaneously or separately
@@ -472,10 +486,17 @@ class DeblendCoaddSourcesTask(CmdLineTask):
         Propagate flags from individual visits.
         Write the deblended sources out.
 
+        The merged detection catalog is the same for all bands, so it is only
+        read once per patch and a copy is deblended in each band.
+
         Parameters
         ----------
         patchRefList: list
             List of data references for each filter
+        psfCache: `int`, optional
+            Size of the CoaddPsf cache of each exposure.
+            If `None`, the cache is sized to the number of merged detections
+            in the patch, up to ``config.maxPsfCache``.
         """
 
         if self.config.hasFakes:
@@ -483,6 +504,11 @@ class DeblendCoaddSourcesTask(CmdLineTask):
         else:
             coaddType = self.config.coaddName
 
+        # The input sources are the same for all bands, since it is a merged catalog
+        mergedSources = self.readSources(patchRefList[0])
+        if psfCache is None:
+            psfCache = min(max(len(mergedSources), 1), self.config.maxPsfCache)
+
         if self.config.simultaneous:
             # Use SCARLET to simultaneously deblend across filters
             filters = []
@@ -491,10 +517,8 @@ class DeblendCoaddSourcesTask(CmdLineTask):
                 exposure = patchRef.get(coaddType + "Coadd_calexp", immediate=True)
                 filters.append(patchRef.dataId["filter"])
                 exposures.append(exposure)
-            # The input sources are the same for all bands, since it is a merged catalog
-            sources = self.readSources(patchRef)
             exposure = afwImage.MultibandExposure.fromExposures(filters, exposures)
-            fluxCatalogs, templateCatalogs = self.multiBandDeblend.run(exposure, sources)
+            fluxCatalogs, templateCatalogs = self.multiBandDeblend.run(exposure, mergedSources)
             for n in range(len(patchRefList)):
                 self.write(patchRefList[n], fluxCatalogs[filters[n]], templateCatalogs[filters[n]])
         else:
@@ -502,7 +526,9 @@ class DeblendCoaddSourcesTask(CmdLineTask):
             for patchRef in patchRefList:
                 exposure = patchRef.get(coaddType + "Coadd_calexp", immediate=True)
                 exposure.getPsf().setCacheCapacity(psfCache)
-                sources = self.readSources(patchRef)
+                # The deblender modifies the catalog in place, so each band needs its own copy.
+                # The copy also clones the IdFactory, so child IDs are identical in every band.
+                sources = mergedSources.copy(deep=True)
                 self.singleBandDeblend.run(exposure, sources)
                 self.write(patchRef, sources)
 
@@ -527,7 +553,24 @@ class DeblendCoaddSourcesTask(CmdLineTask):
         """
         merged = dataRef.get(self.config.coaddName + "Coadd_mergeDet", immediate=True)
         self.log.info("Read %d detections: %s" % (len(merged), dataRef.dataId))
-        idFactory = self.makeIdFactory(dataRef)
+        return self.convertSources(merged, self.makeIdFactory(dataRef))
+
+    def convertSources(self, merged, idFactory):
+        """Copy a catalog of merged detections into a catalog with the output schema
+
+        Parameters
+        ----------
+        merged: `SourceCatalog`
+            Catalog of merged detections
+        idFactory: `IdFactory`
+            Factory for the IDs of new sources, which is notified of the IDs
+            already in ``merged``
+
+        Returns
+        -------
+        sources: `SourceCatalog`
+            List of sources in merged catalog, with the output schema
+        """
         for s in merged:
             idFactory.notify(s.getId())
         table = afwTable.SourceTable.make(self.schema, idFactory)
@@ -611,6 +654,13 @@ class MeasureMergedCoaddSourcesConfig(PipelineTaskConfig):
         doc=("Write reference matches in denormalized format? "
              "This format uses more disk space, but is more convenient to read."),
     )
+    numMeasurementProcesses = Field(
+        dtype=int,
+        default=1,
+        doc=("Number of processes to use for source measurement. If greater than one, the catalog is "
+             "partitioned into groups of whole parent families that are measured in forked worker "
+             "processes, and the measured records are merged back in their original order.")
+    )
     coaddName = Field(dtype=str, default="deep", doc="Name of coadd")
     psfCache = Field(dtype=int, default=100, doc="Size of psfCache")
     checkUnitsParseStrict = Field(
@@ -745,6 +795,119 @@ class MeasureMergedCoaddSourcesRunner(ButlerInitializedTaskRunner):
         return ButlerInitializedTaskRunner.getTargetList(parsedCmd, psfCache=parsedCmd.psfCache)
 
 
+def _makeNoiseReplacer(measurement, measCat, exposure, exposureId=None):
+    """Replace the footprints of all sources in a catalog by noise.
+
+    This sets up the noise replacement exactly as
+    `lsst.meas.base.SingleFrameMeasurementTask.run` does before running the
+    measurement plugins, including the noise metadata recorded in the
+    catalog, for callers that run the plugins themselves.
+
+    Parameters
+    ----------
+    measurement : `lsst.meas.base.SingleFrameMeasurementTask`
+        Measurement task whose configuration is used.
+    measCat : `lsst.afw.table.SourceCatalog`
+        Catalog of the sources to measure.
+    exposure : `lsst.afw.image.Exposure`
+        Exposure on which to measure the sources; its footprint pixels are
+        replaced by noise until the replacer's ``end`` method is called.
+    exposureId : `int`, optional
+        Unique identifier of the exposure, used to seed the noise.
+
+    Returns
+    -------
+    noiseReplacer : `lsst.meas.base.NoiseReplacer` or `lsst.meas.base.DummyNoiseReplacer`
+        Noise replacer to pass to ``measurement.runPlugins``.
+    """
+    if not measurement.config.doReplaceWithNoise:
+        return DummyNoiseReplacer()
+    footprints = {record.getId(): (record.getParent(), record.getFootprint()) for record in measCat}
+    noiseConfig = measurement.config.noiseReplacer
+    noiseReplacer = NoiseReplacer(noiseConfig, exposure=exposure, footprints=footprints,
+                                  exposureId=exposureId, log=measurement.log)
+    algMetadata = measCat.getMetadata()
+    if algMetadata is not None:
+        algMetadata.addInt("NOISE_SEED_MULTIPLIER", noiseConfig.noiseSeedMultiplier)
+        algMetadata.addString("NOISE_SOURCE", noiseConfig.noiseSource)
+        algMetadata.addDouble("NOISE_OFFSET", noiseConfig.noiseOffset)
+        if exposureId is not None:
+            algMetadata.addLong("NOISE_EXPOSURE_ID", exposureId)
+    return noiseReplacer
+
+
+class _SharedNoiseReplacer:
+    """Noise replacer of a forked worker, shared by all the groups it measures.
+
+    ``runPlugins`` ends the noise replacer it is given when it is done with a
+    group; ending is left to the parent process instead, which restores its
+    own exposure once all groups are measured.
+    """
+
+    def __init__(self, noiseReplacer):
+        self.noiseReplacer = noiseReplacer
+
+    def insertSource(self, id):
+        self.noiseReplacer.insertSource(id)
+
+    def removeSource(self, id):
+        self.noiseReplacer.removeSource(id)
+
+    def end(self):
+        pass
+
+
+# State of a forked measurement worker process, set by `_initMeasurementWorker`
+_measurementWorkerState = None
+
+
+def _initMeasurementWorker(measurement, sources, exposure, noiseReplacer):
+    """Initialize a forked worker process for parallel source measurement.
+
+    The worker inherits the catalog, the exposure, whose footprints have
+    already been replaced by noise, and the noise replacer of the parent
+    process, so they are neither pickled nor recomputed.
+
+    Parameters
+    ----------
+    measurement : `lsst.meas.base.SingleFrameMeasurementTask`
+        Measurement task used to run the measurement plugins.
+    sources : `lsst.afw.table.SourceCatalog`
+        Full catalog of sources to measure.
+    exposure : `lsst.afw.image.Exposure`
+        Exposure on which to measure the sources.
+    noiseReplacer : `lsst.meas.base.NoiseReplacer` or `lsst.meas.base.DummyNoiseReplacer`
+        Noise replacer of the parent process, set up by `_makeNoiseReplacer`.
+    """
+    global _measurementWorkerState
+    _measurementWorkerState = Struct(measurement=measurement, sources=sources, exposure=exposure,
+                                     noiseReplacer=_SharedNoiseReplacer(noiseReplacer))
+
+
+def _measureFamilies(rows):
+    """Measure a group of parent families in a worker process.
+
+    Parameters
+    ----------
+    rows : `list` of `int`
+        Indices into the full catalog of the records to measure, consisting
+        of whole parent families in their original order.
+
+    Returns
+    -------
+    rows : `list` of `int`
+        The input indices.
+    measCat : `lsst.afw.table.SourceCatalog`
+        The measured records, in the same order as ``rows``.
+    """
+    state = _measurementWorkerState
+    measCat = afwTable.SourceCatalog(state.sources.getTable())
+    for row in rows:
+        measCat.append(state.sources[row])
+    state.measurement.runPlugins(state.noiseReplacer, measCat, state.exposure)
+    return rows, measCat
+
+
 class MeasureMergedCoaddSourcesTask(PipelineTask, CmdLineTask):
     r"""!
     @anchor MeasureMergedCoaddSourcesTask_
@@ -1069,7 +1232,10 @@ class MeasureMergedCoaddSourcesTask(PipelineTask, CmdLineTask):
             reference catalog in the matchResults attribute, and denormalized
             matches in the denormMatches attribute.
         """
-        self.measurement.run(sources, exposure, exposureId=exposureId)
+        if self.config.numMeasurementProcesses > 1:
+            self.measureParallel(sources, exposure, exposureId)
+        else:
+            self.measurement.run(sources, exposure, exposureId=exposureId)
 
         if self.config.doApCorr:
             self.applyApCorr.run(
@@ -1106,6 +1272,82 @@ class MeasureMergedCoaddSourcesTask(PipelineTask, CmdLineTask):
         results.outputSources = sources
         return results
 
+    def partitionFamilies(self, sources, nGroups):
+        """Partition a catalog into groups of whole parent families.
+
+        Parameters
+        ----------
+        sources : `lsst.afw.table.SourceCatalog`
+            Catalog to partition.
+        nGroups : `int`
+            Maximum number of groups to return.
+
+        Returns
+        -------
+        groups : `list` of `list` of `int`
+            Indices into ``sources`` of the records in each group, in their
+            original order. Each group has roughly the same number of records.
+        """
+        families = {}
+        for row, record in enumerate(sources):
+            familyId = record.getParent() or record.getId()
+            families.setdefault(familyId, []).append(row)
+        groupSize = max(len(sources)//max(nGroups, 1), 1)
+        groups = []
+        group = []
+        for rows in families.values():
+            group.extend(rows)
+            if len(group) >= groupSize:
+                groups.append(sorted(group))
+                group = []
+        if group:
+            groups.append(sorted(group))
+        return groups
+
+    def measureParallel(self, sources, exposure, exposureId):
+        """Measure the sources in parallel worker processes.
+
+        The footprints of all sources are replaced by noise once, as in
+        `lsst.meas.base.SingleFrameMeasurementTask.run`. The catalog is then
+        partitioned into groups of whole parent families, which are measured
+        independently in processes forked from this one, so the exposure and
+        noise replacer are shared with the workers instead of being copied or
+        recomputed. The measured records are assigned back to ``sources`` in
+        place, and the exposure is restored.
+
+        Measurement plugins run on undeblended sources need the restored
+        exposure, so if any are configured the sources are measured in this
+        process instead.
+
+        Parameters
+        ----------
+        sources : `lsst.afw.table.SourceCatalog`
+            Catalog of sources to measure; modified in place.
+        exposure : `lsst.afw.image.Exposure`
+            Exposure on which to measure the sources.
+        exposureId : `int`
+            Unique identifier of the exposure, used to seed the noise replacer.
+        """
+        if len(self.measurement.undeblendedPlugins) > 0:
+            self.log.warn("Undeblended measurement plugins are configured: measuring in a single process")
+            self.measurement.run(sources, exposure, exposureId=exposureId)
+            return
+        numProcesses = self.config.numMeasurementProcesses
+        # Use several groups per process, so that workers that finish early can take more work.
+        groups = self.partitionFamilies(sources, 4*numProcesses)
+        self.log.info("Measuring %d sources in %d groups with %d processes",
+                      len(sources), len(groups), numProcesses)
+        noiseReplacer = _makeNoiseReplacer(self.measurement, sources, exposure, exposureId)
+        try:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(numProcesses, initializer=_initMeasurementWorker,
+                              initargs=(self.measurement, sources, exposure, noiseReplacer)) as pool:
+                for rows, measCat in pool.imap_unordered(_measureFamilies, groups):
+                    for row, measRecord in zip(rows, measCat):
+                        sources[row].assign(measRecord)
+        finally:
+            noiseReplacer.end()
+
     def readSources(self, dataRef):
         """!
         @brief Read input sources.
@@ -1118,7 +1360,16 @@ class MeasureMergedCoaddSourcesTask(PipelineTask, CmdLineTask):
         """
         merged = dataRef.get(self.config.coaddName + self.inputCatalog, immediate=True)
         self.log.info("Read %d detections: %s" % (len(merged), dataRef.dataId))
-        idFactory = self.makeIdFactory(dataRef)
+        return self.convertSources(merged, self.makeIdFactory(dataRef))
+
+    def convertSources(self, merged, idFactory):
+        """!
+        @brief Copy input sources into a catalog with the output schema.
+
+        @param[in] merged: Catalog of merged detections or deblended sources
+        @param[in] idFactory: Factory for the IDs of new sources; notified of the IDs already in merged
+        @return List of sources in merged catalog, with room for the measurements
+        """
         for s in merged:
             idFactory.notify(s.getId())
         table = afwTable.SourceTable.make(self.schema, idFactory)
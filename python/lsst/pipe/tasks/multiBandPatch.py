@@ -0,0 +1,336 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from lsst.coadd.utils.coaddDataIdContainer import ExistingCoaddDataIdContainer
+import lsst.afw.image as afwImage
+import lsst.afw.table as afwTable
+from lsst.pex.config import Config, Field, ConfigurableField
+from lsst.pipe.base import ArgumentParser, CmdLineTask, Struct
+
+from .coaddBase import getSkyInfo
+from .mergeDetections import MergeDetectionsTask
+from .mergeMeasurements import MergeMeasurementsTask
+from .multiBand import DetectCoaddSourcesTask, DeblendCoaddSourcesTask, MeasureMergedCoaddSourcesTask
+from .multiBandUtils import MergeSourcesRunner
+
+__all__ = ["MultiBandPatchConfig", "MultiBandPatchRunner", "MultiBandPatchTask"]
+
+
+class MultiBandPatchConfig(Config):
+    """Configuration parameters for the `MultiBandPatchTask`.
+    """
+    coaddName = Field(dtype=str, default="deep", doc="Name of coadd")
+    detectCoaddSources = ConfigurableField(target=DetectCoaddSourcesTask,
+                                           doc="Detect sources on the coadd in each band")
+    mergeCoaddDetections = ConfigurableField(target=MergeDetectionsTask,
+                                             doc="Merge detections from all bands")
+    deblendCoaddSources = ConfigurableField(target=DeblendCoaddSourcesTask,
+                                            doc="Deblend the merged detections")
+    measureCoaddSources = ConfigurableField(target=MeasureMergedCoaddSourcesTask,
+                                            doc="Measure the merged sources in each band")
+    mergeCoaddMeasurements = ConfigurableField(target=MergeMeasurementsTask,
+                                               doc="Merge measurements from all bands")
+    doWriteCalexp = Field(dtype=bool, default=True,
+                          doc="Write the background-subtracted, variance-scaled coadd and its background?")
+    doWriteDetections = Field(dtype=bool, default=False,
+                              doc="Write the detection catalog of each band?")
+    doWriteMergedDetections = Field(dtype=bool, default=False,
+                                    doc="Write the merged detection catalog?")
+    doWriteDeblendedSources = Field(dtype=bool, default=False,
+                                    doc="Write the deblended catalog(s) of each band?")
+    doWriteMeasurements = Field(dtype=bool, default=True,
+                                doc="Write the measurement catalog (and reference matches) of each band?")
+    doWriteMergedMeasurements = Field(dtype=bool, default=True,
+                                      doc="Write the merged reference catalog?")
+
+    def validate(self):
+        super().validate()
+        for name in ("detectCoaddSources", "mergeCoaddDetections", "deblendCoaddSources",
+                     "measureCoaddSources", "mergeCoaddMeasurements"):
+            if getattr(self, name).coaddName != self.coaddName:
+                raise ValueError("%s.coaddName (%s) does not match coaddName (%s)" %
+                                 (name, getattr(self, name).coaddName, self.coaddName))
+
+
+class MultiBandPatchRunner(MergeSourcesRunner):
+    """Task runner for the `MultiBandPatchTask`.
+
+    Each target is the list of data references for all filters of a single
+    patch, and the ``--psfCache`` command-line argument is passed on to
+    `MultiBandPatchTask.runDataRef`.
+    """
+    @staticmethod
+    def getTargetList(parsedCmd, **kwargs):
+        """Provide a list of patch references for each patch and tract.
+
+        Parameters
+        ----------
+        parsedCmd:
+            The parsed command
+        kwargs:
+            Keyword arguments passed to the task
+
+        Returns
+        -------
+        targetList: list
+            List of tuples, where each tuple is a (dataRef, kwargs) pair.
+        """
+        refDict = MergeSourcesRunner.buildRefDict(parsedCmd)
+        kwargs["psfCache"] = parsedCmd.psfCache
+        return [(list(p.values()), kwargs) for t in refDict.values() for p in t.values()]
+
+
+class MultiBandPatchTask(CmdLineTask):
+    """Run multi-band processing of coadds on a single patch in one process.
+
+    Detect sources on the coadd of each band, merge the detections, deblend
+    and measure the merged sources in each band and merge the measurements,
+    using the same subtasks and configurations as `DetectCoaddSourcesTask`,
+    `MergeDetectionsTask`, `DeblendCoaddSourcesTask`,
+    `MeasureMergedCoaddSourcesTask` and `MergeMeasurementsTask`.
+
+    Exposures and catalogs are handed from one stage to the next in memory,
+    so each coadd is read only once and only the outputs enabled by the
+    ``doWrite*`` configuration fields are written. The dataset types of the
+    outputs are the same as those written by the individual tasks.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.persistence.Butler`, optional
+        Butler used to construct the reference catalog loader for
+        measurement, if reference matching is enabled.
+    """
+    ConfigClass = MultiBandPatchConfig
+    RunnerClass = MultiBandPatchRunner
+    _DefaultName = "multiBandPatch"
+
+    @classmethod
+    def _makeArgumentParser(cls):
+        parser = ArgumentParser(name=cls._DefaultName)
+        parser.add_id_argument("--id", "deepCoadd",
+                               help="data ID, e.g. --id tract=12345 patch=1,2 filter=g^r^i",
+                               ContainerClass=ExistingCoaddDataIdContainer)
+        parser.add_argument("--psfCache", type=int, default=100, help="Size of CoaddPsf cache")
+        return parser
+
+    def __init__(self, butler=None, **kwargs):
+        super().__init__(**kwargs)
+        self.makeSubtask("detectCoaddSources")
+        self.makeSubtask("mergeCoaddDetections", schema=afwTable.Schema(self.detectCoaddSources.schema))
+        peakSchema = self.mergeCoaddDetections.merged.getPeakSchema()
+        mergedSchema = self.mergeCoaddDetections.schema
+        self.doDeblend = self.config.measureCoaddSources.inputCatalog.startswith("deblended")
+        if self.doDeblend:
+            self.makeSubtask("deblendCoaddSources", schema=afwTable.Schema(mergedSchema),
+                             peakSchema=afwTable.Schema(peakSchema))
+            measureInputSchema = self.deblendCoaddSources.schema
+        else:
+            measureInputSchema = mergedSchema
+        self.makeSubtask("measureCoaddSources", butler=butler, schema=afwTable.Schema(measureInputSchema),
+                         peakSchema=afwTable.Schema(peakSchema))
+        self.makeSubtask("mergeCoaddMeasurements",
+                         schema=afwTable.Schema(self.measureCoaddSources.schema))
+
+    def runDataRef(self, patchRefList, psfCache=100):
+        """Process all bands of a patch, writing the requested outputs.
+
+        Parameters
+        ----------
+        patchRefList : `list` of `lsst.daf.persistence.ButlerDataRef`
+            Data references to the coadd of the patch in each filter.
+        psfCache : `int`, optional
+            Size of the CoaddPsf cache of each exposure.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Results struct with components:
+
+            - ``exposures``: background-subtracted coadds, indexed by filter
+              (`dict` of `lsst.afw.image.Exposure`).
+            - ``measCatalogs``: measurement catalogs, indexed by filter
+              (`dict` of `lsst.afw.table.SourceCatalog`).
+            - ``refCatalog``: merged reference catalog
+              (`lsst.afw.table.SourceCatalog`).
+        """
+        coaddName = self.config.coaddName
+        patchRefDict = {patchRef.dataId["filter"]: patchRef for patchRef in patchRefList}
+        mergedRef = patchRefList[0]
+
+        exposures = {}
+        detections = {}
+        for filterName, patchRef in patchRefDict.items():
+            results = self.detect(patchRef)
+            results.outputExposure.getPsf().setCacheCapacity(psfCache)
+            exposures[filterName] = results.outputExposure
+            detections[filterName] = results.outputSources
+
+        skyInfo = getSkyInfo(coaddName=coaddName, patchRef=mergedRef)
+        mergedDetections = self.mergeCoaddDetections.run(
+            detections, skyInfo,
+            idFactory=self.mergeCoaddDetections.makeIdFactory(mergedRef),
+            skySeed=mergedRef.get(coaddName + "MergedCoaddId"),
+        ).outputCatalog
+        if self.config.doWriteMergedDetections:
+            self.mergeCoaddDetections.write(mergedRef, mergedDetections)
+        del detections
+
+        if self.doDeblend:
+            measInputs = self.deblend(patchRefDict, exposures, mergedDetections)
+        else:
+            measInputs = {filterName: mergedDetections for filterName in patchRefDict}
+
+        measCatalogs = {}
+        for filterName, patchRef in patchRefDict.items():
+            measCatalogs[filterName] = self.measure(patchRef, exposures[filterName], measInputs[filterName],
+                                                    skyInfo)
+        del measInputs
+
+        refCatalog = self.mergeCoaddMeasurements.run(measCatalogs).mergedCatalog
+        if self.config.doWriteMergedMeasurements:
+            self.mergeCoaddMeasurements.write(mergedRef, refCatalog)
+
+        return Struct(exposures=exposures, measCatalogs=measCatalogs, refCatalog=refCatalog)
+
+    def detect(self, patchRef):
+        """Detect sources on the coadd of a single band.
+
+        Parameters
+        ----------
+        patchRef : `lsst.daf.persistence.ButlerDataRef`
+            Data reference to the coadd.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Results of `DetectCoaddSourcesTask.run`.
+        """
+        task = self.detectCoaddSources
+        coaddName = self.config.coaddName + "Coadd"
+        if task.config.hasFakes:
+            exposure = patchRef.get("fakes_" + coaddName, immediate=True)
+        else:
+            exposure = patchRef.get(coaddName, immediate=True)
+        expId = int(patchRef.get(coaddName + "Id"))
+        results = task.run(exposure, task.makeIdFactory(patchRef), expId=expId)
+        if self.config.doWriteDetections:
+            patchRef.put(results.outputSources, coaddName + "_det")
+        if self.config.doWriteCalexp:
+            patchRef.put(results.outputBackgrounds, coaddName + "_calexp_background")
+            if task.config.hasFakes:
+                patchRef.put(results.outputExposure, "fakes_" + coaddName + "_calexp")
+            else:
+                patchRef.put(results.outputExposure, coaddName + "_calexp")
+        return results
+
+    def deblend(self, patchRefDict, exposures, mergedDetections):
+        """Deblend the merged detections in every band.
+
+        Parameters
+        ----------
+        patchRefDict : `dict` of `lsst.daf.persistence.ButlerDataRef`
+            Data references to the coadd of the patch, indexed by filter.
+        exposures : `dict` of `lsst.afw.image.Exposure`
+            Background-subtracted coadds, indexed by filter.
+        mergedDetections : `lsst.afw.table.SourceCatalog`
+            Merged detection catalog.
+
+        Returns
+        -------
+        deblended : `dict` of `lsst.afw.table.SourceCatalog`
+            The deblended catalog to measure in each band, indexed by filter.
+        """
+        task = self.deblendCoaddSources
+        mergedRef = next(iter(patchRefDict.values()))
+        sources = task.convertSources(mergedDetections, task.makeIdFactory(mergedRef))
+        deblended = {}
+        if task.config.simultaneous:
+            filters = list(patchRefDict.keys())
+            exposure = afwImage.MultibandExposure.fromExposures(filters,
+                                                                [exposures[f] for f in filters])
+            fluxCatalogs, templateCatalogs = task.multiBandDeblend.run(exposure, sources)
+            useTemplates = self.config.measureCoaddSources.inputCatalog == "deblendedModel"
+            for filterName in filters:
+                if self.config.doWriteDeblendedSources:
+                    task.write(patchRefDict[filterName], fluxCatalogs[filterName],
+                               templateCatalogs[filterName])
+                deblended[filterName] = (templateCatalogs if useTemplates else fluxCatalogs)[filterName]
+        else:
+            for filterName, patchRef in patchRefDict.items():
+                # The deblender modifies the catalog in place, so each band needs its own copy.
+                bandSources = sources.copy(deep=True)
+                task.singleBandDeblend.run(exposures[filterName], bandSources)
+                if self.config.doWriteDeblendedSources:
+                    task.write(patchRef, bandSources)
+                deblended[filterName] = bandSources
+        return deblended
+
+    def measure(self, patchRef, exposure, inputSources, skyInfo):
+        """Measure the merged sources in a single band.
+
+        Parameters
+        ----------
+        patchRef : `lsst.daf.persistence.ButlerDataRef`
+            Data reference to the coadd.
+        exposure : `lsst.afw.image.Exposure`
+            Background-subtracted coadd.
+        inputSources : `lsst.afw.table.SourceCatalog`
+            Deblended or merged sources to measure.
+        skyInfo : `lsst.pipe.base.Struct`
+            Patch geometry information, from `getSkyInfo`.
+
+        Returns
+        -------
+        sources : `lsst.afw.table.SourceCatalog`
+            The measured sources.
+        """
+        task = self.measureCoaddSources
+        sources = task.convertSources(inputSources, task.makeIdFactory(patchRef))
+        # Capture algorithm metadata to write out to the source catalog.
+        sources.getTable().setMetadata(task.algMetadata)
+        if task.config.doPropagateFlags:
+            ccdInputs = task.propagateFlags.getCcdInputs(exposure)
+        else:
+            ccdInputs = None
+        results = task.run(exposure=exposure, sources=sources, skyInfo=skyInfo,
+                           exposureId=task.getExposureId(patchRef), ccdInputs=ccdInputs,
+                           butler=patchRef.getButler())
+        if self.config.doWriteMeasurements:
+            if task.config.doMatchSources:
+                task.writeMatches(patchRef, results)
+            task.write(patchRef, results.outputSources)
+        return results.outputSources
+
+    def writeMetadata(self, dataRefList):
+        """Write the metadata produced from processing the data.
+
+        Parameters
+        ----------
+        dataRefList : `list` of `lsst.daf.persistence.ButlerDataRef`
+            Data references used to write the metadata.
+        """
+        for dataRef in dataRefList:
+            try:
+                metadataName = self._getMetadataName()
+                if metadataName is not None:
+                    dataRef.put(self.getFullMetadata(), metadataName)
+            except Exception as e:
+                self.log.warn("Could not persist metadata for dataId=%s: %s", dataRef.dataId, e)
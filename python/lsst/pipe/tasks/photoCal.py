@@ -282,13 +282,46 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
         instFluxErr = schema.find(self.config.fluxField + "Err").key
         return pipeBase.Struct(instFlux=instFlux, instFluxErr=instFluxErr)
 
+    @staticmethod
+    def getMatchedRows(catalog, records):
+        """Return the row index in a catalog of each of a sequence of records.
+
+        Records are matched by ID.
+
+        Parameters
+        ----------
+        catalog : `lsst.afw.table.SimpleCatalog` or `None`
+            Contiguous catalog containing the records.
+        records : sequence of `lsst.afw.table.SimpleRecord`
+            Records to locate.
+
+        Returns
+        -------
+        rows : `numpy.ndarray` of `int` or `None`
+            Row index of each record, or `None` if no catalog was given, the
+            catalog is not contiguous or not every record is present in it.
+        """
+        if catalog is None or len(catalog) == 0 or not catalog.isContiguous():
+            return None
+        catIds = catalog["id"]
+        ids = np.array([record.getId() for record in records], dtype=catIds.dtype)
+        order = np.argsort(catIds, kind="stable")
+        pos = np.searchsorted(catIds, ids, sorter=order)
+        pos[pos == len(catIds)] = 0
+        rows = order[pos]
+        if not np.all(catIds[rows] == ids):
+            return None
+        return rows
+
     @pipeBase.timeMethod
-    def extractMagArrays(self, matches, filterName, sourceKeys):
+    def extractMagArrays(self, matches, filterName, sourceKeys, sourceCat=None, refCat=None):
         """!Extract magnitude and magnitude error arrays from the given matches.
 
         @param[in] matches Reference/source matches, a @link lsst::afw::table::ReferenceMatchVector@endlink
         @param[in] filterName  Name of filter being calibrated
         @param[in] sourceKeys  Struct of source catalog keys, as returned by getSourceKeys()
+        @param[in] sourceCat  Contiguous catalog containing the matched sources (optional)
+        @param[in] refCat  Contiguous catalog containing the matched reference objects (optional)
 
         @return Struct containing srcMag, refMag, srcMagErr, refMagErr, and magErr numpy arrays
         where magErr is an error in the magnitude; the error in srcMag - refMag
@@ -298,9 +331,20 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
         (1 or 2 strings)
         @note These magnitude arrays are the @em inputs to the photometric calibration, some may have been
         discarded by clipping while estimating the calibration (https://jira.lsstcorp.org/browse/DM-813)
+        @note If sourceCat and refCat are provided, the matched rows are located once and all quantities
+        are read as columns of those catalogs; otherwise they are read from each matched record.
         """
-        srcInstFluxArr = np.array([m.second.get(sourceKeys.instFlux) for m in matches])
-        srcInstFluxErrArr = np.array([m.second.get(sourceKeys.instFluxErr) for m in matches])
+        if not matches:
+            raise RuntimeError("No reference stars are available")
+        srcRows = self.getMatchedRows(sourceCat, [m.second for m in matches])
+        refRows = self.getMatchedRows(refCat, [m.first for m in matches])
+
+        if srcRows is not None:
+            srcInstFluxArr = sourceCat[sourceKeys.instFlux][srcRows]
+            srcInstFluxErrArr = sourceCat[sourceKeys.instFluxErr][srcRows]
+        else:
+            srcInstFluxArr = np.array([m.second.get(sourceKeys.instFlux) for m in matches])
+            srcInstFluxErrArr = np.array([m.second.get(sourceKeys.instFluxErr) for m in matches])
         if not np.all(np.isfinite(srcInstFluxErrArr)):
             # this is an unpleasant hack; see DM-2308 requesting a better solution
             self.log.warn("Source catalog does not have flux uncertainties; using sqrt(flux).")
@@ -311,8 +355,6 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
         srcInstFluxArr = srcInstFluxArr * referenceFlux
         srcInstFluxErrArr = srcInstFluxErrArr * referenceFlux
 
-        if not matches:
-            raise RuntimeError("No reference stars are available")
         refSchema = matches[0].first.schema
 
         applyColorTerms = self.config.applyColorTerms
@@ -330,15 +372,20 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
                           filterName, self.config.photoCatName, applyCTReason)
             colorterm = self.config.colorterms.getColorterm(
                 filterName=filterName, photoCatName=self.config.photoCatName, doRaise=True)
-            refCat = afwTable.SimpleCatalog(matches[0].first.schema)
 
-            # extract the matched refCat as a Catalog for the colorterm code
-            refCat.reserve(len(matches))
-            for x in matches:
-                record = refCat.addNew()
-                record.assign(x.first)
-
-            refMagArr, refMagErrArr = colorterm.getCorrectedMagnitudes(refCat, filterName)
+            if refRows is not None:
+                # the colorterm code works on columns, so apply it to the whole refCat
+                refMagArr, refMagErrArr = colorterm.getCorrectedMagnitudes(refCat, filterName)
+                refMagArr = refMagArr[refRows]
+                refMagErrArr = refMagErrArr[refRows]
+            else:
+                # extract the matched refCat as a Catalog for the colorterm code
+                matchedRefCat = afwTable.SimpleCatalog(matches[0].first.schema)
+                matchedRefCat.reserve(len(matches))
+                for x in matches:
+                    record = matchedRefCat.addNew()
+                    record.assign(x.first)
+                refMagArr, refMagErrArr = colorterm.getCorrectedMagnitudes(matchedRefCat, filterName)
             fluxFieldList = [getRefFluxField(refSchema, filt) for filt in (colorterm.primary,
                                                                            colorterm.secondary)]
         else:
@@ -349,11 +396,17 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
             fluxFieldList = [getRefFluxField(refSchema, filterName)]
             fluxField = getRefFluxField(refSchema, filterName)
             fluxKey = refSchema.find(fluxField).key
-            refFluxArr = np.array([m.first.get(fluxKey) for m in matches])
+            if refRows is not None:
+                refFluxArr = refCat[fluxKey][refRows]
+            else:
+                refFluxArr = np.array([m.first.get(fluxKey) for m in matches])
 
             try:
                 fluxErrKey = refSchema.find(fluxField + "Err").key
-                refFluxErrArr = np.array([m.first.get(fluxErrKey) for m in matches])
+                if refRows is not None:
+                    refFluxErrArr = refCat[fluxErrKey][refRows]
+                else:
+                    refFluxErrArr = np.array([m.first.get(fluxErrKey) for m in matches])
             except KeyError:
                 # Reference catalogue may not have flux uncertainties; HACK DM-2308
                 self.log.warn("Reference catalog does not have flux uncertainties for %s; using sqrt(flux).",
@@ -462,7 +515,8 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
 
         # Prepare for fitting
         sourceKeys = self.getSourceKeys(matches[0].second.schema)
-        arrays = self.extractMagArrays(matches=matches, filterName=filterName, sourceKeys=sourceKeys)
+        arrays = self.extractMagArrays(matches=matches, filterName=filterName, sourceKeys=sourceKeys,
+                                       sourceCat=sourceCat, refCat=getattr(matchResults, "refCat", None))
 
         # Fit for zeropoint
         r = self.getZeroPoint(arrays.srcMag, arrays.refMag, arrays.magErr)
@@ -537,10 +591,9 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
             dmagErr = np.ones(len(dmag))
 
         # need to remove nan elements to avoid errors in stats calculation with numpy
-        ind_noNan = np.array([i for i in range(len(dmag))
-                              if (not np.isnan(dmag[i]) and not np.isnan(dmagErr[i]))])
-        dmag = dmag[ind_noNan]
-        dmagErr = dmagErr[ind_noNan]
+        noNan = ~(np.isnan(dmag) | np.isnan(dmagErr))
+        dmag = dmag[noNan]
+        dmagErr = dmagErr[noNan]
 
         IQ_TO_STDEV = 0.741301109252802    # 1 sigma in units of interquartile (assume Gaussian)
 
@@ -549,7 +602,7 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
         good = None  # set at end of first iteration
         for i in range(self.config.nIter):
             if i > 0:
-                npt = sum(good)
+                npt = np.count_nonzero(good)
 
             center = None
             if i == 0:
@@ -557,11 +610,11 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
                 # Start by finding the mode
                 #
                 nhist = 20
-                try:
-                    hist, edges = np.histogram(dmag, nhist, new=True)
-                except TypeError:
-                    hist, edges = np.histogram(dmag, nhist)  # they removed new=True around numpy 1.5
-                imode = np.arange(nhist)[np.where(hist == hist.max())]
+                hist, edges = np.histogram(dmag, nhist)
+                imode = np.flatnonzero(hist == hist.max())
+                # cumHist[j] is the number of points in bins below j, i.e. the index into
+                # the sorted dmag of the first point in bin j
+                cumHist = np.concatenate(([0], np.cumsum(hist)))
 
                 if imode[-1] - imode[0] + 1 == len(imode):  # Multiple modes, but all contiguous
                     if zp0:
@@ -569,20 +622,18 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
                     else:
                         center = 0.5*(edges[imode[0]] + edges[imode[-1] + 1])
 
-                    peak = sum(hist[imode])/len(imode)  # peak height
+                    peak = hist[imode].sum()/len(imode)  # peak height
 
-                    # Estimate FWHM of mode
-                    j = imode[0]
-                    while j >= 0 and hist[j] > 0.5*peak:
-                        j -= 1
-                    j = max(j, 0)
-                    q1 = dmag[sum(hist[range(j)])]
+                    # Estimate FWHM of mode: find the nearest bins on either side of the
+                    # mode which are no more than half the peak height
+                    halfMax = hist <= 0.5*peak
+                    below = np.flatnonzero(halfMax[:imode[0] + 1])
+                    j = below[-1] if len(below) > 0 else 0
+                    q1 = dmag[cumHist[j]]
 
-                    j = imode[-1]
-                    while j < nhist and hist[j] > 0.5*peak:
-                        j += 1
-                    j = min(j, nhist - 1)
-                    j = min(sum(hist[range(j)]), npt - 1)
+                    above = np.flatnonzero(halfMax[imode[-1]:])
+                    j = imode[-1] + above[0] if len(above) > 0 else nhist - 1
+                    j = min(cumHist[j], npt - 1)
                     q3 = dmag[j]
 
                     if q1 == q3:
@@ -676,7 +727,7 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
             # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 
             old_ngood = ngood
-            ngood = sum(good)
+            ngood = np.count_nonzero(good)
             if ngood == 0:
                 msg = "PhotoCal.getZeroPoint: no good stars remain"
 
@@ -707,3 +758,46 @@ into your debug.py file and run photoCalTask.py with the @c --debug flag.
             sigma=sigma,
             ngood=len(dmag),
         )
+
+    def getZeroPointForEachGroup(self, src, ref, groups, srcErr=None, zp0=None):
+        """!Convenience wrapper calling getZeroPoint for each exposure (e.g. each CCD of a visit)
+
+        @param[in] src     Stacked source magnitudes of all exposures
+        @param[in] ref     Stacked reference magnitudes, matching src
+        @param[in] groups  Exposure (e.g. CCD) identifier of each element of src
+        @param[in] srcErr  Stacked magnitude errors, matching src (optional)
+        @param[in] zp0     Initial guess for the zero point, as for getZeroPoint (optional)
+
+        This only saves the caller the splitting of stacked arrays: each group is solved in turn with
+        getZeroPoint, so the result for a group is identical to a getZeroPoint call on that group's
+        arrays alone, and takes as long.
+
+        @return Struct of numpy arrays, with one element per distinct group in sorted order:
+         - groups ------ Group identifiers
+         - zp ---------- Photometric zero point (mag)
+         - sigma ------- Standard deviation of fit of zero point (mag)
+         - ngood ------- Number of sources used to fit zero point
+        """
+        src = np.asarray(src)
+        ref = np.asarray(ref)
+        groups = np.asarray(groups)
+        order = np.argsort(groups, kind="stable")
+        uniqueGroups, starts = np.unique(groups[order], return_index=True)
+        ranges = zip(starts, np.append(starts[1:], len(order)))
+
+        zp = np.empty(len(uniqueGroups))
+        sigma = np.empty(len(uniqueGroups))
+        ngood = np.empty(len(uniqueGroups), dtype=int)
+        for i, (start, stop) in enumerate(ranges):
+            indices = order[start:stop]
+            r = self.getZeroPoint(src[indices], ref[indices],
+                                  srcErr=None if srcErr is None else np.asarray(srcErr)[indices], zp0=zp0)
+            zp[i] = r.zp
+            sigma[i] = r.sigma
+            ngood[i] = r.ngood
+        return pipeBase.Struct(
+            groups=uniqueGroups,
+            zp=zp,
+            sigma=sigma,
+            ngood=ngood,
+        )
@@ -20,9 +20,13 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import itertools
+
 import numpy
+from scipy.spatial import cKDTree
+
 from lsst.pex.config import Config, Field, DictField
-from lsst.pipe.base import Task
+from lsst.pipe.base import Struct, Task
 import lsst.afw.geom as afwGeom
 import lsst.afw.table as afwTable
 import lsst.pex.exceptions as pexExceptions
@@ -177,23 +181,22 @@ task.run(butler, coaddCatalog, ccdInputs, coaddExposure.getWcs())
 
         flags = self._keys.keys()
         counts = dict((f, numpy.zeros(len(coaddSources), dtype=int)) for f in flags)
-        indices = numpy.array([s.getId() for s in coaddSources])  # Allowing for non-contiguous data
+        # Build a spatial index of the coadd sources once, and reuse it for matching every flag of every
+        # input CCD.  The matching radius is converted to the chord length between unit vectors.
+        coaddTree = cKDTree(self._getUnitVectors(coaddSources))
         radius = self.config.matchRadius*afwGeom.arcseconds
+        chordRadius = 2.0*numpy.sin(0.5*radius.asRadians())
 
-        def processCcd(ccdSources, wcsUpdate):
-            for sourceRecord in ccdSources:
-                sourceRecord.updateCoord(wcsUpdate)
+        def processCcd(ccdData):
             for flag in flags:
-                # We assume that the flags will be relatively rare, so it is more efficient to match
-                # against a subset of the input catalog for each flag than it is to match once against
-                # the entire catalog.  It would be best to have built a kd-tree on coaddSources and
-                # keep reusing that for the matching, but we don't have a suitable implementation.
-                mc = afwTable.MatchControl()
-                mc.findOnlyClosest = False
-                matches = afwTable.matchRaDec(coaddSources, ccdSources[ccdSources.get(flag)], radius, mc)
-                for m in matches:
-                    index = (numpy.where(indices == m.first.getId()))[0][0]
-                    counts[flag][index] += 1
+                # Every coadd source within the matching radius of a flagged input source is counted,
+                # as for a match with findOnlyClosest=False.
+                isFlagged = ccdData.flags[flag]
+                if not numpy.any(isFlagged):
+                    continue
+                matched = coaddTree.query_ball_point(ccdData.vectors[isFlagged], chordRadius)
+                rows = numpy.fromiter(itertools.chain.from_iterable(matched), dtype=int)
+                numpy.add.at(counts[flag], rows, 1)
 
         if visitCatalogs is not None:
             if wcsUpdates is None:
@@ -201,7 +204,7 @@ task.run(butler, coaddCatalog, ccdInputs, coaddExposure.getWcs())
                                                " updates for each catalog must be supplied in the "
                                                "wcsUpdates parameter")
             for i, ccdSource in enumerate(visitCatalogs):
-                processCcd(ccdSource, wcsUpdates[i])
+                processCcd(self.extractVisitData(ccdSource, wcsUpdates[i]))
         else:
             if ccdInputs is None:
                 raise pexExceptions.ValueError("The visitCatalogs and ccdInput parameters can't both be None")
@@ -210,18 +213,75 @@ task.run(butler, coaddCatalog, ccdInputs, coaddExposure.getWcs())
 
             self.log.info("Propagating flags %s from inputs" % (flags,))
 
-            # Accumulate counts of flags being set
+            # Accumulate counts of flags being set.  The catalogs are read one at a time from this
+            # thread: the Gen2 butler is not thread-safe (its sqlite registry connections may only be
+            # used from the thread that opened them), so the reads must not be run concurrently.
             for ccdRecord in ccdInputs:
-                v = ccdRecord.get(visitKey)
-                c = ccdRecord.get(ccdKey)
-                dataId = {"visit": int(v), self.config.ccdName: int(c)}
-                ccdSources = butler.get("src", dataId=dataId, immediate=True)
-                processCcd(ccdSources, ccdRecord.getWcs())
+                dataId = {"visit": int(ccdRecord.get(visitKey)),
+                          self.config.ccdName: int(ccdRecord.get(ccdKey))}
+                processCcd(self.readVisitData(butler, dataId, ccdRecord.getWcs()))
 
         # Apply threshold
+        numOverlaps = numpy.array([len(ccdInputs.subsetContaining(s.getCentroid(), coaddWcs, True))
+                                   for s in coaddSources], dtype=int)
         for f in flags:
             key = self._keys[f]
-            for s, num in zip(coaddSources, counts[f]):
-                numOverlaps = len(ccdInputs.subsetContaining(s.getCentroid(), coaddWcs, True))
-                s.setFlag(key, bool(num > numOverlaps*self.config.flags[f]))
-            self.log.info("Propagated %d sources with flag %s" % (sum(s.get(key) for s in coaddSources), f))
+            isSet = counts[f] > numOverlaps*self.config.flags[f]
+            for s, value in zip(coaddSources, isSet):
+                s.setFlag(key, bool(value))
+            self.log.info("Propagated %d sources with flag %s" % (numpy.count_nonzero(isSet), f))
+
+    def readVisitData(self, butler, dataId, wcsUpdate):
+        """!Read an input source catalog and extract the positions and flags needed to propagate flags
+
+        The Footprints, which are not needed, are not read.
+
+        @param[in] butler  Data butler, for retrieving the input source catalog
+        @param[in] dataId  Data identifier of the input source catalog
+        @param[in] wcsUpdate  Wcs to use to update the coordinates of the sources
+        @return struct as returned by extractVisitData
+        """
+        ccdSources = butler.get("src", dataId=dataId, flags=afwTable.SOURCE_IO_NO_FOOTPRINTS, immediate=True)
+        return self.extractVisitData(ccdSources, wcsUpdate)
+
+    def extractVisitData(self, ccdSources, wcsUpdate):
+        """!Update the coordinates of an input source catalog and extract its positions and flags
+
+        @param[in,out] ccdSources  Source catalog from an input CCD; coordinates are updated in place
+        @param[in] wcsUpdate  Wcs to use to update the coordinates of the sources
+        @return struct with fields:
+          - vectors: unit vectors of the updated source coordinates, numpy array of shape (N, 3)
+          - flags: dict of flag name: boolean numpy array of the values of each propagated flag
+        """
+        afwTable.updateSourceCoords(wcsUpdate, ccdSources)
+        return Struct(vectors=self._getUnitVectors(ccdSources),
+                      flags=dict((f, self._getFlagArray(ccdSources, f)) for f in self._keys))
+
+    @staticmethod
+    def _getUnitVectors(catalog):
+        """!Return the unit vectors of the coordinates of a source catalog
+
+        @param[in] catalog  Source catalog; need not be contiguous
+        @return numpy array of shape (len(catalog), 3)
+        """
+        if catalog.isContiguous():
+            ra = catalog["coord_ra"]
+            dec = catalog["coord_dec"]
+        else:
+            coords = [s.getCoord() for s in catalog]
+            ra = numpy.array([c.getRa().asRadians() for c in coords])
+            dec = numpy.array([c.getDec().asRadians() for c in coords])
+        cosDec = numpy.cos(dec)
+        return numpy.stack([cosDec*numpy.cos(ra), cosDec*numpy.sin(ra), numpy.sin(dec)], axis=-1)
+
+    @staticmethod
+    def _getFlagArray(catalog, flag):
+        """!Return the values of a flag for all sources in a catalog as a boolean array
+
+        @param[in] catalog  Source catalog; need not be contiguous
+        @param[in] flag  Name of the flag
+        """
+        if catalog.isContiguous():
+            return catalog.get(flag)
+        key = catalog.schema.find(flag).key
+        return numpy.array([s.get(key) for s in catalog], dtype=bool)
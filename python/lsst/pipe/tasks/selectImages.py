@@ -19,6 +19,12 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import fcntl
+import os
+import pickle
+import tempfile
+from contextlib import contextmanager
+
 import numpy as np
 import lsst.sphgeom
 import lsst.pex.config as pexConfig
@@ -27,7 +33,8 @@ import lsst.afw.geom as afwGeom
 import lsst.pipe.base as pipeBase
 
 __all__ = ["BaseSelectImagesTask", "BaseExposureInfo", "WcsSelectImagesTask", "PsfWcsSelectImagesTask",
-           "DatabaseSelectImagesConfig", "BestSeeingWcsSelectImagesTask"]
+           "DatabaseSelectImagesConfig", "BestSeeingWcsSelectImagesTask", "ImageFootprintIndex",
+           "PsfQualityTable"]
 
 
 class DatabaseSelectImagesConfig(pexConfig.Config):
@@ -167,9 +174,273 @@ class SelectStruct(pipeBase.Struct):
         super(SelectStruct, self).__init__(dataRef=dataRef, wcs=wcs, bbox=bbox)
 
 
+def _dataIdKey(dataId):
+    """Return a hashable version of a data ID"""
+    if isinstance(dataId, dict):
+        return tuple(sorted(dataId.items()))
+    return dataId
+
+
+def _writePickle(obj, filename):
+    """Pickle an object to a file, replacing the file atomically
+
+    The object is written to a temporary file in the same directory, which is
+    then renamed, so concurrent readers never see a partially written file.
+    """
+    fd, tempName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                    prefix=os.path.basename(filename) + ".")
+    try:
+        with os.fdopen(fd, "wb") as tempFile:
+            pickle.dump(obj, tempFile)
+        os.replace(tempName, filename)
+    except BaseException:
+        os.unlink(tempName)
+        raise
+
+
+@contextmanager
+def _lockFile(filename):
+    """Hold an exclusive lock on a file, to serialize updates between processes"""
+    with open(filename, "a") as fd:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd.fileno(), fcntl.LOCK_UN)
+
+
+def _calexpFingerprint(dataRef):
+    """Return the size and modification time of the calexp of a data reference, or None if unknown"""
+    try:
+        stat = os.stat(dataRef.getUri("calexp"))
+    except Exception:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class ImageFootprintIndex:
+    """Spatial index of image footprints on the sky
+
+    Each image is stored once, as the sky positions of its corners, and is
+    registered in every HTM pixel that its footprint polygon may touch. Finding
+    the images overlapping a region is then a lookup of the region's HTM pixels
+    followed by an exact polygon intersection test on the few candidates.
+
+    The index may be written to and read from a file, so that it can be shared
+    between processes and runs. The HTM pixel ranges of each image are stored
+    in the file, so reading it does not recompute any footprint polygon; the
+    polygons of the candidates of a query are built when first needed. Each
+    image may be stored with a fingerprint of the inputs its footprint was
+    computed from, so that stale entries can be recognized and replaced.
+    """
+
+    def __init__(self, level=8):
+        """Construct an empty index
+
+        @param level: HTM subdivision level of the pixels used for the index
+        """
+        self.level = level
+        self.pixelization = lsst.sphgeom.HtmPixelization(level)
+        self.dataIds = []
+        self._vertices = []  # corner unit vectors of each image, or None if the image is unusable
+        self._ranges = []  # HTM pixel ranges [begin, end) touched by each image
+        self._coordLists = []
+        self._polygons = []
+        self._fingerprints = []
+        self._pixelMap = {}  # HTM pixel index: list of image indices
+        self._keyMap = {}  # data ID key: image index
+
+    def __len__(self):
+        return len(self.dataIds)
+
+    def add(self, dataId, coordList, fingerprint=None):
+        """Add an image to the index
+
+        @param dataId: data ID of the image
+        @param coordList: ICRS coordinates of the image corners (list of lsst.afw.geom.SpherePoint),
+            or None if the footprint of the image is unknown
+        @param fingerprint: picklable summary of the inputs the footprint was computed from, or None
+        @return the index of the image, for use with getCoordList
+        """
+        vertices, polygon, ranges = self._makePolygon(coordList)
+        return self._append(dataId, vertices, ranges, coordList if polygon is not None else None, polygon,
+                            fingerprint)
+
+    def replace(self, imageIndex, coordList, fingerprint=None):
+        """Replace the footprint of an image already in the index
+
+        @param imageIndex: index of the image, as returned by add or find
+        @param coordList: ICRS coordinates of the image corners (list of lsst.afw.geom.SpherePoint),
+            or None if the footprint of the image is unknown
+        @param fingerprint: picklable summary of the inputs the footprint was computed from, or None
+        """
+        for begin, end in self._ranges[imageIndex]:
+            for pixel in range(begin, end):
+                self._pixelMap[pixel].remove(imageIndex)
+                if not self._pixelMap[pixel]:
+                    del self._pixelMap[pixel]
+        vertices, polygon, ranges = self._makePolygon(coordList)
+        self._vertices[imageIndex] = vertices
+        self._ranges[imageIndex] = ranges
+        self._coordLists[imageIndex] = coordList if polygon is not None else None
+        self._polygons[imageIndex] = polygon
+        self._fingerprints[imageIndex] = fingerprint
+        self._register(imageIndex, ranges)
+
+    def set(self, dataId, coordList, fingerprint=None):
+        """Add an image to the index, or replace its footprint if it is already present
+
+        @return the index of the image, for use with getCoordList
+        """
+        imageIndex = self.find(dataId)
+        if imageIndex is None:
+            return self.add(dataId, coordList, fingerprint)
+        self.replace(imageIndex, coordList, fingerprint)
+        return imageIndex
+
+    def _makePolygon(self, coordList):
+        """Return the corner unit vectors, polygon and HTM pixel ranges of a footprint"""
+        if coordList is None:
+            return None, None, []
+        polygon = lsst.sphgeom.ConvexPolygon.convexHull([coord.getVector() for coord in coordList])
+        if polygon is None:
+            return None, None, []
+        vertices = [(v.x(), v.y(), v.z()) for v in (coord.getVector() for coord in coordList)]
+        return vertices, polygon, [(begin, end) for begin, end in self.pixelization.envelope(polygon)]
+
+    def _append(self, dataId, vertices, ranges, coordList, polygon, fingerprint):
+        imageIndex = len(self.dataIds)
+        self.dataIds.append(dataId)
+        self._vertices.append(vertices)
+        self._ranges.append(ranges)
+        self._coordLists.append(coordList)
+        self._polygons.append(polygon)
+        self._fingerprints.append(fingerprint)
+        self._keyMap.setdefault(_dataIdKey(dataId), imageIndex)
+        self._register(imageIndex, ranges)
+        return imageIndex
+
+    def _register(self, imageIndex, ranges):
+        for begin, end in ranges:
+            for pixel in range(begin, end):
+                self._pixelMap.setdefault(pixel, []).append(imageIndex)
+
+    def find(self, dataId):
+        """Return the index of the image with the given data ID, or None if it has not been added"""
+        return self._keyMap.get(_dataIdKey(dataId))
+
+    def getFingerprint(self, imageIndex):
+        """Return the fingerprint an image was added with"""
+        return self._fingerprints[imageIndex]
+
+    def getCoordList(self, imageIndex):
+        """Return the ICRS coordinates of the corners of an image, or None if its footprint is unknown"""
+        if self._coordLists[imageIndex] is None and self._vertices[imageIndex] is not None:
+            self._coordLists[imageIndex] = [afwGeom.SpherePoint(lsst.sphgeom.Vector3d(*v))
+                                            for v in self._vertices[imageIndex]]
+        return self._coordLists[imageIndex]
+
+    def _getPolygon(self, imageIndex):
+        if self._polygons[imageIndex] is None and self._vertices[imageIndex] is not None:
+            self._polygons[imageIndex] = lsst.sphgeom.ConvexPolygon.convexHull(
+                [lsst.sphgeom.Vector3d(*v) for v in self._vertices[imageIndex]])
+        return self._polygons[imageIndex]
+
+    def query(self, coordList):
+        """Find the images whose footprints overlap a region
+
+        @param coordList: ICRS coordinates (list of lsst.afw.geom.SpherePoint) of the vertices of the
+            region, or None for the whole sky
+        @return sorted list of the indices of the overlapping images
+        """
+        if coordList is None:
+            return [i for i, vertices in enumerate(self._vertices) if vertices is not None]
+        region = lsst.sphgeom.ConvexPolygon.convexHull([coord.getVector() for coord in coordList])
+        ranges = self.pixelization.envelope(region)
+        candidates = set()
+        if sum(end - begin for begin, end in ranges) < len(self._pixelMap):
+            for begin, end in ranges:
+                for pixel in range(begin, end):
+                    candidates.update(self._pixelMap.get(pixel, ()))
+        else:
+            for pixel, imageIndices in self._pixelMap.items():
+                if ranges.contains(pixel):
+                    candidates.update(imageIndices)
+        # "intersects" also covers "contains" or "is contained by"
+        return sorted(i for i in candidates if region.intersects(self._getPolygon(i)))
+
+    def write(self, filename):
+        """Write the index to a file, replacing it atomically"""
+        _writePickle(dict(level=self.level, dataIds=self.dataIds, vertices=self._vertices,
+                          ranges=self._ranges, fingerprints=self._fingerprints), filename)
+
+    @classmethod
+    def read(cls, filename):
+        """Read an index written by write()"""
+        with open(filename, "rb") as fd:
+            contents = pickle.load(fd)
+        index = cls(level=contents["level"])
+        numImages = len(contents["dataIds"])
+        # Indexes written without fingerprints are treated as stale wherever fingerprints are compared
+        fingerprints = contents.get("fingerprints", [None]*numImages)
+        rangesList = contents.get("ranges", [None]*numImages)
+        for dataId, vertices, ranges, fingerprint in zip(contents["dataIds"], contents["vertices"],
+                                                         rangesList, fingerprints):
+            polygon = None
+            if ranges is None:
+                # Written before the pixel ranges were stored
+                coordList = None
+                if vertices is not None:
+                    coordList = [afwGeom.SpherePoint(lsst.sphgeom.Vector3d(*v)) for v in vertices]
+                vertices, polygon, ranges = index._makePolygon(coordList)
+            index._append(dataId, vertices, ranges, None, polygon, fingerprint)
+        return index
+
+    @classmethod
+    def update(cls, filename, entries, level=8):
+        """Set footprints in an index file, preserving those written meanwhile by other processes
+
+        The file is locked while it is read, updated and written back, so that
+        concurrent updates are merged rather than overwriting each other.
+
+        @param filename: name of the index file; it is created if it does not exist
+        @param entries: list of (dataId, coordList, fingerprint) of the footprints to set
+        @param level: HTM subdivision level of the index, if the file does not exist
+        @return the updated ImageFootprintIndex
+        """
+        with _lockFile(filename + ".lock"):
+            index = cls.read(filename) if os.path.exists(filename) else cls(level=level)
+            for dataId, coordList, fingerprint in entries:
+                index.set(dataId, coordList, fingerprint)
+            index.write(filename)
+        return index
+
+
+# Footprint index of the most recent list of images, shared between task instances in a process
+_footprintIndexCache = {}
+
+
+class WcsSelectImagesConfig(pexConfig.Config):
+    htmLevel = pexConfig.Field(
+        doc="HTM subdivision level of the image footprint index",
+        dtype=int,
+        default=8,
+    )
+    footprintIndexFile = pexConfig.Field(
+        doc="File holding the image footprint index; it is created if it does not exist, and images "
+            "missing from it are added, under a lock held on '<footprintIndexFile>.lock'. "
+            "If None, the index is only kept in memory.",
+        dtype=str,
+        default=None,
+        optional=True,
+    )
+
+
 class WcsSelectImagesTask(BaseSelectImagesTask):
     """Select images using their Wcs"""
 
+    ConfigClass = WcsSelectImagesConfig
+
     def runDataRef(self, dataRef, coordList, makeDataRefList=True, selectDataList=[]):
         """Select images in the selectDataList that overlap the patch
 
@@ -181,6 +452,10 @@ class WcsSelectImagesTask(BaseSelectImagesTask):
         directly because the standard for the inputs to ConvexPolygon
         are pretty high and we don't want to be responsible for reaching them.
 
+        The image polygons are kept in an ImageFootprintIndex, which is reused
+        for later patches with the same selectDataList and, if
+        config.footprintIndexFile is set, persisted.
+
         @param dataRef: Data reference for coadd/tempExp (with tract, patch)
         @param coordList: List of ICRS coordinates (lsst.afw.geom.SpherePoint) specifying boundary of patch
         @param makeDataRefList: Construct a list of data references?
@@ -189,37 +464,204 @@ class WcsSelectImagesTask(BaseSelectImagesTask):
         dataRefList = []
         exposureInfoList = []
 
-        patchVertices = [coord.getVector() for coord in coordList]
-        patchPoly = lsst.sphgeom.ConvexPolygon.convexHull(patchVertices)
-
-        for data in selectDataList:
-            dataRef = data.dataRef
-            imageWcs = data.wcs
-            imageBox = data.bbox
-
-            try:
-                imageCorners = [imageWcs.pixelToSky(pix) for pix in afwGeom.Box2D(imageBox).getCorners()]
-            except (pexExceptions.DomainError, pexExceptions.RuntimeError) as e:
-                # Protecting ourselves from awful Wcs solutions in input images
-                self.log.debug("WCS error in testing calexp %s (%s): deselecting", dataRef.dataId, e)
-                continue
-
-            imagePoly = lsst.sphgeom.ConvexPolygon.convexHull([coord.getVector() for coord in imageCorners])
-            if imagePoly is None:
-                self.log.debug("Unable to create polygon from image %s: deselecting", dataRef.dataId)
-                continue
-            if patchPoly.intersects(imagePoly):  # "intersects" also covers "contains" or "is contained by"
-                self.log.info("Selecting calexp %s" % dataRef.dataId)
-                dataRefList.append(dataRef)
-                exposureInfoList.append(BaseExposureInfo(dataRef.dataId, imageCorners))
+        if selectDataList:
+            index, imageIndices = self.getFootprintIndex(selectDataList)
+            overlapping = set(index.query(coordList))
+            for data, imageIndex in zip(selectDataList, imageIndices):
+                if imageIndex in overlapping:
+                    dataRef = data.dataRef
+                    self.log.info("Selecting calexp %s" % dataRef.dataId)
+                    dataRefList.append(dataRef)
+                    exposureInfoList.append(BaseExposureInfo(dataRef.dataId, index.getCoordList(imageIndex)))
 
         return pipeBase.Struct(
             dataRefList=dataRefList if makeDataRefList else None,
             exposureInfoList=exposureInfoList,
         )
 
+    def getFootprintIndex(self, selectDataList):
+        """Return the footprint index of the images in selectDataList
+
+        The index is cached by the data IDs of selectDataList, so the image
+        footprints are only computed once per process for a given list of
+        images, even if the list is pickled and sent to that process for each
+        patch. If config.footprintIndexFile is set, footprints are read from
+        that file; any images missing from it, or whose fingerprint (see
+        getFingerprint) has changed, are computed and merged back into it (see
+        ImageFootprintIndex.update).
+
+        @param selectDataList: List of SelectStruct
+        @return the ImageFootprintIndex, and a list of the index of each element of selectDataList
+            in it
+        """
+        cacheKey = (self.config.htmLevel, self.config.footprintIndexFile,
+                    tuple(_dataIdKey(data.dataRef.dataId) for data in selectDataList))
+        cached = _footprintIndexCache.get("select")
+        if cached is not None and cached[0] == cacheKey:
+            return cached[1], cached[2]
+
+        filename = self.config.footprintIndexFile
+        if filename and os.path.exists(filename):
+            index = ImageFootprintIndex.read(filename)
+        else:
+            index = ImageFootprintIndex(level=self.config.htmLevel)
+
+        entries = []  # footprints computed here: (dataId, coordList, fingerprint)
+        for data in selectDataList:
+            fingerprint = None
+            if filename:
+                imageIndex = index.find(data.dataRef.dataId)
+                fingerprint = self.getFingerprint(data)
+                if imageIndex is not None and index.getFingerprint(imageIndex) == fingerprint:
+                    continue
+                if imageIndex is not None:
+                    self.log.debug("Footprint of image %s is stale: recomputing", data.dataRef.dataId)
+            entries.append((data.dataRef.dataId, self.getImageCorners(data), fingerprint))
+
+        if filename and entries:
+            index = ImageFootprintIndex.update(filename, entries, level=self.config.htmLevel)
+        else:
+            for dataId, coordList, fingerprint in entries:
+                index.set(dataId, coordList, fingerprint)
+        for dataId, coordList, fingerprint in entries:
+            if coordList is not None and index.getCoordList(index.find(dataId)) is None:
+                self.log.debug("Unable to create polygon from image %s: deselecting", dataId)
+        imageIndices = [index.find(data.dataRef.dataId) for data in selectDataList]
+
+        _footprintIndexCache["select"] = (cacheKey, index, imageIndices)
+        return index, imageIndices
+
+    def getFingerprint(self, data):
+        """Return a summary of the inputs the footprint of an image is computed from
+
+        The fingerprint is made of the image bounding box and the size and
+        modification time of the calexp file, if known; a footprint read from
+        config.footprintIndexFile is recomputed if it differs.
+
+        @param data: SelectStruct for the image
+        """
+        bbox = data.bbox
+        return ((bbox.getMinX(), bbox.getMinY(), bbox.getMaxX(), bbox.getMaxY()),
+                _calexpFingerprint(data.dataRef))
 
-class PsfWcsSelectImagesConfig(pexConfig.Config):
+    def getImageCorners(self, data):
+        """Return the ICRS coordinates of the corners of an image, or None if its Wcs is unusable
+
+        @param data: SelectStruct for the image
+        """
+        try:
+            return [data.wcs.pixelToSky(pix) for pix in afwGeom.Box2D(data.bbox).getCorners()]
+        except (pexExceptions.DomainError, pexExceptions.RuntimeError) as e:
+            # Protecting ourselves from awful Wcs solutions in input images
+            self.log.debug("WCS error in testing calexp %s (%s): deselecting", data.dataRef.dataId, e)
+            return None
+
+
+class PsfQualityTable:
+    """Per-CCD summary of PSF quality, keyed by data ID
+
+    Each row is a dict of named quantities (e.g. PSF size and FWHM, median
+    ellipticity residual, size residual scatter). Rows are filled lazily by the
+    select tasks that need them, and the table may be persisted so that they are
+    computed only once per CCD. Each row may carry a fingerprint of the inputs
+    it was computed from; a row is discarded if it is requested or updated with
+    a different fingerprint.
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self.modified = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, dataId, names, fingerprint=None):
+        """Return a dict of the requested quantities for a CCD, or None if any of them is missing
+
+        Quantities recorded with a different fingerprint are considered missing.
+        """
+        row = self._rows.get(_dataIdKey(dataId))
+        if row is None or row.get("fingerprint") != fingerprint or any(name not in row for name in names):
+            return None
+        return {name: row[name] for name in names}
+
+    def set(self, dataId, fingerprint=None, **values):
+        """Record quantities for a CCD
+
+        Quantities previously recorded with a different fingerprint are discarded.
+        """
+        key = _dataIdKey(dataId)
+        row = self._rows.get(key)
+        if row is None or row.get("fingerprint") != fingerprint:
+            row = self._rows[key] = dict(fingerprint=fingerprint)
+        row.update(values)
+        self.modified = True
+
+    def write(self, filename):
+        """Write the table to a file, replacing it atomically"""
+        _writePickle(self._rows, filename)
+        self.modified = False
+
+    @classmethod
+    def read(cls, filename):
+        """Read a table written by write()"""
+        table = cls()
+        with open(filename, "rb") as fd:
+            table._rows = pickle.load(fd)
+        return table
+
+
+# PSF quality tables read from files, shared between task instances in a process
+_psfQualityCache = {}
+
+
+class PsfQualitySelectImagesConfig(WcsSelectImagesConfig):
+    psfQualityFile = pexConfig.Field(
+        doc="File holding the per-CCD PSF quality table; it is created if it does not exist, and CCDs "
+            "missing from it are added. If None, PSF quality is computed for every selection.",
+        dtype=str,
+        default=None,
+        optional=True,
+    )
+
+
+class PsfQualitySelectImagesTask(WcsSelectImagesTask):
+    """Base class for tasks selecting images using their Wcs and a per-CCD PSF quality table"""
+
+    ConfigClass = PsfQualitySelectImagesConfig
+
+    def __init__(self, *args, **kwargs):
+        WcsSelectImagesTask.__init__(self, *args, **kwargs)
+        filename = self.config.psfQualityFile
+        if not filename:
+            self.psfQuality = PsfQualityTable()
+        elif filename in _psfQualityCache:
+            self.psfQuality = _psfQualityCache[filename]
+        else:
+            if os.path.exists(filename):
+                self.psfQuality = PsfQualityTable.read(filename)
+            else:
+                self.psfQuality = PsfQualityTable()
+            _psfQualityCache[filename] = self.psfQuality
+
+    def writePsfQuality(self):
+        """Persist the PSF quality table, if configured and modified"""
+        if self.config.psfQualityFile and self.psfQuality.modified:
+            self.psfQuality.write(self.config.psfQualityFile)
+
+    def getQualityFingerprint(self, dataRef):
+        """Return a summary of the inputs the PSF quality of a CCD is computed from
+
+        The fingerprint is the size and modification time of the calexp file, if
+        known, so that rows of the PSF quality table are recomputed when the CCD
+        is reprocessed.
+
+        @param dataRef: data reference for the CCD
+        """
+        return _calexpFingerprint(dataRef)
+
+
+class PsfWcsSelectImagesConfig(PsfQualitySelectImagesConfig):
     maxEllipResidual = pexConfig.Field(
         doc="Maximum median ellipticity residual",
         dtype=float,
@@ -259,7 +701,7 @@ def sigmaMad(array):
     return 1.4826*np.median(np.abs(array - np.median(array)))
 
 
-class PsfWcsSelectImagesTask(WcsSelectImagesTask):
+class PsfWcsSelectImagesTask(PsfQualitySelectImagesTask):
     """Select images using their Wcs and cuts on the PSF properties"""
 
     ConfigClass = PsfWcsSelectImagesConfig
@@ -277,6 +719,9 @@ class PsfWcsSelectImagesTask(WcsSelectImagesTask):
           - the robust scatter of the size residuals scaled by the square of
             the median size
 
+        The residual statistics of each CCD are taken from the PSF quality table,
+        and only computed from the src catalog if they are not there yet.
+
         @param dataRef: Data reference for coadd/tempExp (with tract, patch)
         @param coordList: List of ICRS coordinates (lsst.afw.geom.SpherePoint) specifying boundary of patch
         @param makeDataRefList: Construct a list of data references?
@@ -288,32 +733,10 @@ class PsfWcsSelectImagesTask(WcsSelectImagesTask):
         dataRefList = []
         exposureInfoList = []
         for dataRef, exposureInfo in zip(result.dataRefList, result.exposureInfoList):
-            butler = dataRef.butlerSubset.butler
-            srcCatalog = butler.get('src', dataRef.dataId)
-            mask = srcCatalog[self.config.starSelection]
-
-            starXX = srcCatalog[self.config.starShape+'_xx'][mask]
-            starYY = srcCatalog[self.config.starShape+'_yy'][mask]
-            starXY = srcCatalog[self.config.starShape+'_xy'][mask]
-            psfXX = srcCatalog[self.config.psfShape+'_xx'][mask]
-            psfYY = srcCatalog[self.config.psfShape+'_yy'][mask]
-            psfXY = srcCatalog[self.config.psfShape+'_xy'][mask]
-
-            starSize = np.power(starXX*starYY - starXY**2, 0.25)
-            starE1 = (starXX - starYY)/(starXX + starYY)
-            starE2 = 2*starXY/(starXX + starYY)
-            medianSize = np.median(starSize)
-
-            psfSize = np.power(psfXX*psfYY - psfXY**2, 0.25)
-            psfE1 = (psfXX - psfYY)/(psfXX + psfYY)
-            psfE2 = 2*psfXY/(psfXX + psfYY)
-
-            medianE1 = np.abs(np.median(starE1 - psfE1))
-            medianE2 = np.abs(np.median(starE2 - psfE2))
-            medianE = np.sqrt(medianE1**2 + medianE2**2)
-
-            scatterSize = sigmaMad(starSize - psfSize)
-            scaledScatterSize = scatterSize/medianSize**2
+            quality = self.getPsfResiduals(dataRef)
+            medianE = quality["medianE"]
+            scatterSize = quality["scatterSize"]
+            scaledScatterSize = quality["scaledScatterSize"]
 
             valid = True
             if self.config.maxEllipResidual and medianE > self.config.maxEllipResidual:
@@ -335,13 +758,60 @@ class PsfWcsSelectImagesTask(WcsSelectImagesTask):
             dataRefList.append(dataRef)
             exposureInfoList.append(exposureInfo)
 
+        self.writePsfQuality()
         return pipeBase.Struct(
             dataRefList=dataRefList,
             exposureInfoList=exposureInfoList,
         )
 
+    def getPsfResiduals(self, dataRef):
+        """Return the PSF residual statistics of a CCD, computing them from its src catalog if needed
 
-class BestSeeingWcsSelectImageConfig(WcsSelectImagesTask.ConfigClass):
+        @param dataRef: data reference for the CCD
+        @return dict with medianE, scatterSize, scaledScatterSize and medianSize
+        """
+        # The statistics depend on which measurements are compared, so those are part of the column names
+        suffix = "_%s_%s_%s" % (self.config.starSelection, self.config.starShape, self.config.psfShape)
+        names = ("medianE", "scatterSize", "scaledScatterSize", "medianSize")
+        fingerprint = self.getQualityFingerprint(dataRef)
+        quality = self.psfQuality.get(dataRef.dataId, [name + suffix for name in names], fingerprint)
+        if quality is not None:
+            return {name: quality[name + suffix] for name in names}
+
+        butler = dataRef.butlerSubset.butler
+        srcCatalog = butler.get('src', dataRef.dataId)
+        mask = srcCatalog[self.config.starSelection]
+
+        starXX = srcCatalog[self.config.starShape+'_xx'][mask]
+        starYY = srcCatalog[self.config.starShape+'_yy'][mask]
+        starXY = srcCatalog[self.config.starShape+'_xy'][mask]
+        psfXX = srcCatalog[self.config.psfShape+'_xx'][mask]
+        psfYY = srcCatalog[self.config.psfShape+'_yy'][mask]
+        psfXY = srcCatalog[self.config.psfShape+'_xy'][mask]
+
+        starSize = np.power(starXX*starYY - starXY**2, 0.25)
+        starE1 = (starXX - starYY)/(starXX + starYY)
+        starE2 = 2*starXY/(starXX + starYY)
+        medianSize = np.median(starSize)
+
+        psfSize = np.power(psfXX*psfYY - psfXY**2, 0.25)
+        psfE1 = (psfXX - psfYY)/(psfXX + psfYY)
+        psfE2 = 2*psfXY/(psfXX + psfYY)
+
+        medianE1 = np.abs(np.median(starE1 - psfE1))
+        medianE2 = np.abs(np.median(starE2 - psfE2))
+        medianE = np.sqrt(medianE1**2 + medianE2**2)
+
+        scatterSize = sigmaMad(starSize - psfSize)
+        scaledScatterSize = scatterSize/medianSize**2
+
+        quality = dict(medianE=medianE, scatterSize=scatterSize, scaledScatterSize=scaledScatterSize,
+                       medianSize=medianSize)
+        self.psfQuality.set(dataRef.dataId, fingerprint, **{name + suffix: quality[name] for name in names})
+        return quality
+
+
+class BestSeeingWcsSelectImageConfig(PsfQualitySelectImagesConfig):
     """Base configuration for BestSeeingSelectImagesTask.
     """
     nImagesMax = pexConfig.Field(
@@ -360,7 +830,7 @@ class BestSeeingWcsSelectImageConfig(WcsSelectImagesTask.ConfigClass):
         optional=True)
 
 
-class BestSeeingWcsSelectImagesTask(WcsSelectImagesTask):
+class BestSeeingWcsSelectImagesTask(PsfQualitySelectImagesTask):
     """Select up to a maximum number of the best-seeing images using their Wcs.
     """
     ConfigClass = BestSeeingWcsSelectImageConfig
@@ -403,11 +873,9 @@ class BestSeeingWcsSelectImagesTask(WcsSelectImagesTask):
         result = super().runDataRef(dataRef, coordList, makeDataRefList=True, selectDataList=selectDataList)
 
         for dataRef, exposureInfo in zip(result.dataRefList, result.exposureInfoList):
-            cal = dataRef.get("calexp", immediate=True)
+            psfSize, sizeFwhm = self.getPsfSize(dataRef)
 
             # if min/max PSF values are defined, remove images out of bounds
-            psfSize = cal.getPsf().computeShape().getDeterminantRadius()
-            sizeFwhm = psfSize * np.sqrt(8.*np.log(2.))
             if self.config.maxPsfFwhm and sizeFwhm > self.config.maxPsfFwhm:
                 continue
             if self.config.minPsfFwhm and sizeFwhm < self.config.minPsfFwhm:
@@ -416,6 +884,8 @@ class BestSeeingWcsSelectImagesTask(WcsSelectImagesTask):
             dataRefList.append(dataRef)
             exposureInfoList.append(exposureInfo)
 
+        self.writePsfQuality()
+
         if len(psfSizes) > self.config.nImagesMax:
             sortedIndices = np.argsort(psfSizes)[:self.config.nImagesMax]
             filteredDataRefList = [dataRefList[i] for i in sortedIndices]
@@ -436,3 +906,35 @@ class BestSeeingWcsSelectImagesTask(WcsSelectImagesTask):
             dataRefList=filteredDataRefList if makeDataRefList else None,
             exposureInfoList=filteredExposureInfoList,
         )
+
+    def getPsfSize(self, dataRef):
+        """Return the PSF size of a CCD, computing it from the calexp PSF if needed.
+
+        Only the PSF component of the calexp is read; the full exposure is only
+        read if the Butler does not provide that component.
+
+        Parameters
+        ----------
+        dataRef : `lsst.daf.persistence.ButlerDataRef`
+            Data reference for the CCD.
+
+        Returns
+        -------
+        psfSize : `float`
+            Determinant radius of the PSF model shape (pixels).
+        sizeFwhm : `float`
+            Corresponding Gaussian FWHM (pixels).
+        """
+        fingerprint = self.getQualityFingerprint(dataRef)
+        quality = self.psfQuality.get(dataRef.dataId, ("psfSize", "psfFwhm"), fingerprint)
+        if quality is not None:
+            return quality["psfSize"], quality["psfFwhm"]
+
+        try:
+            psf = dataRef.get("calexp_psf", immediate=True)
+        except (AttributeError, KeyError, RuntimeError):
+            psf = dataRef.get("calexp", immediate=True).getPsf()
+        psfSize = psf.computeShape().getDeterminantRadius()
+        sizeFwhm = psfSize * np.sqrt(8.*np.log(2.))
+        self.psfQuality.set(dataRef.dataId, fingerprint, psfSize=psfSize, psfFwhm=sizeFwhm)
+        return psfSize, sizeFwhm
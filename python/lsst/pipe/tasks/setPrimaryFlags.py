@@ -24,6 +24,7 @@ import numpy
 from lsst.pex.config import Config, Field, ListField
 from lsst.pipe.base import Task
 from lsst.afw.geom import Box2D
+from lsst.skymap import BaseSkyMap, DodecaSkyMap, RingsSkyMap
 
 
 class SetPrimaryFlagsConfig(Config):
@@ -87,29 +88,153 @@ class SetPrimaryFlagsTask(Task):
             except Exception:
                 self.log.warn("merge_peak is not set for pseudo-filter %s" % filt)
 
+        # Column access requires a contiguous catalog; otherwise work on a contiguous copy and
+        # set the flags on the original records afterwards.
+        catalog = sources if sources.isContiguous() else sources.copy(deep=True)
+        centroidSlot = catalog.getTable().getCentroidSlot()
+        x = catalog.get(centroidSlot.getMeasKey().getX())
+        y = catalog.get(centroidSlot.getMeasKey().getY())
+        centroidFlag = catalog.get(centroidSlot.getFlagKey())
+        # Sources with a NaN centroid are left untouched
+        isValid = ~(numpy.isnan(x) | numpy.isnan(y))
+
+        # Use a slightly smaller box to guard against bad centroids (see above)
+        innerBBox = numpy.where(centroidFlag[:, numpy.newaxis],
+                                [[shrunkInnerFloatBBox.getMinX(), shrunkInnerFloatBBox.getMinY(),
+                                  shrunkInnerFloatBBox.getMaxX(), shrunkInnerFloatBBox.getMaxY()]],
+                                [[innerFloatBBox.getMinX(), innerFloatBBox.getMinY(),
+                                  innerFloatBBox.getMaxX(), innerFloatBBox.getMaxY()]])
+        # Box2D.contains is inclusive of the minimum and exclusive of the maximum
+        isPatchInner = ((x >= innerBBox[:, 0]) & (x < innerBBox[:, 2]) &
+                        (y >= innerBBox[:, 1]) & (y < innerBBox[:, 3]))
+        isTractInner = numpy.zeros(len(catalog), dtype=bool)
+        isTractInner[isValid] = self.findTractInner(catalog, skyMap, tractInfo, isValid)
+
+        isPrimaryCandidate = isValid.copy()
+        if nChildKey is not None:
+            isPrimaryCandidate &= catalog.get(nChildKey) == 0
+        isPseudo = numpy.zeros(len(catalog), dtype=bool)
+        for pseudoFilterKey in pseudoFilterKeys:
+            isPseudo |= catalog.get(pseudoFilterKey)
+
+        catalog[self.isPatchInnerKey] = numpy.where(isValid, isPatchInner, catalog.get(self.isPatchInnerKey))
+        catalog[self.isTractInnerKey] = numpy.where(isValid, isTractInner, catalog.get(self.isTractInnerKey))
+        catalog[self.isPrimaryKey] = numpy.where(isPrimaryCandidate, isPatchInner & isTractInner & ~isPseudo,
+                                                 catalog.get(self.isPrimaryKey))
+        if catalog is not sources:
+            for source, record in zip(sources, catalog):
+                for key in (self.isPatchInnerKey, self.isTractInnerKey, self.isPrimaryKey):
+                    source.set(key, record.get(key))
+
+    def findTractInner(self, sources, skyMap, tractInfo, selection):
+        """Determine whether sources are in the inner region of a tract
+
+        The inner region of a tract is the set of positions for which
+        ``skyMap.findTract`` returns it. It is computed with array operations
+        for the sky maps whose ``findTract`` is known:
+        - `RingsSkyMap`: see findRingsTractInner.
+        - `DodecaSkyMap`, and sky maps that use the default
+          `BaseSkyMap.findTract`: see findNearestTractInner.
+        Otherwise ``skyMap.findTract`` is called for each source.
+
+        @param[in] sources   a contiguous SourceCatalog with coord fields
+        @param[in] skyMap   sky tessellation object (subclass of lsst.skymap.BaseSkyMap)
+        @param[in] tractInfo   tract object (subclass of lsst.skymap.TractInfo)
+        @param[in] selection   boolean array selecting the sources to consider
+        @return boolean array, true for each selected source that is in the inner region of tractInfo
+        """
+        ra = sources["coord_ra"][selection]
+        dec = sources["coord_dec"][selection]
+        if len(ra) == 0:
+            return numpy.zeros(0, dtype=bool)
+        if isinstance(skyMap, RingsSkyMap):
+            # Only if the tract is where RingsSkyMap.findTract puts its center, as assumed below
+            if skyMap.findTract(tractInfo.getCtrCoord()).getId() == tractInfo.getId():
+                return self.findRingsTractInner(ra, dec, skyMap, tractInfo)
+        elif isinstance(skyMap, DodecaSkyMap) or type(skyMap).findTract is BaseSkyMap.findTract:
+            # DodecaSkyMap.findTract returns the tract of the nearest dodecahedron face, whose center is
+            # the tract center
+            return self.findNearestTractInner(ra, dec, skyMap, tractInfo)
         tractId = tractInfo.getId()
-        for source in sources:
-            centroidPos = source.getCentroid()
-            if numpy.any(numpy.isnan(centroidPos)):
-                continue
-            if source.getCentroidFlag():
-                # Use a slightly smaller box to guard against bad centroids (see above)
-                isPatchInner = shrunkInnerFloatBBox.contains(centroidPos)
-            else:
-                isPatchInner = innerFloatBBox.contains(centroidPos)
-            source.setFlag(self.isPatchInnerKey, isPatchInner)
-
-            skyPos = source.getCoord()
-            sourceInnerTractId = skyMap.findTract(skyPos).getId()
-            isTractInner = sourceInnerTractId == tractId
-            source.setFlag(self.isTractInnerKey, isTractInner)
-
-            if nChildKey is None or source.get(nChildKey) == 0:
-                for pseudoFilterKey in pseudoFilterKeys:
-                    if source.get(pseudoFilterKey):
-                        isPseudo = True
-                        break
-                else:
-                    isPseudo = False
-
-                source.setFlag(self.isPrimaryKey, isPatchInner and isTractInner and not isPseudo)
+        return numpy.array([skyMap.findTract(source.getCoord()).getId() == tractId
+                            for source in sources[selection]], dtype=bool)
+
+    def findNearestTractInner(self, ra, dec, skyMap, tractInfo):
+        """Determine whether positions are nearer the center of a tract than that of any other tract
+
+        Only the tracts that could be nearest to some position are compared.
+
+        @param[in] ra, dec   arrays of ICRS coordinates, in radians
+        @param[in] skyMap   sky tessellation object (subclass of lsst.skymap.BaseSkyMap)
+        @param[in] tractInfo   tract object (subclass of lsst.skymap.TractInfo)
+        @return boolean array, true for each position whose nearest tract center is that of tractInfo
+        """
+        tractId = tractInfo.getId()
+        vectors = _unitVectors(ra, dec)
+        tractIds = numpy.array([tract.getId() for tract in skyMap])
+        centers = _unitVectors(*numpy.array([[tract.getCtrCoord().getRa().asRadians(),
+                                              tract.getCtrCoord().getDec().asRadians()]
+                                             for tract in skyMap]).T)
+        # Any tract that is nearest to some source has its center within the distance between the
+        # sources' mean position and this tract's center, plus twice the spread of the sources.
+        mean = numpy.mean(vectors, axis=0)
+        mean /= numpy.linalg.norm(mean)
+        spread = numpy.max(_angle(vectors @ mean))
+        thisCenter = centers[tractIds == tractId][0]
+        maxDistance = _angle(numpy.dot(mean, thisCenter)) + 2*spread
+        candidates = _angle(centers @ mean) <= maxDistance
+        # The first of equally distant tracts is chosen, as in BaseSkyMap.findTract
+        nearest = numpy.argmax(vectors @ centers[candidates].T, axis=1)
+        return tractIds[candidates][nearest] == tractId
+
+    def findRingsTractInner(self, ra, dec, skyMap, tractInfo):
+        """Determine whether positions are in the inner region of a tract of a RingsSkyMap
+
+        RingsSkyMap.findTract selects the ring of declination containing a
+        position, or a polar cap, and then the tract of that ring with the
+        nearest center in right ascension. The inner region of a tract is
+        therefore a band of declination, of the width of a ring, centered on
+        the tract center, and, unless the tract is a polar cap or alone in its
+        ring, a range of right ascension centered on the tract center, of the
+        spacing of the tract centers in the ring.
+
+        @param[in] ra, dec   arrays of ICRS coordinates, in radians
+        @param[in] skyMap   a RingsSkyMap
+        @param[in] tractInfo   tract object of skyMap
+        @return boolean array, true for each position in the inner region of tractInfo
+        """
+        tractId = tractInfo.getId()
+        ringNum = skyMap.getRingIndices(tractId)[0]
+        halfRingSize = 0.5*numpy.pi/(skyMap.config.numRings + 1)
+        if ringNum == -1:
+            return dec < halfRingSize - 0.5*numpy.pi
+        if ringNum == skyMap.config.numRings:
+            return dec > 0.5*numpy.pi - halfRingSize
+        ctrRa = tractInfo.getCtrCoord().getRa().asRadians()
+        ctrDec = tractInfo.getCtrCoord().getDec().asRadians()
+        isInner = (dec >= ctrDec - halfRingSize) & (dec < ctrDec + halfRingSize)
+        # The spacing in right ascension of the tract centers of the ring
+        for neighborId in (tractId + 1, tractId - 1):
+            if skyMap.getRingIndices(neighborId)[0] == ringNum:
+                neighborRa = skyMap[neighborId].getCtrCoord().getRa().asRadians()
+                halfSpacing = 0.5*numpy.abs(_wrapAngle(neighborRa - ctrRa))
+                deltaRa = _wrapAngle(ra - ctrRa)
+                isInner &= (deltaRa >= -halfSpacing) & (deltaRa < halfSpacing)
+                break
+        return isInner
+
+
+def _unitVectors(ra, dec):
+    """Return unit vectors of shape (N, 3) for arrays of ra, dec in radians"""
+    cosDec = numpy.cos(dec)
+    return numpy.stack([cosDec*numpy.cos(ra), cosDec*numpy.sin(ra), numpy.sin(dec)], axis=-1)
+
+
+def _angle(cosine):
+    """Return the angle in radians with the given cosine, allowing for roundoff"""
+    return numpy.arccos(numpy.clip(cosine, -1.0, 1.0))
+
+
+def _wrapAngle(angle):
+    """Return angles in radians wrapped into [-pi, pi)"""
+    return numpy.mod(angle + numpy.pi, 2*numpy.pi) - numpy.pi
@@ -22,10 +22,21 @@
 """
 Tasks for transforming raw measurement outputs to calibrated quantities.
 """
+import os
+
+import numpy
+
 import lsst.afw.table as afwTable
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+    havePyArrow = True
+except ImportError:
+    havePyArrow = False
+
 
 def makeContiguous(catalog):
     """!Return a version of the input catalog which is contiguous in memory."""
@@ -35,6 +46,38 @@ def makeContiguous(catalog):
         return catalog
 
 
+def catalogToArrow(catalog):
+    """!Convert a catalog to a pyarrow Table with one column per schema field.
+
+    Scalar fields become plain columns, array fields become fixed-size list columns
+    and flags become boolean columns. Angles are stored in radians.
+
+    @param[in] catalog  Contiguous afw catalog to convert.
+
+    @return A pyarrow.Table sharing the column order of the catalog schema.
+    """
+    if not havePyArrow:
+        raise RuntimeError("pyarrow is required to write Parquet output")
+    catalog = makeContiguous(catalog)
+    names = []
+    columns = []
+    for item in catalog.schema:
+        key = item.key
+        try:
+            values = catalog[key]
+        except Exception:
+            # Columns which are not available as views (e.g. strings) are read per record.
+            values = [record.get(key) for record in catalog]
+        values = numpy.asarray(values)
+        if values.ndim == 2:
+            column = pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(values.ravel()), values.shape[1])
+        else:
+            column = pyarrow.array(values)
+        names.append(item.field.getName())
+        columns.append(column)
+    return pyarrow.Table.from_arrays(columns, names=names)
+
+
 class TransformConfig(pexConfig.Config):
     """!Configuration for TransformTask."""
     copyFields = pexConfig.ListField(
@@ -137,18 +180,27 @@ class TransformTask(pipeBase.Task):
 
         @return A BaseCatalog containing the transformed measurements.
         """
-        outputCat = afwTable.BaseCatalog(self.mapper.getOutputSchema())
-        outputCat.extend(inputCat, mapper=self.mapper)
-
         # Transforms may use a ColumnView on the input and output catalogs,
-        # which requires that the data be contiguous in memory.
+        # which requires that the data be contiguous in memory. The input is
+        # only copied if it is not; the output is allocated as a single block
+        # by extend(), so it is always contiguous.
         inputCat = makeContiguous(inputCat)
-        outputCat = makeContiguous(outputCat)
+        outputCat = afwTable.BaseCatalog(self.mapper.getOutputSchema())
+        outputCat.extend(inputCat, mapper=self.mapper)
 
         for transform in self.transforms:
             transform(inputCat, outputCat, wcs, photoCalib)
         return outputCat
 
+    def runBatch(self, inputs):
+        """!Transform several catalogs with the same schema and transforms.
+
+        @param[in] inputs  Iterable of (inputCat, wcs, photoCalib) tuples, as accepted by run().
+
+        @return A list of BaseCatalogs containing the transformed measurements, in input order.
+        """
+        return [self.run(inputCat, wcs, photoCalib) for inputCat, wcs, photoCalib in inputs]
+
 
 class RunTransformConfig(pexConfig.Config):
     """!Configuration for RunTransformTaskBase derivatives."""
@@ -160,6 +212,57 @@ class RunTransformConfig(pexConfig.Config):
         dtype=str,
         doc="Dataset type of measurement operation configuration",
     )
+    batchSize = pexConfig.RangeField(
+        dtype=int,
+        doc="Number of data references transformed by each task instance (and each process, with -j)",
+        default=1,
+        min=1,
+    )
+    doWriteFits = pexConfig.Field(
+        dtype=bool,
+        doc="Write the transformed catalog as a FITS table",
+        default=True,
+    )
+    doWriteParquet = pexConfig.Field(
+        dtype=bool,
+        doc="Write the transformed catalog as a Parquet table, next to the FITS output with a "
+            "'.parquet' extension; requires pyarrow",
+        default=False,
+    )
+
+
+class RunTransformTaskRunner(pipeBase.ButlerInitializedTaskRunner):
+    """!Task runner that hands each task instance a batch of data references.
+
+    Building a transform task reads the measurement configuration and input schema from
+    the Butler, so batching amortizes that over RunTransformConfig.batchSize data references.
+    If batchSize is 1, each target is a single data reference, as for a standard task runner.
+    """
+
+    @staticmethod
+    def getTargetList(parsedCmd, **kwargs):
+        refList = parsedCmd.id.refList
+        batchSize = parsedCmd.config.batchSize
+        if batchSize == 1:
+            return [(ref, kwargs) for ref in refList]
+        return [(refList[i:i + batchSize], kwargs) for i in range(0, len(refList), batchSize)]
+
+    def makeTask(self, parsedCmd=None, args=None):
+        if parsedCmd is not None:
+            butler = parsedCmd.butler
+        elif args is not None:
+            dataRef, kwargs = args
+            if isinstance(dataRef, list):
+                dataRef = dataRef[0]
+            butler = dataRef.getButler()
+        else:
+            raise RuntimeError("Neither parsedCmd or args specified")
+        return self.TaskClass(config=self.config, log=self.log, butler=butler)
+
+    def runTask(self, task, dataRef, kwargs):
+        if isinstance(dataRef, list):
+            return task.runDataRefList(dataRef, **kwargs)
+        return task.runDataRef(dataRef, **kwargs)
 
 
 class RunTransformTaskBase(pipeBase.CmdLineTask):
@@ -181,7 +284,12 @@ class RunTransformTaskBase(pipeBase.CmdLineTask):
     - Loads configuration for the measurement task which was applied from a repository;
     - Loads the SourceCatalog input schema from a repository;
     - For each input dataRef, reads the SourceCatalog, WCS and calibration from the
-      repository and executes TransformTask.
+      repository and executes TransformTask. The WCS and calibration are read as
+      components of the calibrated exposure, so no pixel data is loaded;
+    - Writes the result as a FITS catalog and/or, if RunTransformConfig.doWriteParquet
+      is set, as a Parquet table.
+
+    Each task instance processes RunTransformConfig.batchSize data references.
 
     This is not a fully-fledged command line task: it requires specialization to a particular
     source type by defining the variables indicated below.
@@ -190,7 +298,7 @@ class RunTransformTaskBase(pipeBase.CmdLineTask):
 
     \copydoc run
     """
-    RunnerClass = pipeBase.ButlerInitializedTaskRunner
+    RunnerClass = RunTransformTaskRunner
     ConfigClass = RunTransformConfig
 
     # Subclasses should provide definitions for the attributes named below.
@@ -242,6 +350,40 @@ class RunTransformTaskBase(pipeBase.CmdLineTask):
         self.makeSubtask('transform', measConfig=self.measurementConfig,
                          inputSchema=self.butler.get(self.inputSchemaType).schema,
                          outputDataset=self.outputDataset)
+        # Whether the Butler knows the wcs and photoCalib components of calexpType; None until the
+        # first read
+        self._componentReadsSupported = None
+
+    def readCalibration(self, dataRef):
+        """!Read the WCS and photometric calibration of the calibrated exposure.
+
+        Only the ``wcs`` and ``photoCalib`` components of the exposure are read, so no
+        pixel data is loaded. Whether the Butler knows those components for `calexpType`
+        is determined by the first read: if the Butler has no mapping for them, full
+        exposures are read from then on. Any other error is raised.
+
+        @param[in] dataRef  Data reference for the calibrated exposure.
+
+        @returns A tuple of (wcs, photoCalib).
+        """
+        if self._componentReadsSupported is None:
+            try:
+                calibration = self._readCalibrationComponents(dataRef)
+            except AttributeError as e:
+                # Raised by the Gen2 mapper for a dataset type it has no map method for
+                self.log.info("Butler does not provide components of %s (%s); reading full exposures",
+                              self.calexpType, e)
+                self._componentReadsSupported = False
+            else:
+                self._componentReadsSupported = True
+                return calibration
+        if self._componentReadsSupported:
+            return self._readCalibrationComponents(dataRef)
+        calexp = dataRef.get(self.calexpType)
+        return calexp.getWcs(), calexp.getPhotoCalib()
+
+    def _readCalibrationComponents(self, dataRef):
+        return (dataRef.get(self.calexpType + "_wcs"), dataRef.get(self.calexpType + "_photoCalib"))
 
     @pipeBase.timeMethod
     def runDataRef(self, dataRef):
@@ -255,12 +397,60 @@ class RunTransformTaskBase(pipeBase.CmdLineTask):
         @returns A BaseCatalog containing the transformed measurements.
         """
         inputCat = dataRef.get(self.sourceType)
-        wcs = dataRef.get(self.calexpType).getWcs()
-        photoCalib = dataRef.get(self.calexpType).getPhotoCalib()
+        wcs, photoCalib = self.readCalibration(dataRef)
         outputCat = self.transform.run(inputCat, wcs, photoCalib)
-        dataRef.put(outputCat, self.outputDataset)
+        if self.config.doWriteFits:
+            dataRef.put(outputCat, self.outputDataset)
+        if self.config.doWriteParquet:
+            self.writeParquet(dataRef, outputCat)
         return outputCat
 
+    def runDataRefList(self, dataRefList):
+        """!Transform the source catalogs referred to by each of dataRefList.
+
+        @param[in] dataRefList  List of data references for source catalog & calibrated exposure.
+
+        @returns A list of BaseCatalogs containing the transformed measurements.
+        """
+        return [self.runDataRef(dataRef) for dataRef in dataRefList]
+
+    def writeMetadata(self, dataRefList):
+        """!Write the metadata produced from processing the data.
+
+        @param[in] dataRefList  Data reference, or list of data references (if
+                                RunTransformConfig.batchSize > 1), used to write the metadata.
+        """
+        if not isinstance(dataRefList, list):
+            dataRefList = [dataRefList]
+        for dataRef in dataRefList:
+            pipeBase.CmdLineTask.writeMetadata(self, dataRef)
+
+    def getParquetPath(self, dataRef):
+        """!Return the path of the Parquet output for a data reference.
+
+        The Parquet table is written next to the FITS output, `outputDataset`, with its
+        extension replaced by ``.parquet``.
+
+        @param[in] dataRef  Data reference for the output.
+
+        @returns The path of the Parquet file.
+        """
+        fitsPath = dataRef.getButler().getUri(self.outputDataset, dataRef.dataId, write=True)
+        return os.path.splitext(fitsPath)[0] + ".parquet"
+
+    def writeParquet(self, dataRef, outputCat):
+        """!Write the transformed catalog as a Parquet table.
+
+        @param[in] dataRef    Data reference for the output.
+        @param[in] outputCat  BaseCatalog of transformed measurements.
+        """
+        table = catalogToArrow(outputCat)
+        filename = self.getParquetPath(dataRef)
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        pyarrow.parquet.write_table(table, filename)
+
 
 ## \addtogroup LSST_task_documentation
 ## \{
@@ -0,0 +1,69 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Utilities shared by the ingestion tests.
+
+The files ingested are not FITS files: their data IDs are parsed from their
+names, ``<visit>-<ccd>.fits``, by FilenameParseTask.
+"""
+import os
+
+from lsst.pex.config import Field
+from lsst.pipe.tasks.ingest import ParseConfig, ParseTask
+
+__all__ = ["FilenameParseConfig", "FilenameParseTask", "makeFiles"]
+
+
+class FilenameParseConfig(ParseConfig):
+    outputDir = Field(dtype=str, default="", doc="Directory into which files are ingested")
+
+
+class FilenameParseTask(ParseTask):
+    """Parse the properties of a file from its name, ``<visit>-<ccd>.fits``"""
+    ConfigClass = FilenameParseConfig
+
+    def getInfo(self, filename):
+        visit, ccd = (int(value) for value in os.path.basename(filename).split(".")[0].split("-"))
+        info = dict(visit=visit, ccd=ccd, object="field%d" % (visit % 3), filter="gri"[visit % 3],
+                    date="2019-01-%02d" % (1 + visit % 28), taiObs="2019-01-%02dT00:00:00" % (1 + visit % 28),
+                    expTime=30.0)
+        return info, [info]
+
+    def getDestination(self, butler, info, filename):
+        return os.path.join(self.config.outputDir, "%(visit)05d" % info, os.path.basename(filename))
+
+
+def makeFiles(directory, visits, ccds=(0, 1, 2)):
+    """Create input files for each visit and ccd
+
+    @param directory: Directory in which to create the files
+    @param visits: Visit numbers
+    @param ccds: CCD numbers
+    @return list of names of the files created
+    """
+    filenameList = []
+    for visit in visits:
+        for ccd in ccds:
+            filename = os.path.join(directory, "%d-%d.fits" % (visit, ccd))
+            with open(filename, "w") as fd:
+                fd.write("visit=%d ccd=%d\n" % (visit, ccd))
+            filenameList.append(filename)
+    return filenameList
@@ -20,6 +20,8 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import os
+import tempfile
 import unittest
 import unittest.mock
 import numpy as np
@@ -68,8 +70,14 @@ class BestSeeingWcsSelectImagesTest(lsst.utils.tests.TestCase):
         self.calexp = unittest.mock.Mock(spec=lsst.afw.image.ExposureD)
         self.calexp.getPsf.return_value.computeShape.return_value.getDeterminantRadius.side_effect \
             = mockDeterminantRadii()
+
+        def mockGet(datasetType, **kwargs):
+            if datasetType == "calexp_psf":
+                return self.calexp.getPsf()
+            return self.calexp
+
         self.dataRef = unittest.mock.Mock(spec=lsst.daf.persistence.ButlerDataRef, dataId=self.dataId)
-        self.dataRef.get.return_value = self.calexp
+        self.dataRef.get.side_effect = mockGet
 
         point1 = lsst.geom.SpherePoint(0, 0, lsst.geom.degrees)
         point2 = lsst.geom.SpherePoint(2, 0, lsst.geom.degrees)
@@ -94,7 +102,7 @@ class BestSeeingWcsSelectImagesTest(lsst.utils.tests.TestCase):
             # encode the FWHM in the dataId
             dataRef = unittest.mock.Mock(spec=lsst.daf.persistence.ButlerDataRef,
                                          dataId=self.makeDataId(fwhm))
-            dataRef.get.return_value = self.calexp
+            dataRef.get.side_effect = mockGet
             # also create a new attribute to store the fwhm since side_effect
             # can only be called once per value
             dataRef.fwhm = fwhm
@@ -202,6 +210,66 @@ class BestSeeingWcsSelectImagesTest(lsst.utils.tests.TestCase):
                                  selectDataList=self.selectList, makeDataRefList=False)
         self.assertIsNone(result.dataRefList)
 
+    def testPsfQualityFile(self):
+        """Test that PSF sizes are persisted and reused rather than recomputed.
+        """
+        self.config.minPsfFwhm = 1.0
+        self.config.maxPsfFwhm = 1.5
+        self.config.nImagesMax = 2
+        mockFWHMs = [0.5, 1.0, 1.25, 1.5, 2.0]
+        self.localSetUp(mockFWHMs=mockFWHMs)
+        with tempfile.TemporaryDirectory() as tempDir:
+            self.config.psfQualityFile = os.path.join(tempDir, "psfQuality.pickle")
+            task = selectImages.BestSeeingWcsSelectImagesTask(config=self.config)
+            result = task.runDataRef(self.dataRef, self.coordList, selectDataList=self.selectList)
+            self.assertTrue(os.path.exists(self.config.psfQualityFile))
+            self.assertEqual(len(task.psfQuality), len(mockFWHMs))
+
+            table = selectImages.PsfQualityTable.read(self.config.psfQualityFile)
+            for selectStruct in self.selectList:
+                selectStruct.dataRef.get.reset_mock()
+            task = selectImages.BestSeeingWcsSelectImagesTask(config=self.config)
+            task.psfQuality = table
+            repeat = task.runDataRef(self.dataRef, self.coordList, selectDataList=self.selectList)
+            for selectStruct in self.selectList:
+                selectStruct.dataRef.get.assert_not_called()
+        self.assertEqual([info.dataId for info in repeat.exposureInfoList],
+                         [info.dataId for info in result.exposureInfoList])
+        self.assertEqual([info.dataId for info in result.exposureInfoList],
+                         [self.makeDataId(fwhm) for fwhm in (1.0, 1.25)])
+
+    def testPsfQualityStale(self):
+        """Test that PSF sizes are recomputed once the calexp has changed.
+        """
+        self.localSetUp(mockFWHMs=[1.0, 1.2])
+        dataRef = self.selectList[0].dataRef
+        with tempfile.TemporaryDirectory() as tempDir:
+            calexpPath = os.path.join(tempDir, "calexp.fits")
+            dataRef.getUri = unittest.mock.Mock(return_value=calexpPath)
+            self.config.psfQualityFile = os.path.join(tempDir, "psfQuality.pickle")
+            task = selectImages.BestSeeingWcsSelectImagesTask(config=self.config)
+
+            with open(calexpPath, "w") as f:
+                f.write("original")
+            self.assertAlmostEqual(task.getPsfSize(dataRef)[1], 1.0)
+            numReads = dataRef.get.call_count
+            self.assertAlmostEqual(task.getPsfSize(dataRef)[1], 1.0)
+            self.assertEqual(dataRef.get.call_count, numReads)
+
+            with open(calexpPath, "w") as f:
+                f.write("reprocessed")
+            self.assertAlmostEqual(task.getPsfSize(dataRef)[1], 1.2)
+            self.assertGreater(dataRef.get.call_count, numReads)
+
+            task.writePsfQuality()
+            table = selectImages.PsfQualityTable.read(self.config.psfQualityFile)
+            self.assertEqual(len(table), 1)
+            self.assertIsNone(table.get(dataRef.dataId, ("psfFwhm",)))
+            self.assertAlmostEqual(table.get(dataRef.dataId, ("psfFwhm",),
+                                             task.getQualityFingerprint(dataRef))["psfFwhm"], 1.2)
+            # The table is replaced atomically, leaving no temporary files behind
+            self.assertEqual(sorted(os.listdir(tempDir)), ["calexp.fits", "psfQuality.pickle"])
+
 
 class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
     pass
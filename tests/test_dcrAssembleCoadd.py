@@ -21,6 +21,11 @@
 
 import unittest
 
+import numpy as np
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+from lsst.ip.diffim.dcrModel import DcrModel
 import lsst.utils.tests
 
 from lsst.pipe.tasks.dcrAssembleCoadd import DcrAssembleCoaddTask, DcrAssembleCoaddConfig
@@ -118,6 +123,57 @@ class DcrAssembleCoaddCalculateGainTestCase(lsst.utils.tests.TestCase):
         self.assertEqual(gainList, expectGainList)
 
 
+class DcrAssembleCoaddSubregionTestCase(lsst.utils.tests.TestCase):
+    """Tests of the warm start and empty subregion skipping of dcrAssembleCoaddTask."""
+    def setUp(self):
+        self.config = DcrAssembleCoaddConfig()
+        self.config.dcrNumSubfilters = 3
+        self.config.convergenceMaskPlanes = ["DETECTED"]
+        self.task = DcrAssembleCoaddTask(config=self.config)
+        rng = np.random.RandomState(5)
+        maskedImage = afwImage.MaskedImageF(afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(40, 20)))
+        maskedImage.image.array[:] = rng.uniform(1., 10., size=maskedImage.image.array.shape)
+        self.detected = maskedImage.mask.getPlaneBitMask("DETECTED")
+        # The left half has signal in 1 pixel out of 4; the right half has none.
+        maskedImage.mask.array[::2, 0:20:2] = self.detected
+        self.dcrModels = DcrModel.fromImage(maskedImage, self.config.dcrNumSubfilters)
+        self.leftBBox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(20, 20))
+        self.rightBBox = afwGeom.Box2I(afwGeom.Point2I(20, 0), afwGeom.Extent2I(20, 20))
+
+    def testCalculateSignalFraction(self):
+        self.assertFloatsAlmostEqual(self.task.calculateSignalFraction(self.dcrModels, self.leftBBox), 0.25)
+        self.assertEqual(self.task.calculateSignalFraction(self.dcrModels, self.rightBBox), 0.)
+
+    def testSeedSubregionModelConservesFlux(self):
+        # Signal in the subregion to be seeded, which is adjacent to the solved left half.
+        self.dcrModels.mask[self.rightBBox].array[1::2, 1::2] |= self.detected
+        before = np.sum([model[self.rightBBox].array for model in self.dcrModels], axis=0)
+        fractions = np.array([0.5, 0.3, 0.2])
+        self.task.seedSubregionModel(self.dcrModels, self.rightBBox, [(self.leftBBox, fractions)])
+        after = np.sum([model[self.rightBBox].array for model in self.dcrModels], axis=0)
+        self.assertFloatsAlmostEqual(after, before, rtol=1e-6)
+        seeded = self.dcrModels.mask[self.rightBBox].array & self.detected > 0
+        for model, fraction in zip(self.dcrModels, fractions):
+            self.assertFloatsAlmostEqual(model[self.rightBBox].array[seeded], before[seeded]*fraction,
+                                         rtol=1e-6)
+
+    def testSeedSubregionModelNoNeighbors(self):
+        """A subregion without solved neighbors keeps its initial model."""
+        before = [model[self.rightBBox].array.copy() for model in self.dcrModels]
+        farBBox = afwGeom.Box2I(afwGeom.Point2I(100, 100), afwGeom.Extent2I(20, 20))
+        self.task.seedSubregionModel(self.dcrModels, self.rightBBox, [(farBBox, np.array([1., 0., 0.]))])
+        for model, expect in zip(self.dcrModels, before):
+            self.assertFloatsEqual(model[self.rightBBox].array, expect)
+
+    def testRecordSkippedSubregion(self):
+        self.assertLessEqual(self.task.calculateSignalFraction(self.dcrModels, self.rightBBox),
+                             self.config.minSignalFraction)
+        self.task.recordSubregionMetadata(0, 0., skipped=True)
+        self.task.recordSubregionMetadata(5, 0., skipped=False)
+        self.assertEqual(list(self.task.metadata.getArray("subregionSkipped")), [True, False])
+        self.assertEqual(list(self.task.metadata.getArray("subregionNumIter")), [0, 5])
+
+
 def setup_module(module):
     lsst.utils.tests.init()
 
@@ -0,0 +1,448 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Test ingestion into a temporary sqlite registry.
+
+The files ingested are not FITS files: their data IDs are parsed from their
+names, by ingestTestUtils.FilenameParseTask, so the registry contents produced
+by the different ingestion strategies can be compared quickly.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import unittest.mock
+
+from astropy.io import fits
+
+import lsst.utils.tests
+from lsst.pipe.base import Struct
+import lsst.pipe.tasks.ingest
+from lsst.pipe.tasks.ingest import (IngestConfig, IngestTask, ParseConfig, ParseTask, assertCanCopyFiles,
+                                    cloneFile)
+
+from ingestTestUtils import FilenameParseTask, makeFiles
+
+
+class IngestTestCase(lsst.utils.tests.TestCase):
+    """Base class for tests ingesting files named by visit and ccd"""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.inputDir = os.path.join(self.tempDir, "input")
+        os.makedirs(self.inputDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def makeFiles(self, visits, ccds=(0, 1, 2)):
+        """Create input files for each visit and ccd
+
+        @return list of names of the files created
+        """
+        return makeFiles(self.inputDir, visits, ccds)
+
+    def makeConfig(self, repoName="repo"):
+        """Return an IngestConfig that ingests into a new repository in the temporary directory"""
+        config = IngestConfig()
+        config.parse.retarget(FilenameParseTask)
+        config.parse.outputDir = os.path.join(self.tempDir, repoName)
+        os.makedirs(config.parse.outputDir, exist_ok=True)
+        return config
+
+    def ingest(self, config, filenameList, mode="copy", ignoreIngested=False):
+        """Ingest files into the repository of the given config, returning the task"""
+        args = argparse.Namespace(files=filenameList, input=config.parse.outputDir, create=False,
+                                  dryrun=False, mode=mode, badFile=[], badId=Struct(idList=[]),
+                                  ignoreIngested=ignoreIngested, butler=None)
+        task = IngestTask(config=config)
+        task.run(args)
+        return task
+
+    def readRegistry(self, config):
+        """Return the rows of the file and visit tables of the registry of the given config
+
+        The ``id`` column of the file table is omitted.
+        """
+        conn = sqlite3.connect(os.path.join(config.parse.outputDir, "registry.sqlite3"))
+        try:
+            columns = ",".join(config.register.columns)
+            raw = conn.execute("SELECT %s FROM raw ORDER BY visit, ccd" % columns).fetchall()
+            visits = conn.execute("SELECT %s FROM raw_visit ORDER BY visit" %
+                                  ",".join(config.register.visit)).fetchall()
+        finally:
+            conn.close()
+        return dict(raw=raw, visits=visits)
+
+
+class IngestParallelTestCase(IngestTestCase):
+    """Test ingesting with a pool of processes"""
+
+    def testParallelMatchesSerial(self):
+        filenameList = self.makeFiles(range(5))
+        serialConfig = self.makeConfig("serial")
+        self.ingest(serialConfig, filenameList[:6])
+        self.ingest(serialConfig, filenameList, ignoreIngested=True)
+
+        parallelConfig = self.makeConfig("parallel")
+        parallelConfig.numProcesses = 3
+        self.ingest(parallelConfig, filenameList[:6])
+        # The second ingest opens an existing registry, which the workers must be able to read
+        self.ingest(parallelConfig, filenameList, ignoreIngested=True)
+
+        serial = self.readRegistry(serialConfig)
+        self.assertEqual(len(serial["raw"]), len(filenameList))
+        self.assertEqual(len(serial["visits"]), 5)
+        self.assertEqual(self.readRegistry(parallelConfig), serial)
+        for filename in filenameList:
+            visit = int(os.path.basename(filename).split("-")[0])
+            self.assertTrue(os.path.exists(os.path.join(parallelConfig.parse.outputDir, "%05d" % visit,
+                                                        os.path.basename(filename))))
+
+
+class IngestBulkTestCase(IngestTestCase):
+    """Test buffering rows and writing them to the registry in bulk"""
+
+    def ingestTwice(self, config, filenameList):
+        """Ingest part of the files, then all of them, returning the registry contents"""
+        self.ingest(config, filenameList[:7])
+        # Re-registering the first files is either skipped or ignored, depending on the config
+        self.ingest(config, filenameList, mode="skip", ignoreIngested=not config.register.ignore)
+        return self.readRegistry(config)
+
+    def testBulkMatchesRowByRow(self):
+        filenameList = self.makeFiles(range(4))
+        for ignore in (False, True):
+            results = {}
+            for batchSize in (0, 1, 5, 100):
+                config = self.makeConfig("batch%d_%s" % (batchSize, ignore))
+                config.register.batchSize = batchSize
+                config.register.ignore = ignore
+                results[batchSize] = self.ingestTwice(config, filenameList)
+            rowByRow = results.pop(0)
+            self.assertEqual(len(rowByRow["raw"]), len(filenameList))
+            self.assertEqual(len(rowByRow["visits"]), 4)
+            for batchSize, result in results.items():
+                self.assertEqual(result, rowByRow, msg="batchSize=%d ignore=%s" % (batchSize, ignore))
+
+    def testFlushRows(self):
+        """Test that buffered rows are only written by flushRows, or when the buffer is full"""
+        config = self.makeConfig()
+        config.register.batchSize = 3
+        task = IngestTask(config=config)
+        conn = sqlite3.connect(":memory:")
+        task.register.createTable(conn)
+
+        def numRows():
+            return conn.execute("SELECT COUNT(*) FROM raw").fetchone()[0]
+
+        infoList = [task.parse.getInfo(filename)[0] for filename in self.makeFiles([1, 2], ccds=(0, 1))]
+        for info in infoList[:2]:
+            task.register.addRow(conn, info)
+        self.assertEqual(numRows(), 0)
+        self.assertTrue(task.register.check(conn, infoList[0]))
+        self.assertFalse(task.register.check(conn, infoList[2]))
+        task.register.addRow(conn, infoList[2])
+        self.assertEqual(numRows(), 3)
+        task.register.addRow(conn, infoList[3])
+        self.assertEqual(numRows(), 3)
+        task.register.flushRows(conn)
+        self.assertEqual(numRows(), 4)
+        conn.close()
+
+
+class IngestManifestTestCase(IngestTestCase):
+    """Test skipping unchanged files with the ingest manifest"""
+
+    def makeConfig(self, repoName="repo"):
+        config = IngestTestCase.makeConfig(self, repoName)
+        config.register.manifestTable = "manifest"
+        return config
+
+    def ingestCounting(self, config, filenameList, **kwargs):
+        """Ingest files, returning the names of the files that were parsed and hashed"""
+        with unittest.mock.patch.object(FilenameParseTask, "getInfo", autospec=True,
+                                        side_effect=FilenameParseTask.getInfo) as getInfo, \
+                unittest.mock.patch.object(lsst.pipe.tasks.ingest, "hashFile",
+                                           side_effect=lsst.pipe.tasks.ingest.hashFile) as hashFile:
+            self.ingest(config, filenameList, **kwargs)
+        return (set(call[0][1] for call in getInfo.call_args_list),
+                set(call[0][0] for call in hashFile.call_args_list))
+
+    def readManifest(self, config):
+        """Return the ingest manifest, as a dict mapping path --> (size, mtime, hash)"""
+        conn = sqlite3.connect(os.path.join(config.parse.outputDir, "registry.sqlite3"))
+        try:
+            return {row[0]: row[1:] for row in conn.execute("SELECT path, size, mtime, hash FROM manifest")}
+        finally:
+            conn.close()
+
+    def testManifest(self):
+        filenameList = self.makeFiles(range(3))
+        config = self.makeConfig()
+        parsed, hashed = self.ingestCounting(config, filenameList)
+        self.assertEqual(parsed, set(filenameList))
+        self.assertEqual(hashed, set())  # New files are not hashed
+        manifest = self.readManifest(config)
+        self.assertEqual(set(manifest), set(os.path.abspath(filename) for filename in filenameList))
+        self.assertTrue(all(entry[2] is None for entry in manifest.values()))
+
+        # Unchanged files are neither opened nor hashed
+        parsed, hashed = self.ingestCounting(config, filenameList, mode="skip", ignoreIngested=True)
+        self.assertEqual(parsed, set())
+        self.assertEqual(hashed, set())
+
+        # A file whose modification time has changed is hashed; its hash is recorded, and used to
+        # recognize it as unchanged the next time its modification time changes
+        touched = filenameList[0]
+        for mtime in (12345678, 23456789):
+            os.utime(touched, (mtime, mtime))
+            parsed, hashed = self.ingestCounting(config, filenameList, mode="skip", ignoreIngested=True)
+            self.assertEqual(hashed, {touched})
+            self.assertEqual(parsed, {touched} if mtime == 12345678 else set())
+            entry = self.readManifest(config)[os.path.abspath(touched)]
+            self.assertEqual(entry[1], mtime)
+            self.assertEqual(entry[2], lsst.pipe.tasks.ingest.hashFile(touched))
+
+        # Modified files are parsed again: the content of one file is changed without changing its
+        # size, and another file is truncated
+        with open(filenameList[0], "w") as fd:
+            fd.write("VISIT=%d CCD=%d\n" % (0, 0))
+        with open(filenameList[1], "w") as fd:
+            fd.write("")
+        parsed, hashed = self.ingestCounting(config, filenameList, mode="skip", ignoreIngested=True)
+        self.assertEqual(parsed, set(filenameList[:2]))
+        self.assertEqual(hashed, {filenameList[0]})
+
+    def testRegistryMatches(self):
+        """Test that the manifest does not change the registry contents"""
+        filenameList = self.makeFiles(range(3))
+        withManifest = self.makeConfig("withManifest")
+        withoutManifest = IngestTestCase.makeConfig(self, "withoutManifest")
+        for config in (withManifest, withoutManifest):
+            self.ingest(config, filenameList[:4])
+            self.ingest(config, filenameList, mode="skip", ignoreIngested=True)
+        self.assertEqual(self.readRegistry(withManifest), self.readRegistry(withoutManifest))
+
+
+class IngestVisitsTestCase(IngestTestCase):
+    """Test adding the visits of newly registered files to the visit table"""
+
+    def testAddVisits(self):
+        # The ccds of visit 2 are registered by different ingests
+        filenameList = self.makeFiles(range(5))
+        for batchSize in (0, 4):
+            config = self.makeConfig("batch%d" % batchSize)
+            config.register.batchSize = batchSize
+            self.ingest(config, filenameList[:7])
+            self.ingest(config, filenameList[7:])
+            self.ingest(config, filenameList, mode="skip", ignoreIngested=True)
+            registry = self.readRegistry(config)
+            columns = list(config.register.columns)
+            indices = [columns.index(col) for col in config.register.visit]
+            # The visits a full scan of the file table (RegisterTask.addAllVisits) would add
+            expected = sorted(set(tuple(row[i] for i in indices) for row in registry["raw"]))
+            self.assertEqual(len(expected), 5)
+            self.assertEqual(registry["visits"], expected)
+
+    def testAddAllVisits(self):
+        """Test that addAllVisits adds the visits missing from the visit table"""
+        config = self.makeConfig()
+        self.ingest(config, self.makeFiles(range(3)))
+        expected = self.readRegistry(config)["visits"]
+        conn = sqlite3.connect(os.path.join(config.parse.outputDir, "registry.sqlite3"))
+        conn.execute("DELETE FROM raw_visit WHERE visit != 1")
+        IngestTask(config=config).register.addAllVisits(conn)
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.readRegistry(config)["visits"], expected)
+
+    def testIndexes(self):
+        """Test that indexes are added to registries created without them"""
+        config = self.makeConfig()
+        filenameList = self.makeFiles(range(3))
+        self.ingest(config, filenameList[:3])
+        registryName = os.path.join(config.parse.outputDir, "registry.sqlite3")
+        conn = sqlite3.connect(registryName)
+        conn.execute("DROP INDEX raw_visit_index")
+        conn.close()
+        self.ingest(config, filenameList[3:])
+        conn = sqlite3.connect(registryName)
+        indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")]
+        conn.close()
+        self.assertIn("raw_visit_index", indexes)
+        self.assertEqual(len(self.readRegistry(config)["raw"]), len(filenameList))
+
+
+class IngestTransferTestCase(IngestTestCase):
+    """Test the modes of transferring files into the repository"""
+
+    def getDestination(self, config, filename):
+        visit = int(os.path.basename(filename).split("-")[0])
+        return os.path.join(config.parse.outputDir, "%05d" % visit, os.path.basename(filename))
+
+    def testModes(self):
+        filenameList = self.makeFiles(range(3))
+        copyConfig = self.makeConfig("copy")
+        self.ingest(copyConfig, filenameList, mode="copy")
+        expected = self.readRegistry(copyConfig)
+        for mode in ("link", "hardlink", "reflink"):
+            config = self.makeConfig(mode)
+            self.ingest(config, filenameList, mode=mode)
+            self.assertEqual(self.readRegistry(config), expected, msg=mode)
+            for filename in filenameList:
+                outfile = self.getDestination(config, filename)
+                with open(filename) as infd, open(outfile) as outfd:
+                    self.assertEqual(outfd.read(), infd.read())
+                self.assertEqual(os.path.islink(outfile), mode == "link")
+                self.assertEqual(os.path.samefile(filename, outfile), mode in ("link", "hardlink"))
+
+    def testConcurrentTransfers(self):
+        filenameList = self.makeFiles(range(4))
+        serialConfig = self.makeConfig("serial")
+        self.ingest(serialConfig, filenameList, mode="copy")
+        for mode in ("copy", "hardlink", "move"):
+            config = self.makeConfig("concurrent_" + mode)
+            config.numTransferThreads = 3
+            config.transferBatchSize = 5
+            contents = {}
+            for filename in filenameList:
+                with open(filename) as fd:
+                    contents[filename] = fd.read()
+            self.ingest(config, filenameList, mode=mode)
+            self.assertEqual(self.readRegistry(config), self.readRegistry(serialConfig), msg=mode)
+            for filename in filenameList:
+                with open(self.getDestination(config, filename)) as fd:
+                    self.assertEqual(fd.read(), contents[filename])
+                self.assertEqual(os.path.exists(filename), mode != "move")
+
+    def testConcurrentFailure(self):
+        """Test that a file which cannot be transferred is not registered"""
+        filenameList = self.makeFiles(range(2))
+        config = self.makeConfig()
+        config.numTransferThreads = 2
+        existing = self.getDestination(config, filenameList[1])
+        os.makedirs(os.path.dirname(existing))
+        with open(existing, "w") as fd:
+            fd.write("already there\n")
+        self.ingest(config, filenameList, mode="copy")
+        registered = [(row[1], row[2]) for row in self.readRegistry(config)["raw"]]  # visit, ccd
+        self.assertEqual(registered, [(0, 0), (0, 2), (1, 0), (1, 1), (1, 2)])
+
+    def testCloneFile(self):
+        source, = self.makeFiles([7], ccds=[0])
+        target = os.path.join(self.tempDir, "clone.fits")
+        cloneFile(source, target)
+        with open(source, "rb") as infd, open(target, "rb") as outfd:
+            self.assertEqual(outfd.read(), infd.read())
+        self.assertFalse(os.path.samefile(source, target))
+
+    def testAssertCanCopyFiles(self):
+        filenameList = self.makeFiles([1, 2])
+        pairs = [(filename, os.path.join(self.tempDir, "new", "dir", os.path.basename(filename)))
+                 for filename in filenameList]
+        assertCanCopyFiles(pairs)
+        required = sum(os.stat(filename).st_size for filename in filenameList)
+        # Enough space for any one of the files, but not for all of them
+        statvfs = unittest.mock.Mock(f_bavail=required - 1, f_frsize=1)
+        with unittest.mock.patch("os.statvfs", return_value=statvfs):
+            with self.assertRaises(RuntimeError):
+                assertCanCopyFiles(pairs)
+
+
+class ExtnameParseTask(ParseTask):
+    """Parse the properties of a multi-extension FITS file, identifying extensions by their full EXTNAME"""
+
+    @staticmethod
+    def getExtensionName(md):
+        return md.getScalar("EXTNAME").strip() if md.exists("EXTNAME") else None
+
+
+class ParseMefTestCase(lsst.utils.tests.TestCase):
+    """Test reading the headers of a multi-extension FITS file with ParseTask.getInfo"""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempDir, "mef.fits")
+        hduList = fits.HDUList([fits.PrimaryHDU(header=fits.Header([("OBJECT", "field1"), ("FILTER", "r")]))])
+        for ccd in (1, 2, 3):
+            hduList.append(fits.ImageHDU(header=fits.Header([("CCDNUM", ccd)]), name="CCD%d" % ccd))
+        hduList.writeto(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def getInfo(self, extnames):
+        """Parse the file, returning the file properties and the numbers of files opened and headers read"""
+        config = ParseConfig()
+        config.hdu = 0
+        config.translation = {"object": "OBJECT", "filter": "FILTER", "ccd": "CCDNUM"}
+        config.extnames = extnames
+        task = ExtnameParseTask(config=config)
+        with unittest.mock.patch.object(lsst.pipe.tasks.ingest, "Fits",
+                                        side_effect=lsst.pipe.tasks.ingest.Fits) as opened, \
+                unittest.mock.patch.object(lsst.pipe.tasks.ingest, "readMetadata",
+                                           side_effect=lsst.pipe.tasks.ingest.readMetadata) as read:
+            phuInfo, infoList = task.getInfo(self.filename)
+        self.assertEqual(phuInfo, dict(object="field1", filter="r"))
+        return infoList, opened.call_count, read.call_count
+
+    def testExtnames(self):
+        """Test that the extensions are returned in file order, whatever the order of config.extnames"""
+        infoList, numOpened, numRead = self.getInfo(["CCD3", "CCD1"])
+        self.assertEqual(infoList, [dict(object="field1", filter="r", ccd=1, hdu=1),
+                                    dict(object="field1", filter="r", ccd=3, hdu=3)])
+        self.assertEqual(numOpened, 1)
+        self.assertEqual(numRead, 4)
+
+    def testEarlyStop(self):
+        """Test that no header is read after all of config.extnames have been found"""
+        infoList, numOpened, numRead = self.getInfo(["CCD1"])
+        self.assertEqual(infoList, [dict(object="field1", filter="r", ccd=1, hdu=1)])
+        self.assertEqual(numOpened, 1)
+        self.assertEqual(numRead, 2)
+
+    def testMissingExtension(self):
+        """Test that the extensions found are returned when one of config.extnames is missing"""
+        infoList, numOpened, numRead = self.getInfo(["CCD2", "CCD9"])
+        self.assertEqual(infoList, [dict(object="field1", filter="r", ccd=2, hdu=2)])
+        self.assertEqual(numOpened, 1)
+        self.assertEqual(numRead, 4)
+
+    def testNoExtnames(self):
+        infoList, numOpened, numRead = self.getInfo([])
+        self.assertEqual(infoList, [dict(object="field1", filter="r")])
+        self.assertEqual((numOpened, numRead), (1, 1))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
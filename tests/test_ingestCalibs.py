@@ -0,0 +1,139 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Test the validity ranges computed for a calibration registry."""
+import sqlite3
+import unittest
+
+import lsst.utils.tests
+from lsst.pipe.tasks.ingestCalibs import CalibsRegisterConfig, CalibsRegisterTask
+
+# Calibration dates of each table and detector (filter, ccd)
+CALIBS = {
+    "flat": {("g", 1): ["2020-01-01", "2020-01-05", "2020-01-20"],
+             ("r", 2): ["2020-01-10"]},
+    "defects": {("g", 1): ["2020-01-01", "2020-02-01"],
+                ("r", 2): ["2020-01-15"]},
+}
+
+# Validity ranges for a validity of 3 days
+EXPECTED = {
+    "flat": {("g", 1, "2020-01-01"): ("2019-12-29", "2020-01-03"),
+             ("g", 1, "2020-01-05"): ("2020-01-04", "2020-01-08"),
+             ("g", 1, "2020-01-20"): ("2020-01-17", "2020-01-23"),
+             ("r", 2, "2020-01-10"): ("2020-01-07", "2020-01-13")},
+    "defects": {("g", 1, "2020-01-01"): ("2020-01-01", "2020-01-31"),
+                ("g", 1, "2020-02-01"): ("2020-02-01", "2037-12-31"),
+                ("r", 2, "2020-01-15"): ("2020-01-15", "2037-12-31")},
+}
+
+
+class CalibsValidityTestCase(lsst.utils.tests.TestCase):
+    """Test updating the validity ranges of a calibration registry"""
+
+    def makeTask(self, **kwargs):
+        config = CalibsRegisterConfig()
+        config.tables = list(CALIBS)
+        config.columns = {"filter": "text", "ccd": "int", "calibDate": "text",
+                          "validStart": "text", "validEnd": "text"}
+        config.unique = ["filter", "ccd", "calibDate"]
+        config.visit = ["calibDate", "filter"]
+        for name, value in kwargs.items():
+            setattr(config, name, value)
+        return CalibsRegisterTask(config=config)
+
+    def makeRegistry(self, task, calibs=CALIBS):
+        """Create a registry in memory, and register calibrations"""
+        conn = sqlite3.connect(":memory:")
+        task.createTable(conn)
+        self.addCalibs(task, conn, calibs)
+        return conn
+
+    def addCalibs(self, task, conn, calibs):
+        for table, detectors in calibs.items():
+            for (filterName, ccd), dates in detectors.items():
+                for calibDate in dates:
+                    task.addRow(conn, dict(filter=filterName, ccd=ccd, calibDate=calibDate), table=table)
+
+    def readValidity(self, conn, table):
+        """Return the validity ranges of a table, as a dict indexed by (filter, ccd, calibDate)"""
+        rows = conn.execute("SELECT filter, ccd, calibDate, validStart, validEnd FROM %s" % table)
+        return {tuple(row)[:3]: tuple(row)[3:] for row in rows}
+
+    def testValidity(self):
+        for batchSize in (0, 2):
+            task = self.makeTask(batchSize=batchSize)
+            conn = self.makeRegistry(task)
+            task.updateValidityRanges(conn, 3)
+            for table in CALIBS:
+                self.assertEqual(self.readValidity(conn, table), EXPECTED[table],
+                                 msg="%s batchSize=%d" % (table, batchSize))
+            conn.close()
+
+    def testMatchesPerDetector(self):
+        """Test that updating all detectors at once matches updating each detector separately"""
+        task = self.makeTask()
+        conn = self.makeRegistry(task)
+        task.updateValidityRanges(conn, 3)
+        perDetectorTask = self.makeTask()
+        perDetectorConn = self.makeRegistry(perDetectorTask)
+        perDetectorConn.row_factory = sqlite3.Row
+        for table, detectors in CALIBS.items():
+            for detectorData in detectors:
+                perDetectorTask.fixSubsetValidity(perDetectorConn, table, detectorData, 3)
+        for table in CALIBS:
+            self.assertEqual(self.readValidity(conn, table), self.readValidity(perDetectorConn, table))
+        conn.close()
+        perDetectorConn.close()
+
+    def testIncremental(self):
+        """Test that only the detectors with new calibrations are updated with incrementalValidity"""
+        task = self.makeTask(incrementalValidity=True)
+        conn = self.makeRegistry(task)
+        task.updateValidityRanges(conn, 3)
+        for table in CALIBS:
+            self.assertEqual(self.readValidity(conn, table), EXPECTED[table])
+
+        # Spoil the validity ranges, to show which are rewritten
+        for table in CALIBS:
+            conn.execute("UPDATE %s SET validStart='spoiled', validEnd='spoiled'" % table)
+        self.addCalibs(task, conn, {"flat": {("r", 2): ["2020-01-12"]}})
+        task.updateValidityRanges(conn, 3)
+        flat = self.readValidity(conn, "flat")
+        self.assertEqual(flat.pop(("r", 2, "2020-01-10")), ("2020-01-07", "2020-01-11"))
+        self.assertEqual(flat.pop(("r", 2, "2020-01-12")), ("2020-01-12", "2020-01-15"))
+        self.assertTrue(all(validity == ("spoiled", "spoiled") for validity in flat.values()))
+        defects = self.readValidity(conn, "defects")
+        self.assertTrue(all(validity == ("spoiled", "spoiled") for validity in defects.values()))
+        conn.close()
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,161 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Test ingestion into a PostgreSQL registry.
+
+The tests create, and finally drop, a temporary database on the server given
+by the standard libpq environment variables (PGHOST, PGPORT, PGUSER,
+PGPASSWORD and PGDATABASE, the database to connect to in order to create the
+temporary one). They are skipped if psycopg2 is not available or the server
+cannot be reached.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+from lsst.pipe.base import Struct
+from lsst.pipe.tasks.ingestPgsql import PgsqlIngestConfig, PgsqlIngestTask, havePgSql
+
+from ingestTestUtils import FilenameParseTask, makeFiles
+
+if havePgSql:
+    import psycopg2
+
+
+def getServer():
+    """Return the connection parameters of the PostgreSQL server, or None if it cannot be reached"""
+    if not havePgSql:
+        return None
+    server = dict(host=os.environ.get("PGHOST", "localhost"), port=int(os.environ.get("PGPORT", 5432)),
+                  user=os.environ.get("PGUSER", os.environ.get("USER", "postgres")),
+                  password=os.environ.get("PGPASSWORD", ""))
+    try:
+        psycopg2.connect(database=os.environ.get("PGDATABASE", "postgres"), **server).close()
+    except psycopg2.Error:
+        return None
+    return server
+
+
+SERVER = getServer()
+
+
+@unittest.skipIf(SERVER is None, "No PostgreSQL server available")
+class PgsqlIngestTestCase(lsst.utils.tests.TestCase):
+    """Test ingesting files into a temporary PostgreSQL database"""
+
+    def setUp(self):
+        self.database = "test_ingest_pgsql_%d" % os.getpid()
+        self.adminConn = psycopg2.connect(database=os.environ.get("PGDATABASE", "postgres"), **SERVER)
+        self.adminConn.autocommit = True
+        try:
+            self.adminConn.cursor().execute("CREATE DATABASE %s" % self.database)
+        except psycopg2.Error as exc:
+            self.adminConn.close()
+            self.skipTest("Cannot create a temporary database: %s" % exc)
+        self.tempDir = tempfile.mkdtemp()
+        self.inputDir = os.path.join(self.tempDir, "input")
+        self.repoDir = os.path.join(self.tempDir, "repo")
+        os.makedirs(self.inputDir)
+        os.makedirs(self.repoDir)
+        with open(os.path.join(self.repoDir, "registry.pgsql"), "w") as fd:
+            for key, value in dict(SERVER, database=self.database).items():
+                fd.write("%s: %s\n" % (key, json.dumps(value)))
+        self.filenameList = makeFiles(self.inputDir, range(4))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+        self.adminConn.cursor().execute("DROP DATABASE IF EXISTS %s" % self.database)
+        self.adminConn.close()
+
+    def makeConfig(self, batchSize=0):
+        config = PgsqlIngestConfig()
+        config.parse.retarget(FilenameParseTask)
+        config.parse.outputDir = self.repoDir
+        config.register.batchSize = batchSize
+        return config
+
+    def ingest(self, config, filenameList, create=False, ignoreIngested=False):
+        args = argparse.Namespace(files=filenameList, input=self.repoDir, create=create, dryrun=False,
+                                  mode="skip", badFile=[], badId=Struct(idList=[]),
+                                  ignoreIngested=ignoreIngested, butler=None)
+        PgsqlIngestTask(config=config).run(args)
+
+    def execute(self, sql, fetch=True):
+        """Execute SQL in the temporary database, returning the rows fetched if requested"""
+        conn = psycopg2.connect(database=self.database, **SERVER)
+        try:
+            cur = conn.cursor()
+            cur.execute(sql)
+            rows = cur.fetchall() if fetch else None
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    def readRegistry(self, config):
+        columns = ",".join(config.register.columns)
+        return dict(raw=self.execute("SELECT %s FROM raw ORDER BY visit, ccd" % columns),
+                    visits=self.execute("SELECT %s FROM raw_visit ORDER BY visit" %
+                                        ",".join(config.register.visit)))
+
+    def testCopyMatchesRowByRow(self):
+        """Test that writing rows through the COPY staging table gives the same registry"""
+        results = {}
+        for batchSize in (0, 5):
+            for ignore in (False, True):
+                config = self.makeConfig(batchSize)
+                config.register.ignore = ignore
+                self.ingest(config, self.filenameList[:7], create=True)
+                self.ingest(config, self.filenameList, ignoreIngested=not ignore)
+                results[(batchSize, ignore)] = self.readRegistry(config)
+        expected = results.pop((0, False))
+        self.assertEqual(len(expected["raw"]), len(self.filenameList))
+        self.assertEqual(len(expected["visits"]), 4)
+        for key, result in results.items():
+            self.assertEqual(result, expected, msg="batchSize=%d ignore=%s" % key)
+
+    def testIndexesOnOpen(self):
+        """Test that indexes missing from an existing registry are created when it is opened"""
+        config = self.makeConfig()
+        self.ingest(config, self.filenameList[:3], create=True)
+        self.execute("DROP INDEX raw_visit_index", fetch=False)
+        self.assertEqual(self.execute("SELECT indexname FROM pg_indexes WHERE indexname = 'raw_visit_index'"),
+                         [])
+        self.ingest(config, self.filenameList[3:])
+        self.assertEqual(self.execute("SELECT indexname FROM pg_indexes WHERE indexname = 'raw_visit_index'"),
+                         [("raw_visit_index",)])
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -25,6 +25,7 @@ import unittest
 import numpy as np
 
 import lsst.utils.tests
+import lsst.afw.geom as afwGeom
 import lsst.afw.image as afwImage
 import lsst.afw.math as afwMath
 from lsst.pipe.tasks.matchBackgrounds import MatchBackgroundsTask
@@ -223,6 +224,48 @@ class MatchBackgroundsTestCase(unittest.TestCase):
         self.matcher.config.order = 4
         self.checkAccuracy(self.vanilla, vanillaTwin)
 
+    def testPackedFitApproximate(self):
+        """Test that a fit passed between processes rebuilds the same model:  .Approximate."""
+        self.matcher.config.binSize = 128
+        self.matcher.config.order = 2
+        fit = self.matcher._fitBackground(self.chipGap, afwImage.ExposureF(self.vanilla, True))
+        unpacked = self.matcher._unpackFit(self.matcher._packFit(fit))
+        np.testing.assert_allclose(unpacked.backgroundModel.getImage().getArray(),
+                                   fit.backgroundModel.getImage().getArray(), rtol=1e-6)
+        self.assertEqual(unpacked.fitRMS, fit.fitRMS)
+        self.assertEqual(unpacked.matchedMSE, fit.matchedMSE)
+
+    def testGridImage(self):
+        """Test that the gridded statistics match afw.math.makeStatistics on each bin."""
+        binSize = 128  # does not divide the 600x600 image, so the last bins are partial
+        mi = afwImage.MaskedImageF(self.chipGap.getMaskedImage(), True)
+        mi.getImage().getArray()[::7, ::5] += 30.  # outliers for the clipped mean
+        mi.getMask().getArray()[100:150, 400:450] = afwImage.Mask.getPlaneBitMask("BAD")
+        mi.getImage().getArray()[:, 250:300] = 20.  # partly cover the chip gap
+        self.matcher.sctrl.setNumSigmaClip(self.matcher.config.numSigmaClip)
+        self.matcher.sctrl.setNumIter(self.matcher.config.numIter)
+        for name in ("MEAN", "MEDIAN", "MEANCLIP"):
+            statsFlag = getattr(afwMath, name)
+            bgX, bgY, bgZ, bgdZ = self.matcher._gridImage(mi, binSize, statsFlag)
+            expected = []
+            for ymin in range(0, 600, binSize):
+                for xmin in range(0, 600, binSize):
+                    xmax, ymax = min(xmin + binSize, 600), min(ymin + binSize, 600)
+                    subIm = afwImage.MaskedImageF(mi, afwGeom.Box2I(afwGeom.Point2I(xmin, ymin),
+                                                                    afwGeom.Point2I(xmax - 1, ymax - 1)),
+                                                  afwImage.PARENT, False)
+                    stats = afwMath.makeStatistics(subIm, statsFlag | afwMath.NPOINT | afwMath.STDEV,
+                                                   self.matcher.sctrl)
+                    npoints = stats.getValue(afwMath.NPOINT)
+                    if npoints >= 2:
+                        expected.append((0.5*(xmin + xmax), 0.5*(ymin + ymax), stats.getValue(statsFlag),
+                                         stats.getValue(afwMath.STDEV)/np.sqrt(npoints)))
+            expected = np.array(expected)
+            np.testing.assert_array_equal(bgX, expected[:, 0])
+            np.testing.assert_array_equal(bgY, expected[:, 1])
+            np.testing.assert_allclose(bgZ, expected[:, 2], rtol=1e-5, err_msg=name)
+            np.testing.assert_allclose(bgdZ, expected[:, 3], rtol=1e-5)
+
     # -=-=-=-=-=-=-=-=-=Background Interp (Splines) -=-=-=-=-=-=-=-=-
 
     def testVanillaBackground(self):
@@ -231,6 +274,15 @@ class MatchBackgroundsTestCase(unittest.TestCase):
         self.matcher.config.binSize = 128
         self.checkAccuracy(self.chipGap, self.vanilla)
 
+    def testPackedFitBackground(self):
+        """Test that a fit passed between processes rebuilds the same model:  .Background."""
+        self.matcher.config.usePolynomial = False
+        self.matcher.config.binSize = 128
+        fit = self.matcher._fitBackground(self.chipGap, afwImage.ExposureF(self.vanilla, True))
+        unpacked = self.matcher._unpackFit(self.matcher._packFit(fit))
+        np.testing.assert_allclose(unpacked.backgroundModel.getImageF().getArray(),
+                                   fit.backgroundModel.getImageF().getArray(), rtol=1e-6)
+
     def testRampBackground(self):
         """Test basic matching of a linear gradient with .Background."""
         self.matcher.config.usePolynomial = False
@@ -0,0 +1,104 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.daf.base import PropertyList
+from lsst.meas.base.tests import TestDataset
+
+from lsst.pipe.tasks.multiBand import MeasureMergedCoaddSourcesTask, MeasureMergedCoaddSourcesConfig
+
+
+class MeasureParallelTestCase(lsst.utils.tests.TestCase):
+    """Test that measuring in parallel gives the same results as in a single process."""
+
+    def setUp(self):
+        bbox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(200, 200))
+        dataset = TestDataset(bbox)
+        dataset.addSource(100000.0, afwGeom.Point2D(30.3, 40.8))
+        dataset.addSource(50000.0, afwGeom.Point2D(160.1, 30.6))
+        with dataset.addBlend() as family:
+            family.addChild(80000.0, afwGeom.Point2D(100.4, 100.2))
+            family.addChild(60000.0, afwGeom.Point2D(107.7, 104.9))
+        with dataset.addBlend() as family:
+            family.addChild(70000.0, afwGeom.Point2D(50.5, 150.1))
+            family.addChild(40000.0, afwGeom.Point2D(56.2, 143.4))
+        dataset.addSource(30000.0, afwGeom.Point2D(170.9, 170.2))
+        self.exposure, self.truth = dataset.realize(10.0, dataset.makeMinimalSchema(), randomSeed=1)
+        self.exposureId = 12345
+
+    def makeTask(self, numMeasurementProcesses):
+        config = MeasureMergedCoaddSourcesConfig()
+        config.doMatchSources = False
+        config.doPropagateFlags = False
+        config.doApCorr = False
+        config.doRunCatalogCalculation = False
+        config.measurement.plugins.names = ["base_SdssCentroid", "base_SdssShape", "base_PsfFlux"]
+        config.measurement.slots.apFlux = None
+        config.measurement.slots.gaussianFlux = None
+        config.measurement.slots.modelFlux = None
+        config.measurement.slots.calibFlux = None
+        config.numMeasurementProcesses = numMeasurementProcesses
+        return MeasureMergedCoaddSourcesTask(config=config, schema=self.truth.schema)
+
+    def makeSources(self, task):
+        sources = afwTable.SourceCatalog(task.schema)
+        sources.getTable().setMetadata(PropertyList())
+        sources.extend(self.truth, task.schemaMapper)
+        return sources
+
+    def testParallelMatchesSerial(self):
+        serialTask = self.makeTask(1)
+        serial = self.makeSources(serialTask)
+        serialTask.measurement.run(serial, self.exposure, exposureId=self.exposureId)
+
+        parallelTask = self.makeTask(2)
+        parallel = self.makeSources(parallelTask)
+        # More groups than processes, so that each worker measures several groups.
+        self.assertGreater(len(parallelTask.partitionFamilies(parallel, 4*2)), 2)
+        image = self.exposure.getMaskedImage().getImage().getArray().copy()
+        parallelTask.measureParallel(parallel, self.exposure, self.exposureId)
+
+        self.assertEqual(list(serial["id"]), list(parallel["id"]))
+        for name in serialTask.schema.extract("base_*"):
+            np.testing.assert_array_equal(serial[name], parallel[name], err_msg=name)
+        # The noise replacement is recorded as by SingleFrameMeasurementTask.run, and undone
+        for name in ("NOISE_SEED_MULTIPLIER", "NOISE_SOURCE", "NOISE_OFFSET", "NOISE_EXPOSURE_ID"):
+            self.assertEqual(parallel.getMetadata().get(name), serial.getMetadata().get(name), msg=name)
+        np.testing.assert_array_equal(self.exposure.getMaskedImage().getImage().getArray(), image)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,133 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.detection as afwDetect
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.pipe.tasks.mergeDetections import MergeDetectionsConfig, MergeDetectionsTask
+
+BANDS = ["i", "r", "g"]
+
+
+class CullPeaksTestCase(lsst.utils.tests.TestCase):
+    """Test the peaks kept by MergeDetectionsTask.cullPeaks"""
+
+    def setUp(self):
+        config = MergeDetectionsConfig()
+        config.priorityList = BANDS
+        self.task = MergeDetectionsTask(schema=afwTable.SourceTable.makeMinimalSchema(), config=config)
+        self.peakSchema = self.task.merged.getPeakSchema()
+
+    def makeCatalog(self, families):
+        """Make a catalog of parents, one for each family
+
+        @param families: list of lists of the number of bands each peak of a family is detected in,
+            from the brightest peak to the faintest
+        @return the catalog; the x position of each peak is its rank in its family
+        """
+        catalog = afwTable.SourceCatalog(self.task.schema)
+        spans = afwGeom.SpanSet(afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(100, 10)))
+        for nBandsList in families:
+            footprint = afwDetect.Footprint(spans, self.peakSchema)
+            for rank, nBands in enumerate(nBandsList):
+                peak = footprint.addPeak(rank, 0, 100.0 - rank)
+                for band in BANDS[:nBands]:
+                    peak.set("merge_peak_%s" % band, True)
+            catalog.addNew().setFootprint(footprint)
+        return catalog
+
+    def getKeptRanks(self, catalog):
+        return [[int(peak.getFx()) for peak in source.getFootprint().getPeaks()] for source in catalog]
+
+    def cullRecords(self, families):
+        """Return the ranks of the peaks kept by the original per-peak implementation of cullPeaks"""
+        config = self.task.config.cullPeaks
+        kept = []
+        for nBandsList in families:
+            familySize = len(nBandsList)
+            kept.append([rank for rank, nBands in enumerate(nBandsList)
+                         if (rank < config.rankSufficient or
+                             nBands >= config.nBandsSufficient or
+                             (rank < config.rankConsidered and
+                              rank < config.rankNormalizedConsidered*familySize))])
+        return kept
+
+    def testThresholds(self):
+        config = self.task.config.cullPeaks
+        self.assertEqual((config.rankSufficient, config.nBandsSufficient, config.rankConsidered,
+                          config.rankNormalizedConsidered), (20, 2, 30, 0.7))
+        families = [
+            # No more than rankSufficient peaks: all kept, whatever their number of bands
+            [0]*15,
+            [1]*20,
+            # More than rankConsidered/rankNormalizedConsidered peaks: the first rankConsidered are
+            # kept, with those detected in nBandsSufficient bands
+            [1]*40 + [2] + [1]*4 + [3] + [1]*4,
+            # Fewer: those below rankNormalizedConsidered*familySize, or rankSufficient, are kept
+            [1]*25,
+            [1]*35,
+        ]
+        catalog = self.makeCatalog(families)
+        self.task.cullPeaks(catalog)
+        self.assertEqual(self.getKeptRanks(catalog), [
+            list(range(15)),
+            list(range(20)),
+            list(range(30)) + [40, 45],
+            list(range(20)),
+            list(range(25)),
+        ])
+
+    def testDisabled(self):
+        """Test that no peak is culled with nBandsSufficient=1"""
+        self.task.config.cullPeaks.nBandsSufficient = 1
+        families = [[1]*50, [1]*25]
+        catalog = self.makeCatalog(families)
+        self.task.cullPeaks(catalog)
+        self.assertEqual(self.getKeptRanks(catalog), [list(range(50)), list(range(25))])
+
+    def testMatchesPeakLoop(self):
+        rng = np.random.RandomState(12345)
+        families = [list(rng.randint(0, 4, size=size)) for size in rng.randint(1, 80, size=30)]
+        catalog = self.makeCatalog(families)
+        self.task.cullPeaks(catalog)
+        self.assertEqual(self.getKeptRanks(catalog), self.cullRecords(families))
+        # The kept peaks are the original records
+        for source in catalog:
+            for peak in source.getFootprint().getPeaks():
+                self.assertEqual(peak.getPeakValue(), 100.0 - peak.getFx())
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,196 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.table as afwTable
+from lsst.pipe.tasks.mergeMeasurements import MergeMeasurementsConfig, MergeMeasurementsTask
+
+BANDS = ["i", "r", "g"]  # In priority order
+
+
+def mergeRecords(task, catalogs):
+    """Choose the reference band of each source one record at a time
+
+    This is the original implementation of MergeMeasurementsTask.run.
+
+    @return list of the index in BANDS of the reference band of each source
+    """
+    orderedCatalogs = [catalogs[band] for band in BANDS]
+    orderedKeys = [task.flagKeys[band] for band in BANDS]
+    bestBands = []
+    for orderedRecords in zip(*orderedCatalogs):
+        maxSNBand = None
+        maxSN = 0.
+        priorityBand = None
+        prioritySN = 0.
+        hasPseudoFilter = False
+        for band, (inputRecord, flagKeys) in enumerate(zip(orderedRecords, orderedKeys)):
+            parent = (inputRecord.getParent() == 0 and inputRecord.get(flagKeys.footprint))
+            child = (inputRecord.getParent() != 0 and inputRecord.get(flagKeys.peak))
+
+            if not (parent or child):
+                for pseudoFilterKey in task.pseudoFilterKeys:
+                    if inputRecord.get(pseudoFilterKey):
+                        hasPseudoFilter = True
+                        priorityBand = band
+                        break
+                if hasPseudoFilter:
+                    break
+
+            isBad = any(inputRecord.get(flag) for flag in task.badFlags)
+            if isBad or inputRecord.get(task.fluxFlagKey) or inputRecord.get(task.instFluxErrKey) == 0:
+                sn = 0.
+            else:
+                sn = inputRecord.get(task.instFluxKey)/inputRecord.get(task.instFluxErrKey)
+            if np.isnan(sn) or sn < 0.:
+                sn = 0.
+            if (parent or child) and priorityBand is None:
+                priorityBand = band
+                prioritySN = sn
+            if sn > maxSN:
+                maxSNBand = band
+                maxSN = sn
+
+        if hasPseudoFilter:
+            bestBands.append(priorityBand)
+        elif (prioritySN < task.config.minSN and (maxSN - prioritySN) > task.config.minSNDiff and
+              maxSNBand is not None):
+            bestBands.append(maxSNBand)
+        else:
+            bestBands.append(priorityBand)
+    return bestBands
+
+
+class MergeMeasurementsTestCase(lsst.utils.tests.TestCase):
+    """Test the choice of the reference band of each source"""
+
+    def setUp(self):
+        self.schema = afwTable.SourceTable.makeMinimalSchema()
+        self.schema.addField("base_PsfFlux_instFlux", type=np.float64, doc="flux")
+        self.schema.addField("base_PsfFlux_instFluxErr", type=np.float64, doc="flux error")
+        self.schema.addField("base_PsfFlux_flag", type="Flag", doc="flux failed")
+        self.schema.addField("base_PixelFlags_flag_interpolatedCenter", type="Flag", doc="bad pixel")
+        for band in BANDS + ["sky"]:
+            self.schema.addField("merge_peak_%s" % band, type="Flag", doc="peak detected in %s" % band)
+            self.schema.addField("merge_footprint_%s" % band, type="Flag",
+                                 doc="footprint detected in %s" % band)
+        config = MergeMeasurementsConfig()
+        config.priorityList = BANDS
+        self.task = MergeMeasurementsTask(schema=self.schema, config=config)
+
+    def makeCatalogs(self, sources):
+        """Make a catalog for each band
+
+        @param sources: list of dicts of the properties of each source: "parent" (index of the
+            parent in the list, or None), "detected" (bands flagged in merge_peak and
+            merge_footprint), "sn" (dict of S/N by band, 1 if missing) and "bad" (bands with a bad
+            measurement flag set)
+        """
+        catalogs = {}
+        for band in BANDS:
+            catalog = afwTable.SourceCatalog(self.schema)
+            for i, source in enumerate(sources):
+                record = catalog.addNew()
+                record.setId(i + 1)
+                if source.get("parent") is not None:
+                    record.setParent(source["parent"] + 1)
+                for detected in source.get("detected", []):
+                    record.set("merge_peak_%s" % detected, True)
+                    record.set("merge_footprint_%s" % detected, True)
+                sn = source.get("sn", {}).get(band, 1.0)
+                record.set("base_PsfFlux_instFluxErr", 10.0)
+                record.set("base_PsfFlux_instFlux", 10.0*sn)
+                record.set("base_PixelFlags_flag_interpolatedCenter", band in source.get("bad", []))
+            catalogs[band] = catalog
+        return catalogs
+
+    def checkMerge(self, catalogs, bestBands):
+        merged = self.task.run(catalogs).mergedCatalog
+        self.assertEqual(len(merged), len(bestBands))
+        for i, band in enumerate(BANDS):
+            np.testing.assert_array_equal(merged["merge_measurement_%s" % band],
+                                          np.array(bestBands) == i, err_msg=band)
+        for record, bestBand in zip(merged, bestBands):
+            reference = catalogs[BANDS[bestBand]][record.getId() - 1]
+            self.assertEqual(record.getParent(), reference.getParent())
+            self.assertEqual(record.get("base_PsfFlux_instFlux"), reference.get("base_PsfFlux_instFlux"))
+        return merged
+
+    def testReferenceBand(self):
+        sources = [
+            # The priority band, with high S/N
+            dict(detected=["g", "i"], sn=dict(i=20, g=50)),
+            # The highest S/N band, as the S/N in the priority band is low
+            dict(detected=["i", "r", "g"], sn=dict(i=2, r=3, g=50)),
+            # The priority band, as the highest S/N is not much higher
+            dict(detected=["i", "r"], sn=dict(i=2, r=4)),
+            # The highest S/N band, among those that are not flagged as bad
+            dict(detected=["i", "r", "g"], sn=dict(i=2, r=20, g=50), bad=["g"]),
+            # A child uses the peak flags of its own record
+            dict(parent=0, detected=["r"], sn=dict(r=20, i=30)),
+            # Detected only in a pseudo-filter: the first band
+            dict(detected=["sky"], sn=dict(g=50)),
+        ]
+        self.checkMerge(self.makeCatalogs(sources), [0, 2, 0, 1, 1, 0])
+
+    def testMatchesRecordLoop(self):
+        rng = np.random.RandomState(12345)
+        sources = []
+        for i in range(300):
+            source = dict(sn={band: rng.choice([-1.0, 0.0, 1.0, 5.0, 9.0, 15.0, 40.0, np.nan])
+                              for band in BANDS},
+                          bad=[band for band in BANDS if rng.uniform() < 0.1])
+            detected = [band for band in BANDS + ["sky"] if rng.uniform() < 0.4]
+            source["detected"] = detected or [BANDS[rng.randint(len(BANDS))]]
+            if sources and rng.uniform() < 0.4:
+                parents = [j for j, s in enumerate(sources) if s.get("parent") is None]
+                source["parent"] = parents[rng.randint(len(parents))]
+            sources.append(source)
+        catalogs = self.makeCatalogs(sources)
+        # Children without detections in their own peak flags, but with a pseudo-filter peak
+        for catalog in catalogs.values():
+            for record in catalog[::7]:
+                for band in BANDS:
+                    record.set("merge_peak_%s" % band, False)
+                record.set("merge_peak_sky", True)
+        self.checkMerge(catalogs, mergeRecords(self.task, catalogs))
+
+    def testNoReference(self):
+        catalogs = self.makeCatalogs([dict(detected=["i"]), dict(detected=[])])
+        with self.assertRaises(ValueError):
+            self.task.run(catalogs)
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,96 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import lsst.utils.tests
+from lsst.pipe.base import Struct
+
+from lsst.pipe.tasks.multiBandPatch import MultiBandPatchConfig, MultiBandPatchRunner, MultiBandPatchTask
+
+
+class DummyDataRef:
+    """Minimal stand-in for a data reference, providing only a data ID."""
+
+    def __init__(self, **dataId):
+        self.dataId = dataId
+
+
+class MultiBandPatchConfigTestCase(lsst.utils.tests.TestCase):
+    """Test validation of `MultiBandPatchConfig`."""
+
+    def testDefault(self):
+        config = MultiBandPatchConfig()
+        config.validate()
+
+    def testCoaddName(self):
+        config = MultiBandPatchConfig()
+        config.coaddName = "goodSeeing"
+        with self.assertRaises(ValueError):
+            config.validate()
+        for name in ("detectCoaddSources", "mergeCoaddDetections", "deblendCoaddSources",
+                     "measureCoaddSources", "mergeCoaddMeasurements"):
+            getattr(config, name).coaddName = "goodSeeing"
+        config.validate()
+
+    def testSingleMismatch(self):
+        config = MultiBandPatchConfig()
+        config.mergeCoaddMeasurements.coaddName = "goodSeeing"
+        with self.assertRaises(ValueError):
+            config.validate()
+
+
+class MultiBandPatchRunnerTestCase(lsst.utils.tests.TestCase):
+    """Test the grouping of data references into targets."""
+
+    def setUp(self):
+        self.refList = [DummyDataRef(tract=tract, patch=patch, filter=filterName)
+                        for tract in (0, 1) for patch in ("1,1", "1,2") for filterName in ("g", "r", "i")]
+
+    def testRunnerClass(self):
+        self.assertIs(MultiBandPatchTask.RunnerClass, MultiBandPatchRunner)
+
+    def testGetTargetList(self):
+        parsedCmd = Struct(id=Struct(refList=self.refList), psfCache=42)
+        targets = MultiBandPatchRunner.getTargetList(parsedCmd)
+        self.assertEqual(len(targets), 4)
+        for refList, kwargs in targets:
+            self.assertEqual(kwargs, {"psfCache": 42})
+            self.assertEqual(sorted(ref.dataId["filter"] for ref in refList), ["g", "i", "r"])
+            self.assertEqual(len({(ref.dataId["tract"], ref.dataId["patch"]) for ref in refList}), 1)
+
+    def testDuplicate(self):
+        parsedCmd = Struct(id=Struct(refList=self.refList + self.refList[:1]), psfCache=100)
+        with self.assertRaises(RuntimeError):
+            MultiBandPatchRunner.getTargetList(parsedCmd)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -201,6 +201,41 @@ class PhotoCalTest(unittest.TestCase):
         # zeropoint: 32.3145
         self.assertLess(abs(self.zp - (31.3145 + zeroPointOffset)), 0.05)
 
+    def testExtractMagArraysColumnar(self):
+        """Test that reading match columns from the catalogs matches reading the matched records"""
+        task = PhotoCalTask(self.refObjLoader, config=self.config, schema=self.srcCat.schema)
+        filterName = self.exposure.getFilter().getName()
+        matchResults = task.match.run(self.srcCat, filterName)
+        sourceKeys = task.getSourceKeys(self.srcCat.schema)
+        byRecord = task.extractMagArrays(matchResults.matches, filterName, sourceKeys)
+        byColumn = task.extractMagArrays(matchResults.matches, filterName, sourceKeys,
+                                         sourceCat=self.srcCat, refCat=matchResults.refCat)
+        self.assertIsNotNone(task.getMatchedRows(self.srcCat, [m.second for m in matchResults.matches]))
+        for name in ("srcMag", "refMag", "magErr", "srcMagErr", "refMagErr"):
+            np.testing.assert_array_equal(getattr(byRecord, name), getattr(byColumn, name))
+        self.assertEqual(byRecord.refFluxFieldList, byColumn.refFluxFieldList)
+
+    def testZeroPointBatch(self):
+        """Test that solving several exposures at once matches solving each alone"""
+        task = PhotoCalTask(self.refObjLoader, config=self.config, schema=self.srcCat.schema)
+        rng = np.random.RandomState(12345)
+        offsets = {3: 31.2, 7: 30.8, 11: 31.5}
+        groups = rng.choice(list(offsets), size=600)
+        ref = rng.uniform(16, 21, size=len(groups))
+        src = ref - np.array([offsets[g] for g in groups]) + rng.normal(0, 0.02, size=len(groups))
+        src[::50] += 1.0  # outliers
+        srcErr = np.full(len(groups), 0.02)
+
+        batch = task.getZeroPointForEachGroup(src, ref, groups, srcErr)
+        np.testing.assert_array_equal(batch.groups, sorted(offsets))
+        for i, group in enumerate(batch.groups):
+            select = groups == group
+            single = task.getZeroPoint(src[select], ref[select], srcErr[select])
+            self.assertEqual(batch.zp[i], single.zp)
+            self.assertEqual(batch.sigma[i], single.sigma)
+            self.assertEqual(batch.ngood[i], single.ngood)
+            self.assertAlmostEqual(single.zp, offsets[group], places=2)
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
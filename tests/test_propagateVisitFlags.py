@@ -0,0 +1,211 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.pipe.tasks.propagateVisitFlags import PropagateVisitFlagsConfig, PropagateVisitFlagsTask
+
+FLAGS = {"calib_psf_used": 0.2, "calib_astrometry_used": 0.5}
+CENTER = afwGeom.SpherePoint(10, 20, afwGeom.degrees)
+SCALE = 0.2*afwGeom.arcseconds
+COADD_DIMS = afwGeom.Extent2I(2000, 2000)
+CCD_DIMS = afwGeom.Extent2I(1000, 2000)
+# Offset of each input CCD in the coadd pixel frame, indexed by (visit, ccd)
+CCD_OFFSETS = {(1, 0): (0, 0), (1, 1): (1000, 0), (2, 0): (300, 0), (2, 1): (1300, 0)}
+
+
+def makeSchema(flags=()):
+    schema = afwTable.SourceTable.makeMinimalSchema()
+    afwTable.Point2DKey.addFields(schema, "centroid", "centroid", "pixel")
+    schema.addField("centroid_flag", type="Flag", doc="centroid failed")
+    schema.getAliasMap().set("slot_Centroid", "centroid")
+    for flag in flags:
+        schema.addField(flag, type="Flag", doc="flag to propagate")
+    return schema
+
+
+def makeWcs(offset=(0, 0)):
+    """Make a Wcs for a CCD whose origin is at offset in the coadd pixel frame"""
+    crpix = afwGeom.Point2D(afwGeom.Extent2D(COADD_DIMS)*0.5) - afwGeom.Extent2D(*offset)
+    return afwGeom.makeSkyWcs(crpix=crpix, crval=CENTER, cdMatrix=afwGeom.makeCdMatrix(scale=SCALE))
+
+
+def propagateRecords(config, coaddSources, ccdInputs, coaddWcs, visitCatalogs, wcsUpdates):
+    """Compute the propagated flags by matching each input catalog and flag separately
+
+    This is the original implementation of PropagateVisitFlagsTask.run; the input catalogs are
+    modified in place.
+
+    @return dict of flag name: list of the values of the flag for each coadd source
+    """
+    counts = dict((f, np.zeros(len(coaddSources), dtype=int)) for f in config.flags)
+    indices = np.array([s.getId() for s in coaddSources])
+    radius = config.matchRadius*afwGeom.arcseconds
+    for ccdSources, wcsUpdate in zip(visitCatalogs, wcsUpdates):
+        for sourceRecord in ccdSources:
+            sourceRecord.updateCoord(wcsUpdate)
+        for flag in config.flags:
+            mc = afwTable.MatchControl()
+            mc.findOnlyClosest = False
+            matches = afwTable.matchRaDec(coaddSources, ccdSources[ccdSources.get(flag)], radius, mc)
+            for m in matches:
+                index = (np.where(indices == m.first.getId()))[0][0]
+                counts[flag][index] += 1
+    numOverlaps = [len(ccdInputs.subsetContaining(s.getCentroid(), coaddWcs, True)) for s in coaddSources]
+    return dict((f, [bool(num > overlaps*config.flags[f]) for num, overlaps in zip(counts[f], numOverlaps)])
+                for f in config.flags)
+
+
+class StubButler:
+    """Butler providing the input source catalogs, indexed by (visit, ccd)"""
+
+    def __init__(self, catalogs):
+        self.catalogs = catalogs
+        self.gets = []
+
+    def get(self, datasetType, dataId, flags=0, immediate=False):
+        assert datasetType == "src"
+        self.gets.append((dataId, flags))
+        return self.catalogs[(dataId["visit"], dataId["ccd"])].copy(deep=True)
+
+
+class PropagateVisitFlagsTestCase(lsst.utils.tests.TestCase):
+    """Test the flags propagated by PropagateVisitFlagsTask against those of the per-visit matching"""
+
+    def setUp(self):
+        self.rng = np.random.RandomState(12345)
+        config = PropagateVisitFlagsConfig()
+        config.flags = FLAGS
+        self.task = PropagateVisitFlagsTask(makeSchema(), config=config)
+        self.coaddWcs = makeWcs()
+
+        ccdSchema = afwTable.ExposureTable.makeMinimalSchema()
+        ccdSchema.addField("ccd", type=np.int32, doc="CCD number")
+        ccdSchema.addField("visit", type=np.int64, doc="visit number")
+        self.ccdInputs = afwTable.ExposureCatalog(ccdSchema)
+        for (visit, ccd), offset in sorted(CCD_OFFSETS.items()):
+            record = self.ccdInputs.addNew()
+            record.set("visit", visit)
+            record.set("ccd", ccd)
+            record.setWcs(makeWcs(offset))
+            record.setBBox(afwGeom.Box2I(afwGeom.Point2I(0, 0), CCD_DIMS))
+
+        positions = [afwGeom.Point2D(x, y) for x, y in self.rng.uniform(0, 2000, size=(300, 2))]
+        # A pair of sources closer than the matching radius, both matching the same input sources
+        positions += [afwGeom.Point2D(500, 500), afwGeom.Point2D(500.5, 500)]
+        self.coaddSources = afwTable.SourceCatalog(self.task.schema)
+        for i, position in enumerate(positions):
+            source = self.coaddSources.addNew()
+            source.setId(i + 1)
+            source.set("centroid", position)
+            source.setCoord(self.coaddWcs.pixelToSky(position))
+
+        visitSchema = makeSchema(FLAGS)
+        self.visitCatalogs = {}
+        for (visit, ccd), offset in CCD_OFFSETS.items():
+            catalog = afwTable.SourceCatalog(visitSchema)
+            bbox = afwGeom.Box2D(afwGeom.Box2I(afwGeom.Point2I(0, 0), CCD_DIMS))
+            for position in positions:
+                ccdPosition = position - afwGeom.Extent2D(*offset) + afwGeom.Extent2D(
+                    *self.rng.uniform(-0.3, 0.3, size=2))
+                if not bbox.contains(ccdPosition):
+                    continue
+                source = catalog.addNew()
+                source.set("centroid", ccdPosition)
+                source.setCoord(CENTER)  # To be updated from the Wcs
+                for flag in FLAGS:
+                    source.set(flag, bool(self.rng.uniform() < 0.4))
+            # Flagged sources at random positions, mostly without a counterpart in the coadd
+            for position in self.rng.uniform(0, 1000, size=(10, 2)):
+                source = catalog.addNew()
+                source.set("centroid", afwGeom.Point2D(*position))
+                for flag in FLAGS:
+                    source.set(flag, True)
+            self.visitCatalogs[(visit, ccd)] = catalog
+
+    def getExpected(self):
+        keys = [(record.get("visit"), record.get("ccd")) for record in self.ccdInputs]
+        expected = propagateRecords(self.task.config, self.coaddSources, self.ccdInputs, self.coaddWcs,
+                                    [self.visitCatalogs[key].copy(deep=True) for key in keys],
+                                    [record.getWcs() for record in self.ccdInputs])
+        for flag in FLAGS:
+            self.assertGreater(sum(expected[flag]), 0)
+            self.assertLess(sum(expected[flag]), len(self.coaddSources))
+        return expected
+
+    def checkFlags(self, expected):
+        for flag in FLAGS:
+            self.assertEqual([source.get(flag) for source in self.coaddSources], expected[flag], msg=flag)
+
+    def testVisitCatalogs(self):
+        expected = self.getExpected()
+        keys = [(record.get("visit"), record.get("ccd")) for record in self.ccdInputs]
+        visitCatalogs = [self.visitCatalogs[key].copy(deep=True) for key in keys]
+        self.task.run(None, self.coaddSources, self.ccdInputs, self.coaddWcs, visitCatalogs=visitCatalogs,
+                      wcsUpdates=[record.getWcs() for record in self.ccdInputs])
+        self.checkFlags(expected)
+        # The coordinates of the input catalogs are updated
+        for catalog, record in zip(visitCatalogs, self.ccdInputs):
+            for source in catalog:
+                expectedCoord = record.getWcs().pixelToSky(source.getCentroid())
+                self.assertLess(source.getCoord().separation(expectedCoord).asArcseconds(), 1.0e-6)
+
+    def testButler(self):
+        expected = self.getExpected()
+        butler = StubButler(self.visitCatalogs)
+        self.task.run(butler, self.coaddSources, self.ccdInputs, self.coaddWcs)
+        self.checkFlags(expected)
+        self.assertEqual(butler.gets, [({"visit": record.get("visit"), "ccd": record.get("ccd")},
+                                        afwTable.SOURCE_IO_NO_FOOTPRINTS) for record in self.ccdInputs])
+
+    def testNonContiguous(self):
+        """Test a non-contiguous coadd catalog and input catalogs"""
+        subset = self.coaddSources[::2]
+        self.assertFalse(subset.isContiguous())
+        self.coaddSources = subset
+        keys = [(record.get("visit"), record.get("ccd")) for record in self.ccdInputs]
+        visitCatalogs = [self.visitCatalogs[key].copy(deep=True)[::3] for key in keys]
+        self.assertFalse(visitCatalogs[0].isContiguous())
+        referenceCatalogs = [self.visitCatalogs[key][::3].copy(deep=True) for key in keys]
+        wcsUpdates = [record.getWcs() for record in self.ccdInputs]
+        expected = propagateRecords(self.task.config, subset, self.ccdInputs, self.coaddWcs,
+                                    referenceCatalogs, wcsUpdates)
+        self.task.run(None, subset, self.ccdInputs, self.coaddWcs, visitCatalogs=visitCatalogs,
+                      wcsUpdates=wcsUpdates)
+        self.checkFlags(expected)
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,115 @@
+# This file is part of pipe_tasks.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.skymap import DodecaSkyMap, RingsSkyMap
+from lsst.pipe.tasks.setPrimaryFlags import SetPrimaryFlagsTask
+
+
+class SetPrimaryFlagsTestCase(lsst.utils.tests.TestCase):
+    """Test the inner flags set by SetPrimaryFlagsTask against those of a per-source loop"""
+
+    def setUp(self):
+        self.rng = np.random.RandomState(12345)
+        self.schema = afwTable.SourceTable.makeMinimalSchema()
+        afwTable.Point2DKey.addFields(self.schema, "centroid", "centroid", "pixel")
+        self.schema.addField("centroid_flag", type="Flag", doc="centroid failed")
+        self.schema.getAliasMap().set("slot_Centroid", "centroid")
+        self.schema.addField("deblend_nChild", type=np.int32, doc="number of children")
+        self.task = SetPrimaryFlagsTask(schema=self.schema)
+
+    def makeSources(self, skyMap, tractInfo, num=500, radius=None):
+        """Make sources around the center of a tract, extending over its neighbors"""
+        if radius is None:
+            radius = 2.0*min(tractInfo.getCtrCoord().separation(tract.getCtrCoord())
+                             for tract in skyMap if tract.getId() != tractInfo.getId())
+            radius = min(radius, 60*afwGeom.degrees)
+        sources = afwTable.SourceCatalog(self.schema)
+        wcs = tractInfo.getWcs()
+        center = tractInfo.getCtrCoord()
+        for bearing, distance in zip(self.rng.uniform(0, 360, num), self.rng.uniform(0, 1, num)):
+            coord = center.offset(bearing*afwGeom.degrees, np.sqrt(distance)*radius)
+            source = sources.addNew()
+            source.setCoord(coord)
+            source.set("centroid", wcs.skyToPixel(coord))
+        return sources
+
+    def checkTractInner(self, skyMap, tractInfo):
+        sources = self.makeSources(skyMap, tractInfo)
+        patchInfo = tractInfo.getPatchInfo((0, 0))
+        expected = np.array([skyMap.findTract(source.getCoord()).getId() == tractInfo.getId()
+                             for source in sources])
+        self.assertGreater(expected.sum(), 0)
+        self.assertLess(expected.sum(), len(sources))
+
+        self.task.run(sources, skyMap, tractInfo, patchInfo)
+        np.testing.assert_array_equal(sources["detect_isTractInner"], expected)
+
+        # A non-contiguous catalog has the flags set on its own records
+        sources["detect_isTractInner"] = np.zeros(len(sources), dtype=bool)
+        subset = sources[::2]
+        self.assertFalse(subset.isContiguous())
+        self.task.run(subset, skyMap, tractInfo, patchInfo)
+        np.testing.assert_array_equal([source.get("detect_isTractInner") for source in sources],
+                                      expected & (np.arange(len(sources)) % 2 == 0))
+        innerBBox = afwGeom.Box2D(patchInfo.getInnerBBox())
+        isPatchInner = [innerBBox.contains(source.getCentroid()) for source in subset]
+        np.testing.assert_array_equal([source.get("detect_isPatchInner") for source in subset],
+                                      isPatchInner)
+
+    def testRingsSkyMap(self):
+        config = RingsSkyMap.ConfigClass()
+        config.numRings = 11
+        skyMap = RingsSkyMap(config)
+        ringNums = {}
+        for tractInfo in skyMap:
+            ringNums.setdefault(skyMap.getRingIndices(tractInfo.getId())[0], []).append(tractInfo)
+        # Polar caps, tracts next to the wrap in right ascension and tracts in the middle of rings
+        for ringNum in (-1, 0, 5, config.numRings - 1, config.numRings):
+            for tractInfo in (ringNums[ringNum][0], ringNums[ringNum][-1],
+                              ringNums[ringNum][len(ringNums[ringNum])//2]):
+                with self.subTest(tract=tractInfo.getId()):
+                    self.checkTractInner(skyMap, tractInfo)
+
+    def testDodecaSkyMap(self):
+        skyMap = DodecaSkyMap()
+        for tractInfo in (skyMap[0], skyMap[5], skyMap[11]):
+            with self.subTest(tract=tractInfo.getId()):
+                self.checkTractInner(skyMap, tractInfo)
+
+
+class MatchMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
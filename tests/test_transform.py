@@ -55,7 +55,9 @@ import lsst.utils.tests
 from lsst.pipe.tasks.multiBand import MeasureMergedCoaddSourcesConfig
 from lsst.pipe.tasks.processCcd import ProcessCcdTask, ProcessCcdConfig
 from lsst.pipe.tasks.transformMeasurement import (TransformConfig, TransformTask, SrcTransformTask,
-                                                  RunTransformConfig, CoaddSrcTransformTask)
+                                                  RunTransformConfig, CoaddSrcTransformTask,
+                                                  RunTransformTaskRunner, catalogToArrow, havePyArrow)
+from lsst.pipe.base import Struct
 
 PLUGIN_NAME = "base_TrivialMeasurement"
 
@@ -201,6 +203,40 @@ class TransformTestCase(lsst.utils.tests.TestCase):
                                       config=transformConfig)
         self._transformAndCheck(forcedConfig, forcedTask.schema, transformTask)
 
+    def testRunBatch(self):
+        """Test transforming several catalogs at once, and conversion to Arrow."""
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        sfmConfig = measBase.SingleFrameMeasurementConfig(plugins=[PLUGIN_NAME])
+        for key in sfmConfig.slots:
+            setattr(sfmConfig.slots, key, None)
+        sfmTask = measBase.SingleFrameMeasurementTask(schema, config=sfmConfig)
+        transformTask = TransformTask(measConfig=sfmConfig,
+                                      inputSchema=sfmTask.schema, outputDataset="src")
+        inputs = []
+        for numSources in (1, 3):
+            inCat = afwTable.SourceCatalog(sfmTask.schema)
+            for i in range(numSources):
+                r = inCat.addNew()
+                r.setCoord(afwGeom.SpherePoint(0.0, 11.19, afwGeom.degrees))
+                r[PLUGIN_NAME] = float(i)
+            inputs.append((inCat, Placeholder(), Placeholder()))
+
+        outCats = transformTask.runBatch(inputs)
+        self.assertEqual(len(outCats), len(inputs))
+        for (inCat, wcs, photoCalib), outCat in zip(inputs, outCats):
+            self.assertEqual(len(outCat), len(inCat))
+            self.assertTrue(outCat.isContiguous())
+            for inSrc, outSrc in zip(inCat, outCat):
+                self.assertEqual(outSrc[PLUGIN_NAME + "_transform"], inSrc[PLUGIN_NAME] * -1.0)
+            self.assertEqual(wcs.count, len(transformTask.transforms))
+
+        if not havePyArrow:
+            return
+        table = catalogToArrow(outCats[1])
+        self.assertEqual(table.num_rows, len(outCats[1]))
+        self.assertEqual(table.column_names, [item.field.getName() for item in outCats[1].schema])
+        self.assertEqual(table.column(PLUGIN_NAME + "_transform").to_pylist(), [-0.0, -1.0, -2.0])
+
 
 @contextlib.contextmanager
 def tempDirectory(*args, **kwargs):
@@ -250,6 +286,19 @@ class RunTransformTestCase(lsst.utils.tests.TestCase):
             # configuration/metadata persistence.
             trResult = SrcTransformTask.parseAndRun(args=trArgs, doReturnResults=True)
 
+            # A batch of data references is transformed by a single task, which also writes the
+            # metadata of each of them; the result is a list of catalogs.
+            batchArgs = trArgs + ["-c", "batchSize=2", "doWriteParquet=%s" % havePyArrow]
+            batchResult = SrcTransformTask.parseAndRun(args=batchArgs, doReturnResults=True)
+            self.assertEqual(len(batchResult.resultList), 1)
+            batchSrcs = batchResult.resultList[0].result
+            self.assertEqual(len(batchSrcs), 1)
+            self.assertEqual(len(batchSrcs[0]), len(trResult.resultList[0].result))
+            if havePyArrow:
+                parquetPath = os.path.splitext(batchResult.parsedCmd.butler.getUri(
+                    "transformed_src", visit=1))[0] + ".parquet"
+                self.assertTrue(os.path.exists(parquetPath))
+
         measSrcs = measResult.resultList[0].result.calibRes.sourceCat
         trSrcs = trResult.resultList[0].result
 
@@ -271,6 +320,25 @@ class RunTransformTestCase(lsst.utils.tests.TestCase):
             self.assertAlmostEqual(measSrc.getCoord().getLatitude(), trCoord.getLatitude())
 
 
+class RunTransformTaskRunnerTestCase(lsst.utils.tests.TestCase):
+    """Test the grouping of data references into batches."""
+
+    def makeParsedCmd(self, batchSize, numRefs):
+        config = RunTransformConfig()
+        config.batchSize = batchSize
+        return Struct(config=config, id=Struct(refList=list(range(numRefs))))
+
+    def testSingle(self):
+        """Check that each target is a single data reference if batchSize is 1."""
+        targets = RunTransformTaskRunner.getTargetList(self.makeParsedCmd(1, 3), foo=1)
+        self.assertEqual(targets, [(0, {"foo": 1}), (1, {"foo": 1}), (2, {"foo": 1})])
+
+    def testBatch(self):
+        """Check that data references are split into batches of at most batchSize."""
+        targets = RunTransformTaskRunner.getTargetList(self.makeParsedCmd(2, 5))
+        self.assertEqual([refList for refList, kwargs in targets], [[0, 1], [2, 3], [4]])
+
+
 class CoaddTransformTestCase(lsst.utils.tests.TestCase):
     """Check that CoaddSrcTransformTask is set up properly.
 
@@ -332,6 +400,55 @@ class CoaddTransformTestCase(lsst.utils.tests.TestCase):
         """Check that we have correctly derived the type of the measurement images."""
         self.assertEqual(self.transformTask.calexpType, self.coaddName + self.CALEXP_SUFFIX)
 
+    def testReadCalibration(self):
+        """Check that an error reading one exposure does not disable component reads."""
+        calexpType = self.transformTask.calexpType
+        wcs, photoCalib = Placeholder(), Placeholder()
+        good = CalibrationDataRef(**{calexpType + "_wcs": wcs, calexpType + "_photoCalib": photoCalib})
+        bad = CalibrationDataRef(**{calexpType + "_wcs": RuntimeError("corrupt file")})
+        self.assertEqual(self.transformTask.readCalibration(good), (wcs, photoCalib))
+        with self.assertRaises(RuntimeError):
+            self.transformTask.readCalibration(bad)
+        self.assertEqual(self.transformTask.readCalibration(good), (wcs, photoCalib))
+
+    def testReadCalibrationFullExposure(self):
+        """Check that full exposures are read if the Butler has no component datasets."""
+        calexpType = self.transformTask.calexpType
+        calexp = CalibratedExposure()
+        dataRef = CalibrationDataRef(**{calexpType + "_wcs": AttributeError("no map_" + calexpType + "_wcs"),
+                                        calexpType: calexp})
+        self.assertEqual(self.transformTask.readCalibration(dataRef), (calexp.wcs, calexp.photoCalib))
+        # Components are not tried again
+        del dataRef.datasets[calexpType + "_wcs"]
+        self.assertEqual(self.transformTask.readCalibration(dataRef), (calexp.wcs, calexp.photoCalib))
+
+
+class CalibrationDataRef:
+    """Quacks like a data reference, returning or raising the given objects."""
+
+    def __init__(self, **datasets):
+        self.datasets = datasets
+
+    def get(self, datasetType):
+        value = self.datasets[datasetType]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+class CalibratedExposure:
+    """Quacks like an exposure, for reading its calibration."""
+
+    def __init__(self):
+        self.wcs = Placeholder()
+        self.photoCalib = Placeholder()
+
+    def getWcs(self):
+        return self.wcs
+
+    def getPhotoCalib(self):
+        return self.photoCalib
+
 
 class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
     pass
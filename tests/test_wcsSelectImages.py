@@ -20,12 +20,19 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import multiprocessing
+import os
+import pickle
+import tempfile
 import unittest
+import unittest.mock
 
 import lsst.utils.tests
 import lsst.afw.geom as afwGeom
-from lsst.pipe.tasks.selectImages import WcsSelectImagesTask, SelectStruct
-from lsst.pipe.tasks.coaddBase import CoaddBaseTask
+import lsst.pipe.tasks.selectImages
+from lsst.pipe.tasks.selectImages import (WcsSelectImagesTask, WcsSelectImagesConfig, SelectStruct,
+                                          ImageFootprintIndex)
+from lsst.pipe.tasks.coaddBase import CoaddBaseTask, getSkyInfo
 
 
 class KeyValue:
@@ -87,6 +94,9 @@ class DummyDataRef:
     def get(self, dataType):
         return self._data[dataType]
 
+    def getUri(self, dataType):
+        return self._data[dataType + "_uri"]
+
 
 # Common defaults for createPatch and createImage
 CENTER = afwGeom.SpherePoint(0, 90, afwGeom.degrees)
@@ -128,8 +138,20 @@ def createImage(
                                                                  afwGeom.Extent2I(dims[0], dims[1])))
 
 
+def selectInProcess(filename, names):
+    """Add the footprints of images to an index file, as a coadd worker process would"""
+    lsst.pipe.tasks.selectImages._footprintIndexCache.clear()
+    config = WcsSelectImagesConfig()
+    config.footprintIndexFile = filename
+    selectDataList = [createImage(dataId={"name": name}, rotateAngle=i*SCALE) for i, name in enumerate(names)]
+    WcsSelectImagesTask(config=config).getFootprintIndex(selectDataList)
+
+
 class WcsSelectImagesTestCase(unittest.TestCase):
 
+    def tearDown(self):
+        lsst.pipe.tasks.selectImages._footprintIndexCache.clear()
+
     def check(self, patchRef, selectData, doesOverlap):
         config = CoaddBaseTask.ConfigClass()
         config.select.retarget(WcsSelectImagesTask)
@@ -156,6 +178,130 @@ class WcsSelectImagesTestCase(unittest.TestCase):
         self.check(createPatch(), createImage(rotateAngle=0.5*afwGeom.Extent2D(DIMS).computeNorm()*SCALE),
                    True)
 
+    def testFootprintIndex(self):
+        """Test that the footprint index finds the same images as a direct test, and survives persistence"""
+        task = WcsSelectImagesTask()
+        selectDataList = [createImage(dataId={"name": "identical"}),
+                          createImage(dataId={"name": "intersect"},
+                                      rotateAngle=0.5*afwGeom.Extent2D(DIMS).computeNorm()*SCALE),
+                          createImage(dataId={"name": "disjoint"},
+                                      center=afwGeom.SpherePoint(0, -90, afwGeom.degrees))]
+        index = ImageFootprintIndex()
+        for data in selectDataList:
+            index.add(data.dataRef.dataId, task.getImageCorners(data))
+
+        patchRef = createPatch()
+        skyInfo = getSkyInfo("deep", patchRef)
+        coordList = [skyInfo.wcs.pixelToSky(pos) for pos in afwGeom.Box2D(skyInfo.bbox).getCorners()]
+        self.assertEqual(index.query(coordList), [0, 1])
+        self.assertEqual(index.query(None), [0, 1, 2])
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            filename = os.path.join(tempDir, "footprints.pickle")
+            index.write(filename)
+            restored = ImageFootprintIndex.read(filename)
+        self.assertEqual(restored.query(coordList), [0, 1])
+        self.assertEqual(restored.find({"name": "disjoint"}), 2)
+        for imageIndex in range(len(index)):
+            for coord, restoredCoord in zip(index.getCoordList(imageIndex),
+                                            restored.getCoordList(imageIndex)):
+                self.assertLess(coord.separation(restoredCoord).asArcseconds(), 1.0e-6)
+
+    def testFootprintIndexFile(self):
+        """Test that footprints in the index file are reused, unless the calexp has changed"""
+        patchRef = createPatch()
+        skyInfo = getSkyInfo("deep", patchRef)
+        coordList = [skyInfo.wcs.pixelToSky(pos) for pos in afwGeom.Box2D(skyInfo.bbox).getCorners()]
+        dataId = {"name": "moving"}
+        farAway = afwGeom.SpherePoint(0, -90, afwGeom.degrees)
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            calexpPath = os.path.join(tempDir, "calexp.fits")
+            config = WcsSelectImagesConfig()
+            config.footprintIndexFile = os.path.join(tempDir, "footprints.pickle")
+
+            def select(selectData, calexpContents=None):
+                if calexpContents is not None:
+                    with open(calexpPath, "w") as f:
+                        f.write(calexpContents)
+                selectData.dataRef._data["calexp_uri"] = calexpPath
+                # Each selection is made as if by a new process
+                lsst.pipe.tasks.selectImages._footprintIndexCache.clear()
+                index, imageIndices = WcsSelectImagesTask(config=config).getFootprintIndex([selectData])
+                self.assertEqual(imageIndices, [0])
+                return index.query(coordList)
+
+            self.assertEqual(select(createImage(dataId=dataId), "original"), [0])
+            # Footprints of unchanged calexps are read from the file rather than recomputed
+            self.assertEqual(select(createImage(dataId=dataId, center=farAway)), [0])
+            # A changed calexp invalidates the stored footprint
+            self.assertEqual(select(createImage(dataId=dataId, center=farAway), "reprocessed"), [])
+            self.assertEqual(len(ImageFootprintIndex.read(config.footprintIndexFile)), 1)
+            # The index is replaced atomically, leaving no temporary files behind
+            self.assertEqual(sorted(os.listdir(tempDir)),
+                             ["calexp.fits", "footprints.pickle", "footprints.pickle.lock"])
+
+    def testFootprintIndexReuse(self):
+        """Test that footprints are not recomputed for later patches, nor when read from the index file"""
+        patchRef = createPatch()
+        skyInfo = getSkyInfo("deep", patchRef)
+        coordList = [skyInfo.wcs.pixelToSky(pos) for pos in afwGeom.Box2D(skyInfo.bbox).getCorners()]
+        selectDataList = [createImage(dataId={"name": "near%d" % i}, rotateAngle=100*i*SCALE)
+                          for i in range(5)]
+        selectDataList += [createImage(dataId={"name": "far%d" % i}, rotateAngle=(90 - i)*afwGeom.degrees)
+                           for i in range(50)]
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            config = WcsSelectImagesConfig()
+            config.footprintIndexFile = os.path.join(tempDir, "footprints.pickle")
+            for data in selectDataList:
+                data.dataRef._data["calexp_uri"] = os.path.join(tempDir, "missing.fits")
+            task = WcsSelectImagesTask(config=config)
+            selected = task.runDataRef(patchRef, coordList, selectDataList=selectDataList).dataRefList
+            self.assertEqual([ref.dataId["name"] for ref in selected], ["near%d" % i for i in range(5)])
+
+            # The selectDataList of a later patch, as received by a worker process, hits the cache
+            # without checking the calexps or recomputing any footprint
+            noCall = unittest.mock.Mock(side_effect=AssertionError("unexpected call"))
+            with unittest.mock.patch.object(lsst.pipe.tasks.selectImages, "_calexpFingerprint", noCall), \
+                    unittest.mock.patch.object(WcsSelectImagesTask, "getImageCorners", noCall):
+                pickled = pickle.loads(pickle.dumps(selectDataList))
+                selected = task.runDataRef(patchRef, coordList, selectDataList=pickled).dataRefList
+            self.assertEqual(len(selected), 5)
+
+            # Reading the index file in another process computes no footprint, and only the
+            # polygons of the candidates of a query are built
+            lsst.pipe.tasks.selectImages._footprintIndexCache.clear()
+            with unittest.mock.patch.object(WcsSelectImagesTask, "getImageCorners", noCall):
+                index, imageIndices = task.getFootprintIndex(selectDataList)
+            self.assertEqual(sum(polygon is not None for polygon in index._polygons), 0)
+            self.assertEqual(index.query(coordList), imageIndices[:5])
+            self.assertLess(sum(polygon is not None for polygon in index._polygons), len(selectDataList)//2)
+
+    def testEmptySelection(self):
+        """Test that nothing is selected from an empty selectDataList, even with an index file"""
+        patchRef = createPatch()
+        skyInfo = getSkyInfo("deep", patchRef)
+        coordList = [skyInfo.wcs.pixelToSky(pos) for pos in afwGeom.Box2D(skyInfo.bbox).getCorners()]
+        with tempfile.TemporaryDirectory() as tempDir:
+            config = WcsSelectImagesConfig()
+            config.footprintIndexFile = os.path.join(tempDir, "footprints.pickle")
+            selectInProcess(config.footprintIndexFile, ["identical"])
+            result = WcsSelectImagesTask(config=config).runDataRef(patchRef, coordList, selectDataList=[])
+        self.assertEqual(result.dataRefList, [])
+        self.assertEqual(result.exposureInfoList, [])
+
+    def testConcurrentUpdates(self):
+        """Test that processes adding footprints to the same index file do not lose each other's"""
+        nameLists = [["proc%d_image%d" % (proc, i) for i in range(10)] for proc in range(4)]
+        with tempfile.TemporaryDirectory() as tempDir:
+            filename = os.path.join(tempDir, "footprints.pickle")
+            with multiprocessing.get_context("fork").Pool(4) as pool:
+                pool.starmap(selectInProcess, [(filename, names) for names in nameLists])
+            index = ImageFootprintIndex.read(filename)
+        self.assertEqual(sorted(dataId["name"] for dataId in index.dataIds),
+                         sorted(name for names in nameLists for name in names))
+
 
 class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
     pass